@@ -0,0 +1,407 @@
+import argparse
+from contextlib import ExitStack
+from datetime import datetime, timedelta, timezone
+import importlib.metadata
+import json
+import os
+import platform
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from build.github_fixtures import FixtureServer, generate_github_fixtures, get_pull_request_period, load_fixtures, write_fixtures
+from build.synthetic_repository import DEFAULT_COMMIT_INTERVAL, DEFAULT_START_DATE, generate_repository
+
+REPORT_SCHEMA_VERSION = 1
+DEFAULT_OUTPUT_DIR = "Exports/benchmarks"
+DEFAULT_REPOSITORY = "benchmark/synthetic"
+DEFAULT_REGRESSION_THRESHOLD = 0.1
+
+SCALES = {
+    "small": {"commits": 50, "files": 20, "lines_per_file": 100, "doc_files": 2, "guideline_sentences": 5, "pull_requests": 20, "events_per_pull": 8},
+    "medium": {"commits": 200, "files": 50, "lines_per_file": 200, "doc_files": 3, "guideline_sentences": 10, "pull_requests": 100, "events_per_pull": 12},
+    "large": {"commits": 1000, "files": 200, "lines_per_file": 300, "doc_files": 5, "guideline_sentences": 20, "pull_requests": 500, "events_per_pull": 15},
+}
+
+# Items processed by a stage, whose number per second is its throughput
+STAGE_ITEMS = {
+    "local_extraction": "commits",
+    "remote_extraction": "pull_requests",
+    "ocel_export": "events",
+    "code_quality_plot": "commits",
+    "flattening": "events",
+    "petri_net_discovery": "pull_requests",
+}
+
+PACKAGES = ["pm4py", "pydriller", "pymongo", "mongomock", "radon", "matplotlib", "pylint", "aiohttp", "pandas", "numpy"]
+
+class MongodProcess:
+    """
+    Throwaway MongoDB server in a temporary directory, listening on a free local port.
+    """
+    def __init__(self, executable: str, db_path: str):
+        self.executable = executable
+        self.db_path = db_path
+        self.uri = None
+        self._process = None
+
+    def __enter__(self):
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            port = probe.getsockname()[1]
+        os.makedirs(self.db_path, exist_ok=True)
+        self._process = subprocess.Popen(
+            [self.executable, "--dbpath", self.db_path, "--bind_ip", "127.0.0.1", "--port", str(port), "--quiet"],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL
+        )
+        deadline = time.time() + 30
+        while time.time() < deadline:
+            if self._process.poll() is not None:
+                raise Exception(f"MongoDB server {self.executable} exited with code {self._process.returncode}")
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=1).close()
+                break
+            except OSError:
+                time.sleep(0.2)
+        else:
+            self.__exit__(None, None, None)
+            raise Exception(f"MongoDB server {self.executable} did not start within 30 seconds")
+        self.uri = f"mongodb://127.0.0.1:{port}/"
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._process.terminate() # type: ignore
+        try:
+            self._process.wait(timeout=10) # type: ignore
+        except subprocess.TimeoutExpired:
+            self._process.kill() # type: ignore
+            self._process.wait() # type: ignore
+
+def run_stages(config: dict) -> dict:
+    """
+    Run the pipeline on a synthetic repository and record its stages. Called in a fresh process per run,
+    such that peak memory, caches and module state of one run do not distort another.
+    Args:
+        config (dict): The configuration of the run, see `run_benchmark`.
+    Returns:
+        dict: The recorded stages, the numbers of objects by type and of events, the MongoDB version and the peak memory of the process.
+    """
+    import main
+    from build import database_handler
+    from build.instrumentation import CountingMongoClient, StageRecorder
+
+    collection = os.path.basename(config["repo_path"])
+    if config["memory_database"]:
+        from build.memory_database import create_memory_client
+        client = CountingMongoClient(create_memory_client())
+    else:
+        client = CountingMongoClient(database_handler.myclient)
+    database_handler.set_client(client)
+    client.drop_database(collection)
+
+    with StageRecorder(keep_going=True) as recorder:
+        main.run_pipeline(
+            config["repo_path"],
+            config["api_url"],
+            datetime.fromisoformat(config["from_date"]),
+            datetime.fromisoformat(config["to_date"]),
+            [".py"],
+            workers=config["workers"],
+            resume=False,
+            split_date=datetime.fromisoformat(config["split_date"]),
+            view=False
+        )
+    database_handler.flush_ocel_writes(collection)
+
+    ocdb = client[collection]
+    objects = {group["_id"]: group["count"] for group in ocdb["objects"].aggregate([{"$group": {"_id": "$type", "count": {"$sum": 1}}}])}
+    return {
+        "stages": recorder.stages,
+        "counts": {"objects": objects, "events": ocdb["events"].count_documents({})},
+        "mongo_version": f"mongomock-{importlib.metadata.version('mongomock')}" if config["memory_database"] else client.server_info().get("version"),
+        "peak_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024),
+    }
+
+def _add_throughput(stages: list, items: dict):
+    for result in stages:
+        item = STAGE_ITEMS.get(result["name"])
+        if item is None or result["status"] != "ok":
+            continue
+        result["items"] = item
+        result["item_count"] = items[item]
+        result["items_per_second"] = items[item] / result["wall_seconds"] if result["wall_seconds"] > 0 else None
+
+def run_benchmark(name: str, parameters: dict, run_dir: str, mongo_uri: str, workers=None, seed: int = 0, recorded_fixtures=None) -> dict:
+    """
+    Generate a synthetic repository and GitHub fixtures of a size and run the pipeline on them in a child process.
+    Args:
+        name (str): The name of the scale.
+        parameters (dict): The size of the repository and the fixtures, see `SCALES`.
+        run_dir (str): The working directory of the run, which holds the repository, fixtures and exports.
+        mongo_uri (str): The URI of the MongoDB server to use, or None to use an in-memory database.
+        workers (int): The number of processes analysing the code quality.
+        seed (int): The seed of the generated repository and fixtures.
+        recorded_fixtures (dict): Recorded fixtures to answer the GitHub API requests with instead of generated ones.
+    Returns:
+        dict: The result of the run for the report.
+    """
+    os.makedirs(os.path.join(run_dir, "Exports"), exist_ok=True)
+    repository = recorded_fixtures["repository"] if recorded_fixtures else DEFAULT_REPOSITORY
+    # The repository, the remote repository and the collection share their name
+    repo_path = os.path.join(run_dir, "repos", repository.split("/")[-1])
+
+    print(f"LOG: Generating repository with {parameters['commits']} commits and {parameters['files']} files at {repo_path}")
+    start = time.perf_counter()
+    summary = generate_repository(
+        repo_path,
+        commits=parameters["commits"],
+        files=parameters["files"],
+        lines_per_file=parameters["lines_per_file"],
+        doc_files=parameters["doc_files"],
+        guideline_sentences=parameters["guideline_sentences"],
+        seed=seed
+    )
+    period = max(parameters["commits"] - 1, 1) * DEFAULT_COMMIT_INTERVAL
+    fixtures = recorded_fixtures or generate_github_fixtures(
+        repository,
+        pull_requests=parameters["pull_requests"],
+        events_per_pull=parameters["events_per_pull"],
+        commit_shas=summary["commits"],
+        files=summary["python_files"] + summary["doc_files"],
+        seed=seed,
+        start_date=DEFAULT_START_DATE,
+        period=period
+    )
+    # Cover the commits as well as the pull requests, which recorded fixtures created at other times
+    first, last = DEFAULT_START_DATE, DEFAULT_START_DATE + period
+    pull_request_period = get_pull_request_period(fixtures)
+    if pull_request_period is not None:
+        first, last = min(first, pull_request_period[0]), max(last, pull_request_period[1])
+    fixtures_path = os.path.join(run_dir, "github-fixtures.json")
+    write_fixtures(fixtures, fixtures_path)
+    generation_seconds = time.perf_counter() - start
+
+    result_path = os.path.join(run_dir, "result.json")
+    config_path = os.path.join(run_dir, "config.json")
+    with FixtureServer(fixtures) as server:
+        config = {
+            "repo_path": summary["path"],
+            "api_url": f"{server.url}/repos/{repository}",
+            "from_date": (first - timedelta(days=1)).isoformat(),
+            "to_date": (last + timedelta(days=1)).isoformat(),
+            "split_date": (first + (last - first) / 2).isoformat(),
+            "workers": workers,
+            "memory_database": mongo_uri is None,
+            "result_path": result_path,
+        }
+        with open(config_path, "w") as file:
+            json.dump(config, file)
+        env = dict(
+            os.environ,
+            GITHUB_API_URL=server.url,
+            GITHUB_TOKEN="",
+            GITHUB_CACHE_PATH=os.path.join(run_dir, "Exports", "github-cache.sqlite"),
+            METRICS_CACHE_PATH=os.path.join(run_dir, "Exports", "metrics-cache.sqlite"),
+            MPLBACKEND="Agg",
+        )
+        if mongo_uri is not None:
+            env["MONGODB_URI"] = mongo_uri
+        print(f"LOG: Running the pipeline for scale {name}")
+        start = time.perf_counter()
+        process = subprocess.run([sys.executable, os.path.abspath(__file__), "--run-config", config_path], cwd=run_dir, env=env)
+        wall_seconds = time.perf_counter() - start
+        github_statistics = dict(server.statistics)
+
+    run = {
+        "name": name,
+        "parameters": dict(parameters, seed=seed, workers=workers, recorded_fixtures=recorded_fixtures is not None, memory_database=mongo_uri is None),
+        "repository": {key: summary[key] for key in ["start_date", "end_date", "lines_of_code"]},
+        "generation_seconds": generation_seconds,
+        "wall_seconds": wall_seconds,
+        "github_requests": github_statistics,
+    }
+    if process.returncode != 0 or not os.path.exists(result_path):
+        print(f"ERROR: Pipeline for scale {name} exited with code {process.returncode}")
+        return dict(run, status="error", exit_code=process.returncode, stages=[])
+    with open(result_path, "r") as file:
+        result = json.load(file)
+    items = {
+        "commits": len(summary["commits"]),
+        "pull_requests": result["counts"]["objects"].get("pull_request", 0),
+        "events": result["counts"]["events"],
+    }
+    _add_throughput(result["stages"], items)
+    status = "ok" if all(stage["status"] == "ok" for stage in result["stages"]) else "error"
+    return dict(run, status=status, exit_code=0, **result)
+
+def get_environment() -> dict:
+    """
+    Describe the environment of a benchmark, such that reports of different machines or versions are told apart.
+    """
+    root = os.path.dirname(os.path.abspath(__file__))
+    def git(*args):
+        try:
+            return subprocess.run(["git", *args], cwd=root, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True).stdout.decode("utf-8").strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+    packages = {}
+    for package in PACKAGES:
+        try:
+            packages[package] = importlib.metadata.version(package)
+        except importlib.metadata.PackageNotFoundError:
+            packages[package] = None
+    status = git("status", "--porcelain", "--untracked-files=no")
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "git_revision": git("rev-parse", "HEAD"),
+        "git_dirty": bool(status) if status is not None else None,
+        "packages": packages,
+    }
+
+def compare_reports(report: dict, baseline: dict, threshold: float = DEFAULT_REGRESSION_THRESHOLD) -> list:
+    """
+    Compare the stages of the runs of a report with those of a baseline report.
+    Args:
+        report (dict): The report of the current benchmark.
+        baseline (dict): The report of a previous benchmark.
+        threshold (float): The relative increase of wall time, from which on a stage counts as regressed.
+    Returns:
+        list: The changes of wall time and throughput of each stage of each run in both reports.
+    """
+    baseline_runs = {run["name"]: run for run in baseline.get("runs", [])}
+    comparison = []
+    for run in report["runs"]:
+        baseline_run = baseline_runs.get(run["name"])
+        if baseline_run is None:
+            continue
+        if baseline_run.get("parameters") != run.get("parameters"):
+            print(f"WARNING: Parameters of scale {run['name']} differ from the baseline")
+        baseline_stages = {stage["name"]: stage for stage in baseline_run.get("stages", [])}
+        for stage in run.get("stages", []):
+            baseline_stage = baseline_stages.get(stage["name"])
+            if baseline_stage is None or stage["status"] != "ok" or baseline_stage["status"] != "ok" or baseline_stage["wall_seconds"] <= 0:
+                continue
+            change = stage["wall_seconds"] / baseline_stage["wall_seconds"] - 1
+            comparison.append({
+                "run": run["name"],
+                "stage": stage["name"],
+                "baseline_wall_seconds": baseline_stage["wall_seconds"],
+                "wall_seconds": stage["wall_seconds"],
+                "wall_time_change": change,
+                "baseline_items_per_second": baseline_stage.get("items_per_second"),
+                "items_per_second": stage.get("items_per_second"),
+                "db_round_trips_change": stage["db_round_trips"] - baseline_stage["db_round_trips"],
+                "regressed": change > threshold,
+            })
+    return comparison
+
+def print_summary(report: dict):
+    print(f"{'scale':<10}{'stage':<22}{'status':<8}{'wall s':>10}{'items/s':>12}{'db trips':>10}{'subproc':>9}{'peak MiB':>10}")
+    for run in report["runs"]:
+        for stage in run.get("stages", []):
+            items_per_second = stage.get("items_per_second")
+            print(
+                f"{run['name']:<10}{stage['name']:<22}{stage['status']:<8}{stage['wall_seconds']:>10.2f}"
+                f"{items_per_second if items_per_second is not None else float('nan'):>12.1f}"
+                f"{stage['db_round_trips']:>10}{stage['subprocess_launches']:>9}{stage['peak_rss_bytes'] / 2**20:>10.1f}"
+            )
+
+def main(args):
+    scales = {}
+    for name in args.scales.split(","):
+        if name not in SCALES:
+            raise Exception(f"Unknown scale {name}, choose from {', '.join(SCALES)}")
+        # Options override the size of all scales
+        scales[name] = {key: getattr(args, key) if getattr(args, key) is not None else value for key, value in SCALES[name].items()}
+    recorded_fixtures = load_fixtures(args.fixtures) if args.fixtures else None
+
+    work_dir = os.path.abspath(args.work_dir) if args.work_dir else tempfile.mkdtemp(prefix="benchmark-")
+    os.makedirs(work_dir, exist_ok=True)
+    report = {
+        "schema_version": REPORT_SCHEMA_VERSION,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "environment": get_environment(),
+        "parameters": {"scales": scales, "seed": args.seed, "workers": args.workers, "fixtures": args.fixtures, "memory_database": args.memory_database},
+        "runs": [],
+    }
+    try:
+        with ExitStack() as stack:
+            if args.memory_database:
+                mongo_uri = None
+            elif args.mongo_uri:
+                mongo_uri = args.mongo_uri
+            else:
+                executable = shutil.which(args.mongod)
+                if executable is None:
+                    raise Exception(f"MongoDB server {args.mongod} not found, pass --mongod or --mongo-uri")
+                mongo_uri = stack.enter_context(MongodProcess(executable, os.path.join(work_dir, "mongod"))).uri
+            for name, parameters in scales.items():
+                run_dir = os.path.join(work_dir, name)
+                if os.path.exists(run_dir):
+                    shutil.rmtree(run_dir)
+                report["runs"].append(run_benchmark(name, parameters, run_dir, mongo_uri, args.workers, args.seed, recorded_fixtures))
+    finally:
+        if not args.keep and not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    report["environment"]["mongo_version"] = next((run["mongo_version"] for run in report["runs"] if "mongo_version" in run), None)
+
+    if args.compare:
+        with open(args.compare, "r") as file:
+            baseline = json.load(file)
+        comparison = compare_reports(report, baseline, args.threshold)
+        report["comparison"] = {"baseline": args.compare, "created_at": baseline.get("created_at"), "threshold": args.threshold, "stages": comparison}
+        for change in comparison:
+            message = f"{change['run']}/{change['stage']}: {change['baseline_wall_seconds']:.2f}s -> {change['wall_seconds']:.2f}s ({change['wall_time_change']:+.1%})"
+            print(f"WARNING: Regression of {message}" if change["regressed"] else f"LOG: {message}")
+
+    output = args.output or os.path.join(DEFAULT_OUTPUT_DIR, f"benchmark-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    if os.path.dirname(output):
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(report, file, indent=2)
+    print_summary(report)
+    print(f"LOG: Wrote benchmark report to {output}")
+    return 0 if all(run["exit_code"] == 0 for run in report["runs"]) else 1
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the stages of the pipeline on synthetic repositories and GitHub fixtures")
+    parser.add_argument("--scales", type=str, default="small", help=f"Comma-separated scales to run, of {', '.join(SCALES)} (default: small)")
+    for option, help in [
+        ("commits", "Number of commits"),
+        ("files", "Number of Python files"),
+        ("lines-per-file", "Lines of a Python file"),
+        ("doc-files", "Number of doc files with contribution guidelines"),
+        ("guideline-sentences", "Number of guideline sentences of a doc file"),
+        ("pull-requests", "Number of closed pull requests"),
+        ("events-per-pull", "Number of timeline events of a pull request"),
+    ]:
+        parser.add_argument(f"--{option}", type=int, default=None, help=f"{help}, overriding the scales")
+    parser.add_argument("--workers", type=int, default=None, help="Number of processes analysing the code quality (default: number of cores)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the generated repositories and fixtures (default: 0)")
+    parser.add_argument("--mongo-uri", type=str, default=None, help="URI of a MongoDB server to use instead of starting a throwaway one")
+    parser.add_argument("--memory-database", action="store_true", help="Use an in-memory database (mongomock) instead of a MongoDB server, which counts the same round trips without their latency")
+    parser.add_argument("--mongod", type=str, default="mongod", help="MongoDB server executable to start a throwaway server with (default: mongod)")
+    parser.add_argument("--fixtures", type=str, default=None, help="Recorded GitHub fixtures to use instead of generated ones, see build/github_fixtures.py")
+    parser.add_argument("--output", type=str, default=None, help=f"Path of the report (default: {DEFAULT_OUTPUT_DIR}/benchmark-<time>.json)")
+    parser.add_argument("--compare", type=str, default=None, help="Report of a previous benchmark to compare the stages with")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_REGRESSION_THRESHOLD, help=f"Relative increase of wall time counted as regression (default: {DEFAULT_REGRESSION_THRESHOLD})")
+    parser.add_argument("--work-dir", type=str, default=None, help="Directory to keep the repositories, fixtures and exports of the runs in (default: temporary)")
+    parser.add_argument("--keep", action="store_true", help="Keep the temporary directory of the runs")
+    parser.add_argument("--run-config", type=str, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.run_config:
+        with open(args.run_config, "r") as file:
+            config = json.load(file)
+        result = run_stages(config)
+        with open(config["result_path"], "w") as file:
+            json.dump(result, file, indent=2)
+    else:
+        sys.exit(main(args))
@@ -1,20 +1,51 @@
 from datetime import datetime
 import math
 import os
+import shutil
 import subprocess
+import tempfile
 from matplotlib.pylab import f
 from radon.metrics import mi_visit, h_visit
 from radon.raw import analyze
 from radon.complexity import cc_visit
+import radon
+import lizard
+from lizard import analyze_file
+import pylint
 from pylint.reporters.base_reporter import BaseReporter
 import re
+from pylint.config import find_default_config_files
 from pylint.lint import Run
 import os
+from typing import List, Optional
 
 from sympy import Q
 from tomlkit import date
 
 from build.database_handler import get_attribute_change_times, get_attribute_value_at_time, get_object
+from build.metrics_cache import MISSING, Uncached, cached_metric, metrics_cache
+from build.utils import get_blob_hash
+
+# Increase when changing how metrics are calculated to invalidate the cached metrics
+ANALYZER_VERSION = "1"
+RADON_VERSION = f"radon-{radon.__version__}-{ANALYZER_VERSION}"
+# Duplicate code is only detected across modules, thus disable it to keep the per file scores
+PYLINT_ARGUMENTS = ["--persistent=n", "--clear-cache-post-run=y", "--disable=duplicate-code"]
+
+def _get_pylint_configuration():
+    # pylint uses the first configuration found in the working directory, PYLINTRC or the home directory, e.g. .pylintrc
+    configuration_path = next((str(path) for path in find_default_config_files()), None)
+    if configuration_path is None:
+        return None, ""
+    with open(configuration_path, encoding="utf-8") as configuration_file:
+        return configuration_path, configuration_file.read()
+
+PYLINT_CONFIGURATION_PATH, PYLINT_CONFIGURATION = _get_pylint_configuration()
+# The scores depend on the enabled checks, thus the configuration and the arguments are part of the version
+PYLINT_VERSION = f"pylint-{pylint.__version__}-{ANALYZER_VERSION}-{get_blob_hash(PYLINT_CONFIGURATION + ' '.join(PYLINT_ARGUMENTS))[:12]}"
+LIZARD_VERSION = f"lizard-{lizard.version}-{ANALYZER_VERSION}"
+PYTHON2_TIMEOUT = 120
+
 class ScoreOnlyReporter(BaseReporter):
     def __init__(self, output = None) -> None:
         super().__init__(output)
@@ -35,6 +66,7 @@ class ScoreOnlyReporter(BaseReporter):
     def on_close(self, stats, previous_stats): 
         pass
 
+@cached_metric("maintainability_index", RADON_VERSION)
 def get_maintainability_index(source_code, filepath='temp_code.py'):
     """
     Calculate the maintainability index of a given source code file.
@@ -47,23 +79,13 @@ def get_maintainability_index(source_code, filepath='temp_code.py'):
     try:
         return mi_visit(source_code, True)
     except Exception as e:
-        filename = filepath.split('/')[-1]
-        with open(filename, "w") as f:
-            f.write(source_code)
-        result = subprocess.run(
-            ['python2', '-m' 'radon', "mi", "-s", filename],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
-        )
-        maintainability_output = result.stdout
-        match_mi = re.search(r"\((\d+)\)", maintainability_output)
+        result = _run_python2_radon(["mi", "-s"], source_code, filepath)
+        match_mi = re.search(r"\((\d+)\)", result.stdout) if result else None
         if match_mi:
-            os.remove(filename)
             return float(match_mi.group(1))  
         else:
-            print(f"Error calculating maintainability index for file at {filepath}: {result.stderr}")
-            return 0
+            print(f"Error calculating maintainability index for file at {filepath}: {result.stderr if result else e}")
+            return Uncached(0)
         
 def calculate_maintainability_index(N1, N2, h1, h2, complexity, loc):
     N = N1 + N2
@@ -117,28 +139,117 @@ def calculate_maintainability_index_like_radon(N1, N2, h1, h2, complexity, sloc,
 #         return 0
     
 def get_pylint_score(source_code, filepath='temp_code.py') -> float:
-    filename = filepath.split("/")[-1]
-    with open(filename, 'w') as f:
+    """
+    Calculate the pylint score of a given source code file in-process.
+    Args:
+        source_code (str): The source code to analyze.
+        filepath (str): The path of the analysed file, used for logging.
+    Returns:
+        float: The pylint score of the source code.
+    """
+    try:
+        return get_pylint_scores([source_code])[0]
+    except Exception as e:
+        print(f"Error calculating pylint score for file at {filepath}: {e}")
+        return 0
+
+def get_pylint_scores(source_codes) -> list:
+    """
+    Calculate the pylint scores of a batch of source codes within one in-process pylint run.
+    Every source code is linted as its own module, so that the per module statistics
+    yield the same score as a separate pylint run on each file. Cached scores are not recomputed.
+    Args:
+        source_codes (list[str]): The source codes to analyze.
+    Returns:
+        list[float]: The pylint score of each source code in the given order.
+    """
+    scores = [metrics_cache.get(get_blob_hash(source_code), "pylint_score", PYLINT_VERSION) for source_code in source_codes]
+    uncached_source_codes = list(dict.fromkeys(source_code for source_code, score in zip(source_codes, scores) if score is MISSING))
+    if uncached_source_codes:
+        try:
+            computed_scores = dict(zip(uncached_source_codes, _run_pylint(uncached_source_codes)))
+        except Exception as e:
+            print(f"Error calculating pylint scores for {len(uncached_source_codes)} files: {e}")
+            computed_scores = dict.fromkeys(uncached_source_codes)
+        for source_code, score in computed_scores.items():
+            # Failed runs score 0, but are not cached, such that the next run computes the score again
+            if score is not None:
+                metrics_cache.set(get_blob_hash(source_code), "pylint_score", PYLINT_VERSION, score)
+        scores = [(computed_scores[source_code] or 0) if score is MISSING else score for source_code, score in zip(source_codes, scores)]
+    return scores
+
+def _run_pylint(source_codes) -> List[Optional[float]]:
+    temp_dir = tempfile.mkdtemp(prefix="pylint_")
+    try:
+        module_names = []
+        for source_code in source_codes:
+            module_name = f"blob_{get_blob_hash(source_code)}"
+            with open(os.path.join(temp_dir, f"{module_name}.py"), "w") as f:
+                f.write(source_code)
+            module_names.append(module_name)
+        # Pin the configuration to the one the cached scores are keyed by
+        rcfile = [f"--rcfile={PYLINT_CONFIGURATION_PATH}"] if PYLINT_CONFIGURATION_PATH else []
+        pylint_results = Run(
+            rcfile + PYLINT_ARGUMENTS + [os.path.join(temp_dir, f"{name}.py") for name in module_names],
+            ScoreOnlyReporter(),
+            exit=False
+        )
+        module_stats = pylint_results.linter.stats.by_module
+        return [_calculate_pylint_score(module_stats.get(name)) for name in module_names]
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+def _calculate_pylint_score(module_stats) -> Optional[float]:
+    # Default evaluation of pylint, see option "evaluation" in .pylintrc, or None if pylint failed on the module
+    if not module_stats or module_stats["fatal"]:
+        return None
+    if not module_stats["statement"]:
+        return 0
+    penalty = 5 * module_stats["error"] + module_stats["warning"] + module_stats["refactor"] + module_stats["convention"]
+    return round(max(0, 10.0 - ((float(penalty) / module_stats["statement"]) * 10)), 2)
+
+@cached_metric("method_count", LIZARD_VERSION)
+def get_method_count(source_code, filepath='temp_code.py') -> int:
+    """
+    Count the methods of a given source code file, as pydriller does for modified files.
+    Args:
+        source_code (str): The source code to analyze.
+        filepath (str): The path of the file, used to detect the language.
+    Returns:
+        int: The number of methods in the source code.
+    """
+    try:
+        return len(analyze_file.analyze_source_code(filepath, source_code).function_list)
+    except Exception as e:
+        print(f"Error counting methods for file at {filepath}: {e}")
+        return Uncached(0)
+
+def _write_temporary_source(source_code, filepath):
+    # Use a private directory, so that parallel workers do not overwrite each others files
+    filename = os.path.join(tempfile.mkdtemp(prefix="radon_"), filepath.split("/")[-1])
+    with open(filename, "w") as f:
         f.write(source_code)
+    return filename
+
+def _remove_temporary_source(filename):
+    shutil.rmtree(os.path.dirname(filename), ignore_errors=True)
+
+def _run_python2_radon(arguments, source_code, filepath):
+    # Radon of Python 2 analyses source code, which does not parse as Python 3, or returns None if it cannot run
+    filename = _write_temporary_source(source_code, filepath)
     try:
-        result = subprocess.run(
-            ['python', '-m', 'pylint', filename],
+        return subprocess.run(
+            ['python2', '-m', 'radon', *arguments, filename],
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
-            text=True
+            text=True,
+            timeout=PYTHON2_TIMEOUT
         )
-        match = re.search(r"rated at ([\d\.]+)/10", result.stdout)
-        if match:
-            os.remove(filename)
-            print(f"{match.group(1)}")
-            return float(match.group(1))
-        else:
-            pylint_results = Run([filename], ScoreOnlyReporter(), exit =False)
-            os.remove(filename)
-            return float(pylint_results.linter.stats.global_note)
-    except Exception as e:
-        print(f"Error calculating pylint score for file at {filepath}: {e}")
-        return 0
+    except (OSError, subprocess.TimeoutExpired) as e:
+        print(f"Error running radon of Python 2 for file at {filepath}: {e}")
+        return None
+    finally:
+        _remove_temporary_source(filename)
 
 class Python2LineMetics:
     def __init__(self, loc, lloc, sloc, comments, single_comments, multi, blank):
@@ -160,20 +271,13 @@ class Python2LineMetics:
         Multi: {self.multi}, 
         Blank: {self.blank}"""
 
+@cached_metric("line_metrics", RADON_VERSION)
 def get_line_metrics(source_code, filepath='temp_code.py'):
     try:
         return analyze(source_code)
     except Exception as e:
-        filename = filepath.split("/")[-1]
-        with open(filename, 'w') as f:
-            f.write(source_code)
-        result = subprocess.run(
-            ['python2', '-m' 'radon', "raw", filename],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
-        )
-        line_metrics_output = result.stdout
+        result = _run_python2_radon(["raw"], source_code, filepath)
+        line_metrics_output = result.stdout if result else ""
         loc = re.search(r"LOC:\s*(\d+)", line_metrics_output)
         lloc = re.search(r"LLOC:\s*(\d+)", line_metrics_output)
         sloc = re.search(r"SLOC:\s*(\d+)", line_metrics_output)
@@ -182,7 +286,6 @@ def get_line_metrics(source_code, filepath='temp_code.py'):
         multi = re.search(r"Multi:\s*(\d+)", line_metrics_output)
         blank = re.search(r"Blank:\s*(\d+)", line_metrics_output)
         if loc and lloc and sloc and comments and single_comments and multi and blank:
-            os.remove(filename)
             return Python2LineMetics(
                 loc=int(loc.group(1)),
                 lloc=int(lloc.group(1)),
@@ -193,8 +296,8 @@ def get_line_metrics(source_code, filepath='temp_code.py'):
                 blank=int(blank.group(1))
             )
         else:
-            print(f"Error calculating maintainability index for {filepath}: {result.stderr}")
-            return Python2LineMetics(
+            print(f"Error calculating maintainability index for {filepath}: {result.stderr if result else e}")
+            return Uncached(Python2LineMetics(
                 loc=0,
                 lloc=0,
                 sloc=0,
@@ -202,7 +305,7 @@ def get_line_metrics(source_code, filepath='temp_code.py'):
                 single_comments=0,
                 multi=0,
                 blank=0
-            )
+            ))
         
 class Python2HelsteadTotal:
     def __init__(self, h1, h2, N1, N2):
@@ -223,6 +326,7 @@ class Python2HelsteadReport:
         N1={self.total.N1}, 
         N2={self.total.N2})"""
 
+@cached_metric("halstead_metrics", RADON_VERSION)
 def get_halstead_metrics(source_code, filepath='temp_code.py'):
     """
     Calculate the Halstead metrics of a given source code file.
@@ -235,22 +339,13 @@ def get_halstead_metrics(source_code, filepath='temp_code.py'):
     try:
         return h_visit(source_code)
     except Exception as e:
-        filename = filepath.split("/")[-1]
-        with open(filename, 'w') as f:
-            f.write(source_code)
-        result = subprocess.run(
-            ['python2', '-m' 'radon', "raw", filename],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
-        )
-        line_metrics_output = result.stdout
+        result = _run_python2_radon(["raw"], source_code, filepath)
+        line_metrics_output = result.stdout if result else ""
         theta_1 = re.search(r"h1:\s*(\d+)", line_metrics_output)
         theta_2 = re.search(r"h1:\s*(\d+)", line_metrics_output)
         N1 = re.search(r"N1:\s*(\d+)", line_metrics_output)
         N2 = re.search(r"N2:\s*(\d+)", line_metrics_output)
         if theta_1 and theta_2 and N1 and N2:
-            os.remove(filename)
             return Python2HelsteadReport(
                 h1=int(theta_1.group(1)),
                 h2=int(theta_2.group(1)),
@@ -258,14 +353,15 @@ def get_halstead_metrics(source_code, filepath='temp_code.py'):
                 N2=int(N2.group(1))
             )
         else:
-            print(f"File at {filepath} does not compile: {result.stderr}")
-            return Python2HelsteadReport(
+            print(f"File at {filepath} does not compile: {result.stderr if result else e}")
+            return Uncached(Python2HelsteadReport(
                 h1=0,
                 h2=0,
                 N1=0,
                 N2=0
-            )
+            ))
         
+@cached_metric("cyclomatic_complexity", RADON_VERSION)
 def get_cyclomatic_complexity(source_code, filepath='temp_code.py'):
     """
     Calculate the Cyclomatic Complexity of a given source code file.
@@ -279,31 +375,36 @@ def get_cyclomatic_complexity(source_code, filepath='temp_code.py'):
         res = cc_visit(source_code)
         return sum(res[i].complexity for i in range(len(res)))
     except Exception as e:
-        filename = filepath.split("/")[-1]
-        with open(filename, "w") as f:
-            f.write(source_code)
-        result = subprocess.run(
-            ['python2', '-m' 'radon', "cc", "-s", filename],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
-        )
-        cc_output = result.stdout
-        match_cc = re.search(r"\((\d+)\)", cc_output)
+        result = _run_python2_radon(["cc", "-s"], source_code, filepath)
+        match_cc = re.search(r"\((\d+)\)", result.stdout) if result else None
         if match_cc:
-            os.remove(filename)
             return int(match_cc.group(1))
         else:
-            print(f"File at {filepath} does not compile: {result.stderr}")
-            return 0
+            print(f"File at {filepath} does not compile: {result.stderr if result else e}")
+            return Uncached(0)
+
+def get_file_metrics_at(file_id, commit_date, collection, temporal_index=None):
+    """
+    Get the maintainability index and pylint score of a file at a point in time.
+    Args:
+        file_id (str): The ID of the object holding the metrics.
+        commit_date (str): The point in time as ISO 8601 string.
+        collection (str): The collection of the object.
+        temporal_index (TemporalIndex, optional): An index of the collection to query instead of the database.
+    Returns:
+        tuple: The maintainability index and the pylint score, 0 if unknown.
+    """
+    def value_at(attribute_name):
+        if temporal_index is not None:
+            return temporal_index.value_at(file_id, attribute_name, commit_date)
+        return get_attribute_value_at_time(file_id, attribute_name, commit_date, collection)
 
-def get_file_metrics_at(file_id, commit_date, collection):
-    h1 = get_attribute_value_at_time(file_id, "theta_1", commit_date, collection) or 0
-    h2 = get_attribute_value_at_time(file_id, "theta_2", commit_date, collection) or 0
-    N1 = get_attribute_value_at_time(file_id, "N_1", commit_date, collection) or 0
-    N2 = get_attribute_value_at_time(file_id, "N_2", commit_date, collection) or 0
-    cyclomatic_complexity = get_attribute_value_at_time(file_id, "cyclomatic_complexity", commit_date, collection) or 0
-    loc = get_attribute_value_at_time(file_id, "loc", commit_date, collection) or 0
+    h1 = value_at("theta_1") or 0
+    h2 = value_at("theta_2") or 0
+    N1 = value_at("N_1") or 0
+    N2 = value_at("N_2") or 0
+    cyclomatic_complexity = value_at("cc") or 0
+    loc = value_at("loc") or 0
     mi = calculate_maintainability_index(N1, N2, h1, h2, cyclomatic_complexity, loc) or 0
-    pl = get_attribute_value_at_time(file_id, "pylint_score", commit_date, collection) or 0
+    pl = value_at("pylint_score") or 0
     return mi, pl
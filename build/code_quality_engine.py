@@ -0,0 +1,135 @@
+from concurrent.futures import ProcessPoolExecutor
+import os
+import subprocess
+from typing import Dict, List, Optional, Tuple
+
+from build.code_quality_analyzer import get_cyclomatic_complexity, get_halstead_metrics, get_line_metrics, get_maintainability_index, get_method_count, get_pylint_scores
+from build.metrics_cache import metrics_cache
+from build.utils import batched
+
+DEFAULT_BATCH_SIZE = 16
+
+class GitBlobReader:
+    """
+    Read file contents directly from the object storage of a git repository,
+    i.e. without checking out any commit in the working tree.
+    """
+    def __init__(self, repo_path: str):
+        self.repo_path = repo_path
+        self._process = subprocess.Popen(
+            ["git", "cat-file", "--batch"],
+            cwd=repo_path,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def list_files(self, commit_sha: str) -> List[Tuple[str, str]]:
+        """
+        List all files of the tree of a commit.
+        Args:
+            commit_sha (str): The hash of the commit to list the files for.
+        Returns:
+            list: A list of (path, blob_sha) tuples.
+        """
+        result = subprocess.run(
+            ["git", "ls-tree", "-r", "-z", commit_sha],
+            cwd=self.repo_path,
+            stdout=subprocess.PIPE,
+            check=True
+        )
+        files = []
+        for entry in result.stdout.decode("utf-8", "ignore").split("\0"):
+            if not entry:
+                continue
+            meta, path = entry.split("\t", 1)
+            _, object_type, blob_sha = meta.split()
+            if object_type == "blob":
+                files.append((path, blob_sha))
+        return files
+
+    def read(self, blob_sha: str) -> Optional[str]:
+        """
+        Read the content of a blob.
+        Args:
+            blob_sha (str): The hash of the blob to read.
+        Returns:
+            str: The decoded content of the blob, or None if the blob does not exist.
+        """
+        self._process.stdin.write(f"{blob_sha}\n".encode()) # type: ignore
+        self._process.stdin.flush() # type: ignore
+        header = self._process.stdout.readline().decode().split() # type: ignore
+        if len(header) < 3 or header[1] == "missing":
+            return None
+        content = self._process.stdout.read(int(header[2])) # type: ignore
+        self._process.stdout.read(1) # type: ignore # Skip the newline terminating the content
+        return content.decode("utf-8", "ignore")
+
+    def close(self):
+        if self._process.poll() is None:
+            # Forked worker processes may hold a copy of stdin, thus do not wait for the end of the input
+            self._process.stdin.close() # type: ignore
+            self._process.terminate()
+            self._process.wait()
+
+def _analyse_batch(jobs):
+    # Runs in a worker process, thus only take and return picklable values
+    pylint_scores = get_pylint_scores([source_code for _, _, source_code in jobs])
+    results = []
+    for (blob_sha, filename, source_code), pylint_score in zip(jobs, pylint_scores):
+        results.append((blob_sha, [
+            get_maintainability_index(source_code, filename)/100,
+            pylint_score/10,
+            get_cyclomatic_complexity(source_code, filename),
+            get_halstead_metrics(source_code, filename),
+            get_line_metrics(source_code, filename),
+            get_method_count(source_code, filename)
+        ]))
+    # Worker processes exit without running exit handlers, thus write the computed metrics now
+    metrics_cache.flush()
+    return results
+
+class CodeQualityEngine:
+    """
+    Compute the code quality metrics of many source files on a pool of worker processes.
+
+    Sources are identified by their git blob hash, such that identical contents are only analysed once
+    and pylint is run in-process on batches of files instead of starting one subprocess per file.
+    """
+    def __init__(self, workers: Optional[int] = None, batch_size: int = DEFAULT_BATCH_SIZE):
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self._executor = None
+
+    def __enter__(self):
+        if self.workers > 1:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def analyse(self, jobs: List[Tuple[str, str, str]]) -> Dict[str, list]:
+        """
+        Analyse the code quality of source files.
+        Args:
+            jobs (list): A list of (blob_sha, filename, source_code) tuples.
+        Returns:
+            dict: A dictionary mapping each blob_sha to [maintainability_index, pylint_score, cc, halstead_metrics, line_metrics, method_count].
+        """
+        unique_jobs = {}
+        for job in jobs:
+            unique_jobs.setdefault(job[0], job)
+        batches = list(batched(unique_jobs.values(), self.batch_size))
+        if self._executor is not None:
+            batch_results = self._executor.map(_analyse_batch, batches)
+        else:
+            batch_results = map(_analyse_batch, batches)
+        return {blob_sha: metrics for results in batch_results for blob_sha, metrics in results}
@@ -4,10 +4,11 @@ from matplotlib import pyplot as plt
 import numpy as np
 from build.code_quality_analyzer import calculate_maintainability_index, get_file_metrics_at
 from build.database_handler import get_commits
-from build.database_handler import get_attribute_time, get_attribute_value, get_events_for_eventType, get_files, get_object, get_related_objectIds
+from build.database_handler import get_attribute_time, get_attribute_value, get_events_for_eventType, get_files, get_object, get_related_objectIds, get_temporal_index
 import matplotlib.dates as mdates
 from matplotlib.dates import date2num as date2num
 
+from build.temporal_index import to_epoch
 from build.utils import _set_plot_style_and_plot
 
 def plot_repo_code_quality_fast(collection, year=None): #TODO Unify with get_repository_code_quality and split_code_quality_per_guideline_change
@@ -27,11 +28,9 @@ def plot_repo_code_quality_fast(collection, year=None): #TODO Unify with get_rep
         # TODO Fix as not intended use of function 
         commit_date = get_attribute_time(commit["_id"], "message", collection)
         guideline_version = get_attribute_value(commit["_id"], "guideline_version", collection)
-        pylint_score = None
-        maintainability_index = None
-
-        pylint_score = get_related_objectIds(commit["_id"], "commit_pylint", collection)[0]
-        maintainability_index = get_related_objectIds(commit["_id"], "commit_mi", collection)[0]
+        # The local repository extractor stores the averaged metrics of the files of a commit as its attributes
+        pylint_score = get_attribute_value(commit["_id"], "repository_pylint_score", collection) or 0
+        maintainability_index = get_attribute_value(commit["_id"], "repository_maintainability_index", collection) or 0
 
         if year and year in commit_date:
             metrics[commit_date] = {
@@ -177,6 +176,7 @@ def plot_file_code_quality(file_id, collection, metric_names=[]):
 def get_repository_code_quality(collection, limit_commits=None):
     """
     Get a time series of averaged code quality metrics (maintainability index and pylint score) over all files at each commit date.
+    The metrics are looked up in an in-memory temporal index, and the averages are updated incrementally with the files changed by each commit.
 
     Args:
         collection (str): The name of the collection (i.e., repository) to get the metrics from.
@@ -185,48 +185,61 @@ def get_repository_code_quality(collection, limit_commits=None):
         dict: A dictionary mapping each commit date (datetime) to the averaged code quality metrics at that point in time.
     """
     # TODO Compare and contrast with fast version above
-    files = get_files(collection)
-    commits = get_commits(collection)
+    files = [file["_id"] for file in get_files(collection) if file["_id"].split(".")[-1] in ["py"]]
+    commits = sorted(get_commits(collection), key=lambda commit: to_epoch([commit["attributes"][0]["time"]])[0])
     file_metrics = {}
+    totals = {"mi": 0.0, "pylint_score": 0.0}
     if commits:
         initial_commit_time = datetime.fromisoformat(commits[0].get("attributes")[0]["time"])
     else:
         raise ValueError("No commits found in the collection.")
-        
-    for file in files:
-        mi, pylint = get_file_metrics_at(file["_id"], initial_commit_time.isoformat(), collection)
-        file_metrics[file["_id"]] = {
+    # Only the files and their metrics are queried, thus do not index the other objects
+    temporal_index = get_temporal_index(collection, object_types=["file", "file_metrics"])
+
+    # The metrics of a file are held by its file_metrics object. Commits do not relate the files they changed,
+    # thus take the changes of each file from the history of its metrics
+    changed_files = {}
+    for file_id in files:
+        history = temporal_index.get_history(f"m_{file_id}", "loc")
+        if history is not None:
+            for change_time in np.unique(history[0]):
+                changed_files.setdefault(int(change_time), []).append(file_id)
+    change_times = sorted(changed_files)
+    next_change = 0
+
+    def update_file_metrics(file_id, mi, pylint):
+        # Replace the contribution of the file to the running totals
+        if file_id in file_metrics:
+            totals["mi"] -= file_metrics[file_id]["mi"]
+            totals["pylint_score"] -= file_metrics[file_id]["pylint_score"]
+        file_metrics[file_id] = {
             "mi": mi,
             "pylint_score": pylint
         }
+        totals["mi"] += mi
+        totals["pylint_score"] += pylint
+
+    def update_changed_files(time):
+        # Update the files changed since the last update, up to the time
+        nonlocal next_change
+        epoch = to_epoch([time])[0]
+        while next_change < len(change_times) and change_times[next_change] <= epoch:
+            for file_id in changed_files[change_times[next_change]]:
+                mi, pylint = get_file_metrics_at(f"m_{file_id}", time, collection, temporal_index)
+                update_file_metrics(file_id, mi, pylint)
+            next_change += 1
+
+    def get_averages():
+        return {
+            "mi": totals["mi"] / len(file_metrics) if file_metrics else 0,
+            "pylint_score": totals["pylint_score"] / len(file_metrics) if file_metrics else 0
+        }
+
+    update_changed_files(initial_commit_time.isoformat())
     code_quality = {}
-    # Average over all pylint_scores
-    pylint_scores = [v["pylint_score"] for v in file_metrics.values()]
-    pylint_average = sum(pylint_scores) / len(pylint_scores) if pylint_scores else 0
-    mi_scores = [v["mi"] for v in file_metrics.values()]
-    mi_average = sum(mi_scores) / len(mi_scores) if mi_scores else 0
-    code_quality[initial_commit_time] = {
-        "mi": mi_average,
-        "pylint_score": pylint_average
-    }
+    code_quality[initial_commit_time] = get_averages()
     for commit in commits[:limit_commits]:
         commit_time = datetime.fromisoformat(commit["attributes"][0]["time"])
-        files = get_related_objectIds(commit["_id"], "aggregates", collection)
-        for changed_file in files:
-            if changed_file.split(".")[-1] not in ["py"]: 
-                continue
-            else:
-                mi, pl = get_file_metrics_at(changed_file, commit["attributes"][0]["time"], collection)
-                file_metrics[changed_file] = {
-                    "mi": mi,
-                    "pylint_score": pl
-                }
-        pylint_scores = [v["pylint_score"] for v in file_metrics.values()]
-        pylint_average = sum(pylint_scores) / len(pylint_scores) if pylint_scores else 0
-        mi_scores = [v["mi"] for v in file_metrics.values()]
-        mi_average = sum(mi_scores) / len(mi_scores) if mi_scores else 0
-        code_quality[commit_time] = {
-            "mi": mi_average,
-            "pylint_score": pylint_average
-        }
-    return code_quality
\ No newline at end of file
+        update_changed_files(commit["attributes"][0]["time"])
+        code_quality[commit_time] = get_averages()
+    return code_quality
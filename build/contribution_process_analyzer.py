@@ -1,38 +1,39 @@
 from heapq import merge
 import pandas as pd
-from build.code_quality_visualizer import get_object
+from build.pull_request_analytics import get_pull_request_analytics
 from build.utils import _set_plot_style_and_plot, date_1970
-from build.database_handler import get_commits, get_events_for_eventType, get_events_for_object, get_is_user_bot, get_ocel_data, get_object_type_by_type_name, get_related_objectIds_for_event, get_type_of_object
+from build.database_handler import get_commits, get_events_for_eventType, get_ocel_data, get_object_type_by_type_name, get_related_objectIds_for_event
 from datetime import datetime, tzinfo, timezone
 from matplotlib import pyplot as plt
 from itertools import combinations
 
+def _to_python(value):
+    # Results hold datetimes and ints like before, instead of pandas and numpy scalars
+    if isinstance(value, pd.Timestamp):
+        return value.to_pydatetime()
+    return value.item() if hasattr(value, "item") else value
+
 def pull_request_reviewer_analysis(pull_request_ids, collection, visualise=False):
     """
     First extract the pull request data for one or multiple pull requests
     then extract the reviewers from the pull request data
     and if specified visualise the number of reviewers per pull request over time.
+    The time of a pull request is its last closing, or its first opening if it was not closed.
     """
+    analytics = get_pull_request_analytics(collection)
+    times = analytics.get_times()
+    pr_times = times["last_close_only"].fillna(times["first_open"]).dropna().to_dict()
+    reviewers = analytics.get_reviewers()
+    reviewers_by_pull_request = reviewers[~reviewers["is_bot"]].groupby("pull_request_id")["object_id"].agg(list).to_dict()
+    bots_by_pull_request = reviewers[reviewers["is_bot"]].groupby("pull_request_id")["object_id"].agg(list).to_dict()
     pull_request_data = []
     for pull_request_id in pull_request_ids:
-        events = get_events_for_object(pull_request_id, collection)
-        reviewers = []
-        bots = []
-        pr_time = None
-        for event in events:
-            if "open" in event["type"] and pr_time is None:
-                pr_time = datetime.fromisoformat(event["time"])
-            elif "close" in event["type"]:
-                pr_time = datetime.fromisoformat(event["time"])
-            elif "review" == event["type"].split("_")[-1]:
-                for related_object in event["relationships"]:
-                    if "by" in related_object["qualifier"]:
-                        user = get_object(related_object["objectId"], collection)
-                        if user and user["type"] == "user" and user["attributes"][2]["value"] == "True":
-                            bots.append(related_object["objectId"])
-                        else:
-                            reviewers.append(related_object["objectId"])
-        pull_request_data.append({"id": pull_request_id, "time": pr_time, "reviewers": reviewers, "bots": bots})
+        pull_request_data.append({
+            "id": pull_request_id,
+            "time": _to_python(pr_times.get(pull_request_id)),
+            "reviewers": list(reviewers_by_pull_request.get(pull_request_id, [])),
+            "bots": list(bots_by_pull_request.get(pull_request_id, []))
+        })
 
     # Visualise the number of reviewers per pull request over time if specified
     if visualise:
@@ -65,31 +66,21 @@ def pull_request_reviewer_analysis(pull_request_ids, collection, visualise=False
 def pull_request_open_time_analysis(pull_request_ids, collection, visualise=False):
     """
     Extract the open time of pull requests and optionally visualise it.
+    The open, close and merge times are the last of their kind, and the duration in hours lies between opening and closing.
     """
+    times = get_pull_request_analytics(collection).get_times()
+    open_to_close_times = pd.DataFrame({
+        "open": times["last_open"],
+        "close": times["last_close"],
+        "merge": times["last_merge"],
+        "duration": (times["last_close"] - times["last_open"]).dt.total_seconds() / 3600
+    })
+    open_to_close_times = open_to_close_times[open_to_close_times.index.isin(pull_request_ids)]
+    records = dict(zip(open_to_close_times.index, open_to_close_times.to_dict("records")))
     pr_open_to_close_times = {}
     for pull_request_id in pull_request_ids:
-        events = get_events_for_object(pull_request_id, collection)
-        for event in events:
-            if "open" in event["type"]:
-                open_time = datetime.fromisoformat(event["time"])
-                if pull_request_id in pr_open_to_close_times:
-                    pr_open_to_close_times[pull_request_id]["open"] = open_time
-                    if "close" in pr_open_to_close_times[pull_request_id]:
-                        close_time = pr_open_to_close_times[pull_request_id]["close"]
-                        pr_open_to_close_times[pull_request_id]["duration"] = (close_time - open_time).total_seconds() / 3600
-                else:
-                    pr_open_to_close_times.setdefault(pull_request_id, {})["open"] = open_time
-            if "close" in event["type"]:
-                close_time = datetime.fromisoformat(event["time"])
-                if pull_request_id in pr_open_to_close_times and "open" in pr_open_to_close_times[pull_request_id]:
-                    open_time = pr_open_to_close_times[pull_request_id]["open"]
-                    pr_open_to_close_times[pull_request_id]["close"] = close_time
-                    pr_open_to_close_times[pull_request_id]["duration"] = (close_time - open_time).total_seconds() / 3600
-                else:
-                   pr_open_to_close_times.setdefault(pull_request_id, {})["close"] = close_time
-            if "merge" in event["type"]:
-                merge_time = datetime.fromisoformat(event["time"])
-                pr_open_to_close_times.setdefault(pull_request_id, {})["merge"] = merge_time
+        if pull_request_id in records:
+            pr_open_to_close_times[pull_request_id] = {key: _to_python(value) for key, value in records[pull_request_id].items() if not pd.isna(value)}
 
     if visualise:
         plt.figure(figsize=(10, 5))
@@ -151,20 +142,8 @@ def pull_request_review_iterations(pull_request_ids, collection, visualise=False
     """
     Extract the number of review iterations for each pull request and optionally visualise it.
     """
-    pr_review_iterations = {}
-    for pull_request_id in pull_request_ids:
-        events = get_events_for_object(pull_request_id, collection)
-        events = sorted(events, key=lambda x: datetime.fromisoformat(x["time"]))
-        review_iterations = 0
-        started_iteration = False
-        for event in events:
-            if "commit" in event["type"]:
-                started_iteration = True
-            if "review" in event["type"].split("_")[-1]:
-                if started_iteration:
-                    review_iterations += 1
-                    started_iteration = False
-        pr_review_iterations[pull_request_id] = review_iterations
+    review_iterations = get_pull_request_analytics(collection).get_review_iterations().to_dict()
+    pr_review_iterations = {pull_request_id: int(review_iterations.get(pull_request_id, 0)) for pull_request_id in pull_request_ids}
 
     if visualise:
         plt.figure(figsize=(10, 5))
@@ -178,22 +157,14 @@ def pull_request_review_iterations(pull_request_ids, collection, visualise=False
         return pr_review_iterations
     
 def pull_request_approving_reviews(pull_request_ids, collection, visualise=False):
+    labels_and_approvals = get_pull_request_analytics(collection).get_labels_and_approvals()
+    labels = labels_and_approvals["labels"].to_dict()
+    approvals = labels_and_approvals["approvals"].to_dict()
     pr_attributes = {}
-    pr_label_sets = {}
-    pr_approvals = {}
     for pull_request_id in pull_request_ids:
-        events = get_events_for_object(pull_request_id, collection)
-        events = sorted(events, key=lambda x: datetime.fromisoformat(x["time"]))
-        pr_labels = []
-        approvals = 0
-        for event in events:
-            if "add_label" in event["type"]:
-                pr_labels.append(_get_event_attribute(event))
-            if "approve" in event["type"]:
-                approvals += 1
         pr_attributes[pull_request_id] = {
-            "labels": pr_labels,
-            "approvals": approvals
+            "labels": list(labels.get(pull_request_id, [])),
+            "approvals": int(approvals.get(pull_request_id, 0))
         }
     
     if visualise:
@@ -211,12 +182,6 @@ def pull_request_approving_reviews(pull_request_ids, collection, visualise=False
     else:
         return pr_attributes
         
-def _get_event_attribute(event):
-    for attribute in event.get("attributes", []):
-        if attribute.get("name") == "label":
-            return attribute.get("value")
-    return None
-
 def pull_request_approving_reviews_grouped(pull_request_ids,
                                            collection,
                                            visualise=False,
@@ -234,22 +199,16 @@ def pull_request_approving_reviews_grouped(pull_request_ids,
         min_prs_per_group (int): filter out sparse groups
 
     """
+    labels_and_approvals = get_pull_request_analytics(collection).get_labels_and_approvals()
+    labels_by_pull_request = labels_and_approvals["labels"].to_dict()
+    approvals_by_pull_request = labels_and_approvals["approvals"].to_dict()
     pr_label_sets = {}
     pr_approvals = {}
     for pull_request_id in pull_request_ids:
-        events = get_events_for_object(pull_request_id, collection)
-        events = sorted(events, key=lambda x: datetime.fromisoformat(x["time"]))
-        labels = set()
-        approvals = 0
-        for event in events:
-            etype = event["type"]
-            if "add_label" in etype:
-                labels.add(_get_event_attribute(event))
-            if "approve" in etype:
-                approvals += 1
+        labels = set(labels_by_pull_request.get(pull_request_id, []))
         if labels:
             pr_label_sets[pull_request_id] = labels
-            pr_approvals[pull_request_id] = approvals
+            pr_approvals[pull_request_id] = int(approvals_by_pull_request.get(pull_request_id, 0))
 
     # Step 2: build power-set groups (exclude empty)
     group_data = {}
@@ -318,43 +277,30 @@ def pull_request_bot_ratio(pull_request_ids, collection, visualise=False):
     """
     Compute bot vs total event counts for the given PRs.
     Returns both per-event-type totals and bot-only counts, plus debug stats.
+    The actor of an event is its first related user by the preferred qualifiers of `ACTOR_QUALIFIERS`.
     """
-    event_by_bot = {}
-    event_not_by_bot = {}
-    event_by_type = {}
-    totals = {
-        "events_processed": 0,
-        "events_with_actor": 0,
-        "bot_events": 0,
-        "non_bot_events": 0,
-        "unmatched_actor": [],
-        "user_lookup_failed": 0,
-    }
-
-    for pull_request_id in pull_request_ids:
-        if int(pull_request_id) < 30000:
-            events = get_events_for_object(pull_request_id, collection)
-            events = sorted(events, key=lambda x: datetime.fromisoformat(x["time"]))
+    analytics = get_pull_request_analytics(collection)
+    events = analytics.select([pull_request_id for pull_request_id in pull_request_ids if int(pull_request_id) < 30000], by_time=True)
+    actors = events["position"].map(analytics.get_actors())
+    has_actor = actors.notna()
+    is_bot = actors.map(analytics.users)
+    by_bot = is_bot.eq(True)
+    not_by_bot = is_bot.eq(False)
 
-            for event in events:
-                etype = event["type"]
-                event_by_type[etype] = event_by_type.get(etype, 0) + 1
-                totals["events_processed"] += 1
+    def count_by_type(mask):
+        return {event_type: int(count) for event_type, count in events["type"][mask].groupby(events["type"][mask], sort=False).size().items()}
 
-                actor_id, origin = _extract_event_actor(event, collection)
-                if actor_id:
-                    totals["events_with_actor"] += 1
-                    is_bot = get_is_user_bot(actor_id, collection)
-                    if is_bot == True:
-                        totals["bot_events"] += 1
-                        event_by_bot[etype] = event_by_bot.get(etype, 0) + 1
-                    elif is_bot == False:
-                        totals["non_bot_events"] += 1
-                        event_not_by_bot[etype] = event_not_by_bot.get(etype, 0) + 1
-                    else:
-                        totals["unmatched_actor"].append(actor_id)
-                else:
-                    totals["user_lookup_failed"] += 1
+    event_by_bot = count_by_type(by_bot)
+    event_not_by_bot = count_by_type(not_by_bot)
+    event_by_type = count_by_type(pd.Series(True, index=events.index))
+    totals = {
+        "events_processed": len(events),
+        "events_with_actor": int(has_actor.sum()),
+        "bot_events": int(by_bot.sum()),
+        "non_bot_events": int(not_by_bot.sum()),
+        "unmatched_actor": actors[has_actor & ~by_bot & ~not_by_bot].tolist(),
+        "user_lookup_failed": int((~has_actor).sum()),
+    }
 
     # Log summary
     total_events = totals["events_processed"]
@@ -372,19 +318,3 @@ def pull_request_bot_ratio(pull_request_ids, collection, visualise=False):
             "totals": event_by_type,
             "totals": totals
         }
-
-# Prefer actor from attributes when available; else use relationships.
-# Looks for common attribute names and relationship qualifiers.
-def _extract_event_actor(event, collection):
-    prefer = ["by", "author", "committer", "merged_by", "closed_by", "requested_by", "reviewer", "assignee", "user", "actor"]
-    rels = event.get("relationships", [])
-    # exact or substring match
-    for pref in prefer:
-        for rel in rels:
-            qual = rel.get("qualifier", "")
-            if qual == pref or pref in qual:
-                oid = rel.get("objectId")
-                if oid and get_type_of_object(oid, collection) == "user":
-                    return oid, "relationship"
-
-    return None, "none"
\ No newline at end of file
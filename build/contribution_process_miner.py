@@ -2,7 +2,8 @@ import pandas as pd
 import pm4py
 from build.code_quality_visualizer import get_attribute_value
 from build.database_handler import get_is_user_bot, get_related_objectIds, get_related_objectIds_for_event
-from build.utils import date_1970
+from build.ocel_stream import iterate_ocel
+from build.utils import batched, date_1970
 from build.database_handler import get_commits, get_event, get_ocel_data, get_object_type_by_type_name, get_type_of_object
 from datetime import datetime
 from pandas._typing import Timezone
@@ -56,7 +57,122 @@ def emptyOCEL():
         "events": []
     }
 
-def flatten_ocel2(ocel, object_type, collection):
+DEFAULT_FLATTENING_OBJECT_TYPES = ["pull_request", "commit", "user", "file"]
+FLATTENING_CHUNK_SIZE = 10000
+
+def get_object_type_index(ocel):
+    """
+    Map the id of every object of an object-centric event log to its object type.
+
+    Parameters
+    -------------------
+    ocel
+        Object-centric event log, either as path of an OCEL 2.0 JSON file or as dictionary
+
+    Returns
+    ------------------
+    index
+        Dictionary of object id to object type
+    """
+    return {obj["id"]: obj["type"] for obj in iterate_ocel(ocel, "objects")}
+
+def _explode_relationships(events: pd.DataFrame) -> pd.DataFrame:
+    # One row per related object, indexed by the position of the event
+    relationships = events["relationships"].explode().dropna()
+    object_ids = relationships.str.get("objectId")
+    qualifiers = relationships.str.get("qualifier")
+    # Change file events relate {action: filename} as qualifier to {role: committer} as object id,
+    # thus split them into a relationship to the file and one to the committer
+    legacy = object_ids.map(lambda object_id: isinstance(object_id, dict))
+    legacy_qualifiers = qualifiers[legacy]
+    legacy_object_ids = object_ids[legacy]
+    table = pd.concat([
+        pd.DataFrame({"object_id": object_ids[~legacy], "qualifier": qualifiers[~legacy]}),
+        pd.DataFrame({
+            "object_id": legacy_qualifiers.map(lambda qualifier: next(iter(qualifier.values()), None)),
+            "qualifier": legacy_qualifiers.map(lambda qualifier: next(iter(qualifier), None))
+        }),
+        pd.DataFrame({
+            "object_id": legacy_object_ids.map(lambda object_id: next(iter(object_id.values()), None)),
+            "qualifier": legacy_object_ids.map(lambda object_id: next(iter(object_id), None))
+        })
+    ])
+    return table.sort_index(kind="stable").dropna(subset=["object_id"])
+
+def _flatten_events(events: pd.DataFrame, object_type_index, object_types) -> pd.DataFrame:
+    # One row per relationship of an event to an object of the object types
+    relationships = _explode_relationships(events)
+    relationships["object_type"] = relationships["object_id"].map(object_type_index)
+    # Change file events only belong to the cases of their files, not e.g. to those of the committers
+    file_events = events["type"].str.contains("file", regex=False).fillna(False).to_numpy(dtype=bool)[relationships.index]
+    relationships = relationships[relationships["object_type"].isin(object_types) & (~file_events | (relationships["object_type"] == "file"))]
+
+    related_events = events.iloc[relationships.index].reset_index(drop=True)
+    return pd.DataFrame({
+        "case:concept:name": relationships["object_id"].to_numpy(),
+        "event_id": related_events["id"],
+        "concept:name": related_events["type"],
+        "time:timestamp": pd.to_datetime(related_events["time"], utc=True, format="ISO8601"),
+        **{column: related_events[column] for column in events.columns if column not in ["id", "type", "time"]},
+        "object_type": relationships["object_type"].to_numpy()
+    })
+
+def flatten_ocel2_for_object_types(ocel, object_types=DEFAULT_FLATTENING_OBJECT_TYPES, object_type_index=None, chunk_size=FLATTENING_CHUNK_SIZE):
+    """
+    Flattens the object-centric event log for several object types in one pass over its events.
+    Relationships are resolved against an in-memory index of the object types instead of the database.
+    The events are streamed in chunks, each exploded into rows of the related objects of the object types,
+    such that only the rows of the flattened logs and one chunk of events are held in memory.
+
+    Parameters
+    -------------------
+    ocel
+        Object-centric event log, either as path of an OCEL 2.0 JSON file, whose events are streamed, or as dictionary
+    object_types
+        Object types to flatten the log for
+    object_type_index
+        Dictionary of object id to object type, built from the objects of the log if not given
+    chunk_size
+        Number of events to flatten at once
+
+    Returns
+    ------------------
+    event_logs
+        Dictionary of object type to flattened log as DataFrame sorted by case and timestamp, which is empty if no event relates to an object of the type
+    """
+    if object_type_index is None:
+        object_type_index = get_object_type_index(ocel)
+    chunks = []
+    for events in batched(iterate_ocel(ocel, "events"), chunk_size):
+        chunk = _flatten_events(pd.DataFrame.from_records(events), object_type_index, object_types)
+        # Skip chunks without related events, which would turn the columns of all chunks into objects
+        if not chunk.empty:
+            chunks.append(chunk)
+    if not chunks:
+        chunks = [_flatten_events(pd.DataFrame(columns=["id", "type", "time", "attributes", "relationships"]), object_type_index, object_types)]
+    flat_log = pd.concat(chunks, ignore_index=True)
+    object_type_of_rows = flat_log.pop("object_type").to_numpy()
+
+    event_logs = {}
+    for object_type in object_types:
+        event_log = flat_log[object_type_of_rows == object_type]
+        event_logs[object_type] = event_log.sort_values(["case:concept:name", "time:timestamp"]).reset_index(drop=True)
+    return event_logs
+
+def export_flattened_log(event_log: pd.DataFrame, object_type, collection):
+    """
+    Export a flattened log as XES file.
+
+    Returns
+    ------------------
+    export_path
+        Path of the XES file
+    """
+    export_path = f"Exports/{collection}-{object_type}-flattened.xes"
+    xes_exporter.apply(log_converter.apply(event_log, variant=log_converter.Variants.TO_EVENT_LOG), export_path)
+    return export_path
+
+def flatten_ocel2(ocel, object_type, collection, export=True):
     """
     Flattens the object-centric event log to a traditional event log with the choice of an object type.
     In the flattened log, the objects of a given object type are the cases, and each case
@@ -65,121 +181,113 @@ def flatten_ocel2(ocel, object_type, collection):
     Parameters
     -------------------
     ocel
-        Object-centric event log
+        Object-centric event log, either as path of an OCEL 2.0 JSON file, whose events are streamed, or as dictionary
     object_type
         Object type
     collection
         Name of the repository to search for
+    export
+        Whether to export the flattened log as XES file or to return it as DataFrame
    
     Returns
     ------------------
     xes
-        Flattened log in the form of a xes-type encoded JSON
+        Path of the flattened log in the form of a xes-type encoded JSON, or the flattened log as DataFrame if export is False
     """
-    event_map = {ev["id"]: ev for ev in ocel["events"]}
-    
-    # For each relation, if object_type matches, collect (object_id, event_id)
-    case_event_pairs = []
-    for event in ocel["events"]:
-        if "file" not in event["type"]:
-            for row in event["relationships"]:
-                object_id = row["objectId"]
-                event_id = event["id"]
-                if get_type_of_object(object_id, collection) == object_type:
-                    case_event_pairs.append((object_id, event_id))
-
-    # For each (object_id, event_id), build a row with case_id, activity, timestamp, event_id, etc.
-    rows = []
-    for object_id, event_id in case_event_pairs:
-        event = event_map[event_id]
-        # related_object_ids = get_related_objectIds_for_event(event_id, "by", collection, True)
-        # bot = get_is_user_bot(related_object_ids[0], collection)
-        # rank = get_attribute_value(related_object_ids[0], "rank" , collection)
-        row = {
-            "case:concept:name": object_id,
-            "event_id": event_id,
-            "concept:name": event.get("type"),
-            "time:timestamp": event.get("time") + "Z",
-            # "is_bot": bot,
-            **{k: v for k, v in event.items() if k not in ["id", "type", "time"]}
-        }
-        rows.append(row)
-    
-    # Build DataFrame and sort by case_id and timestamp
-    df = pd.DataFrame(rows)
-    export_path = f"Exports/{collection}-{object_type}-flattened.xes"
-    if df is not None and rows != []:
-        df["time:timestamp"] = pd.to_datetime(df["time:timestamp"], utc=True)
-        df = df.sort_values(["case:concept:name", "time:timestamp"])
-        event_log = log_converter.apply(df, variant=log_converter.Variants.TO_EVENT_LOG)
-        xes_exporter.apply(event_log, export_path)
-        return export_path
+    event_log = flatten_ocel2_for_object_types(ocel, [object_type])[object_type]
+    if event_log.empty:
+        print("ERROR flattening OCEL for export at ", f"Exports/{collection}-{object_type}-flattened.xes")
+        return None
+    if not export:
+        return event_log
+    return export_flattened_log(event_log, object_type, collection)
+
+def _read_event_log(event_log):
+    # Accept the path of a XES file as well as a flattened log as DataFrame
+    if isinstance(event_log, str):
+        return log_converter.apply(xes_importer.apply(event_log), variant=log_converter.Variants.TO_DATA_FRAME)
+    return event_log
 
-    print("ERROR flattening OCEL for export at ", export_path)
-    return None
+def visualise_xes_as(variant, event_log, collection, view=True):
+    """
+    Discover a model of a flattened log and visualise it.
+
+    Parameters
+    -------------------
+    variant
+        Model to discover, i.e. "petri_net", "process_tree" or "dfg"
+    event_log
+        Event log, either as path of a XES file or as DataFrame
+    collection
+        Name of the repository
+    view
+        Whether to view the visualisation, otherwise the model is only discovered
 
-def visualise_xes_as(variant, import_path, collection):
-    event_log = xes_importer.apply(import_path)
+    Returns
+    ------------------
+    model
+        The discovered model, i.e. the Petri net with its initial and final marking, the process tree or the directly-follows graph
+    """
+    event_log = _read_event_log(event_log)
 
     if variant != "dfg":
         # Discover a process tree
         process_tree = inductive_miner.apply(event_log) # type: ignore
         if variant == "petri_net":
             net1, im1, fm1 = convert_to_petri_net(process_tree)
-            gviz = pn_visualizer.apply(net1, im1, fm1)
-            pn_visualizer.view(gviz) 
-        else:
+            if view:
+                gviz = pn_visualizer.apply(net1, im1, fm1)
+                pn_visualizer.view(gviz) 
+            return net1, im1, fm1
+        if view:
             gviz = pt_visualizer.apply(process_tree)
             pt_visualizer.view(gviz)
-    else:
-        dfg = dfg_discovery.apply(event_log)
+        return process_tree
+    dfg = dfg_discovery.apply(event_log)
+    if view:
         gviz = dfg_visualizer.apply(dfg)
         dfg_visualizer.view(gviz)
+    return dfg
 
-def divide_event_log_at(split_date: datetime, event_log_path: str):
+def divide_event_log_at(split_date: datetime, event_log):
     """
-    Splits the XES log at a given date.
+    Splits the flattened log at a given date.
     
     Parameters
     -------------------
     date
         Date to split the log at
-    event_log_path
-        Event log to split
+    event_log
+        Event log to split, either as path of a XES file or as DataFrame
 
     Returns
     ------------------
-    export_path_before
-        Path to event log before the date
-    export_path_after
-        Path to event log after the date
+    before
+        Path to event log before the date, or the event log as DataFrame if a DataFrame was given
+    after
+        Path to event log after the date, or the event log as DataFrame if a DataFrame was given
     """
-    event_log = xes_importer.apply(event_log_path)
-    split_date = pd.to_datetime(split_date)
+    event_log_path = event_log if isinstance(event_log, str) else None
+    event_log = _read_event_log(event_log).copy()
 
     event_log["time:timestamp"] = pd.to_datetime(event_log["time:timestamp"], utc=True)
-    traces_before = []
-    traces_after = []
+    split_date = pd.to_datetime(split_date)
+    split_date = split_date.tz_localize("UTC") if split_date.tzinfo is None else split_date
 
-    split_date = pd.to_datetime(split_date).tz_localize(None)
-    event_log["time:timestamp"] = pd.to_datetime(event_log["time:timestamp"], utc=True)
+    # A trace belongs to the log before the split date if any of its events happened before it
+    is_before = (event_log["time:timestamp"] < split_date).groupby(event_log["case:concept:name"]).transform("any")
+    df_before = event_log[is_before]
+    df_after = event_log[~is_before]
+    if df_before.empty or df_after.empty:
+        print("ERROR splitting log: split-date is not in range of event_log")
 
-    for _, trace_events in event_log.groupby("case:concept:name"): # type: ignore
-        if (trace_events["time:timestamp"] < split_date).any():
-            traces_before.append(trace_events)
-        else:
-            traces_after.append(trace_events)
+    if event_log_path is None:
+        return df_before, df_after
 
-    # Concatenate the traces back into DataFrames
-    df_before = pd.concat(traces_before) if traces_before else pd.DataFrame(columns=event_log.columns) # type: ignore
-    df_after = pd.concat(traces_after) if traces_after else pd.DataFrame(columns=event_log.columns) # type: ignore
-    if traces_before == [] or traces_after == []:
-        print("ERROR splitting log: split-date is not in range of event_log")
-    
     export_path_before = f"{event_log_path.split('.')[0]}-before.xes"
     export_path_after = f"{event_log_path.split('.')[0]}-after.xes"
 
     xes_exporter.apply(df_before, export_path_before)
     xes_exporter.apply(df_after, export_path_after)
 
-    return export_path_before, export_path_after
\ No newline at end of file
+    return export_path_before, export_path_after
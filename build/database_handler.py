@@ -1,11 +1,198 @@
+import atexit
+from collections import OrderedDict
+from copy import deepcopy
 from datetime import datetime
+import os
 from os import path
 from flask.cli import F
+from typing import Optional
 import pymongo
+from pymongo import ReplaceOne
 
-from build.utils import date_1970, generic_to_python_type, rename_field, write_json, write_to_file
+from build.ocel_stream import write_ocel_json
+from build.temporal_index import TemporalIndex
+from build.utils import date_1970, generic_to_python_type, rename_field, write_to_file
 
-myclient = pymongo.MongoClient("mongodb://localhost:27017/")
+myclient = pymongo.MongoClient(os.getenv("MONGODB_URI", "mongodb://localhost:27017/"))
+
+DEFAULT_WRITE_BATCH_SIZE = 1000
+DEFAULT_MAX_CACHED_OBJECTS = 100000
+
+class OCELWriter:
+    """
+    Buffer the writes of objects and events to the OCEL store.
+
+    Object and event types as well as recently written objects are cached in memory, such that attribute
+    histories are merged client-side without reading the object again. Pending objects and events are
+    keyed by their id, i.e. only the latest state of a document is written, which allows to flush them
+    with unordered bulk writes of `batch_size` operations. Checkpoint updates are buffered as well, merged
+    per checkpoint and written after the objects and events, such that a checkpoint never gets ahead of the data.
+    """
+    def __init__(self, client, batch_size: int = DEFAULT_WRITE_BATCH_SIZE, max_cached_objects: int = DEFAULT_MAX_CACHED_OBJECTS):
+        self.client = client
+        self.batch_size = batch_size
+        self.max_cached_objects = max_cached_objects
+        self._types = {}  # (collection, types collection, name): type document
+        self._objects = {}  # collection: OrderedDict of object id: object document
+        self._pending_objects = {}  # collection: set of object ids to write
+        self._pending_events = {}  # collection: dict of event id: event document
+        self._pending_checkpoints = {}  # collection: dict of checkpoint name: merged update
+        self._first_values = {}  # collection: dict of (object type, value of the first attribute): object id of cached objects
+
+    def get_type(self, types_collection: str, name: str, collection: str):
+        key = (collection, types_collection, name)
+        if key not in self._types:
+            self._types[key] = self.client[collection][types_collection].find_one({"_id": name})
+        return self._types[key]
+
+    def set_type(self, types_collection: str, name: str, attributes: list, collection: str):
+        self.client[collection][types_collection].replace_one({"_id": name}, {"attributes": attributes}, True)
+        self._types[(collection, types_collection, name)] = {"_id": name, "attributes": attributes}
+
+    def get_object(self, id, collection: str):
+        """
+        Get the current state of an object, including pending changes.
+        Reads the object from the database only if it is not cached.
+        """
+        objects = self._objects.setdefault(collection, OrderedDict())
+        if id in objects:
+            objects.move_to_end(id)
+            return objects[id]
+        document = self.client[collection]["objects"].find_one({"_id": id})
+        if document is not None:
+            self._cache_object(id, document, collection)
+        return document
+
+    def get_pending_object(self, id, collection: str):
+        if id in self._pending_objects.get(collection, set()):
+            return self._objects[collection][id]
+        return None
+
+    def get_pending_event(self, id, collection: str):
+        return self._pending_events.get(collection, {}).get(id)
+
+    def get_cached_object_by_first_value(self, object_type: str, value, collection: str):
+        """
+        Get a cached object by its type and the value of its first attribute, e.g. a user by its username.
+        Pending objects are always cached, thus an object not found here is up to date in the database.
+        """
+        id = self._first_values.get(collection, {}).get((object_type, value))
+        document = self._objects.get(collection, OrderedDict()).get(id)
+        if document is not None and document.get("type") == object_type and _first_value(document) == value:
+            return document
+        return None
+
+    def update_checkpoint(self, name: str, update: dict, collection: str):
+        # Later values override earlier ones, added values accumulate
+        pending = self._pending_checkpoints.setdefault(collection, {}).setdefault(name, {})
+        pending.setdefault("$set", {}).update(update.get("$set", {}))
+        for key, added in update.get("$addToSet", {}).items():
+            pending.setdefault("$addToSet", {}).setdefault(key, {"$each": []})["$each"].extend(added["$each"])
+        self._flush_if_full(collection)
+
+    def replace_object(self, id, document: dict, collection: str):
+        self._cache_object(id, {"_id": id, **document}, collection)
+        self._pending_objects.setdefault(collection, set()).add(id)
+        self._flush_if_full(collection)
+
+    def replace_event(self, id, document: dict, collection: str):
+        # Callers may reuse the passed attributes and relationships, thus do not keep references to them
+        self._pending_events.setdefault(collection, {})[id] = {"_id": id, **deepcopy(document)}
+        self._flush_if_full(collection)
+
+    def forget_object(self, id, collection: str):
+        """
+        Remove an object from the cache, e.g. after it was changed in the database directly.
+        """
+        document = self._objects.get(collection, OrderedDict()).pop(id, None)
+        self._pending_objects.get(collection, set()).discard(id)
+        if document is not None:
+            self._forget_first_value(id, document, collection)
+
+    def _cache_object(self, id, document: dict, collection: str):
+        objects = self._objects.setdefault(collection, OrderedDict())
+        if id in objects:
+            self._forget_first_value(id, objects[id], collection)
+        objects[id] = document
+        objects.move_to_end(id)
+        if _first_value(document) is not None:
+            self._first_values.setdefault(collection, {})[(document.get("type"), _first_value(document))] = id
+        if len(objects) > self.max_cached_objects:
+            # Pending objects must not be evicted before being written
+            self.flush(collection)
+            while len(objects) > self.max_cached_objects // 2:
+                evicted_id, evicted = objects.popitem(last=False)
+                self._forget_first_value(evicted_id, evicted, collection)
+
+    def _forget_first_value(self, id, document: dict, collection: str):
+        first_values = self._first_values.get(collection, {})
+        key = (document.get("type"), _first_value(document))
+        if first_values.get(key) == id:
+            del first_values[key]
+
+    def _flush_if_full(self, collection: str):
+        pending = len(self._pending_objects.get(collection, set())) + len(self._pending_events.get(collection, {})) + len(self._pending_checkpoints.get(collection, {}))
+        if pending >= self.batch_size:
+            self.flush(collection)
+
+    def flush(self, collection=None):
+        """
+        Write all pending objects and events of a collection, or of all collections if none is given.
+        """
+        collections = [collection] if collection is not None else list(set(self._pending_objects) | set(self._pending_events) | set(self._pending_checkpoints))
+        for collection in collections:
+            object_ids = self._pending_objects.pop(collection, set())
+            events = self._pending_events.pop(collection, {})
+            checkpoints = self._pending_checkpoints.pop(collection, {})
+            object_operations = [ReplaceOne({"_id": id}, _without_id(self._objects[collection][id]), upsert=True) for id in object_ids]
+            event_operations = [ReplaceOne({"_id": id}, _without_id(event), upsert=True) for id, event in events.items()]
+            self._bulk_write(collection, "objects", object_operations)
+            self._bulk_write(collection, "events", event_operations)
+            for name, update in checkpoints.items():
+                self.client[collection]["checkpoints"].update_one({"_id": name}, {key: value for key, value in update.items() if value}, upsert=True)
+
+    def _bulk_write(self, collection: str, documents_collection: str, operations: list):
+        for start in range(0, len(operations), self.batch_size):
+            try:
+                self.client[collection][documents_collection].bulk_write(operations[start:start + self.batch_size], ordered=False)
+            except (pymongo.errors.BulkWriteError, pymongo.errors.DocumentTooLarge, pymongo.errors.InvalidDocument) as e: # type: ignore
+                print(e)
+
+def _without_id(document: dict):
+    return {k: v for k, v in document.items() if k != "_id"}
+
+def _first_value(document: dict):
+    attributes = document.get("attributes")
+    return attributes[0].get("value") if attributes else None
+
+ocel_writer = OCELWriter(myclient, int(os.getenv("OCEL_WRITE_BATCH_SIZE", DEFAULT_WRITE_BATCH_SIZE)))
+
+def flush_ocel_writes(collection=None):
+    """
+    Write all buffered objects and events to the database.
+    Args:
+        collection (str): The collection to flush, or all collections if None.
+    """
+    ocel_writer.flush(collection)
+
+atexit.register(flush_ocel_writes)
+
+def set_client(client):
+    """
+    Use another MongoDB client, e.g. one that counts the database round trips of a benchmark.
+    Buffered writes are flushed with the previous client first.
+    Args:
+        client: The client, which behaves like a `pymongo.MongoClient`.
+    """
+    global myclient, ocel_writer
+    ocel_writer.flush()
+    myclient = client
+    ocel_writer = OCELWriter(client, ocel_writer.batch_size, ocel_writer.max_cached_objects)
+
+def _read_database(collection: str):
+    # Queries do not see buffered writes, thus flush them before reading
+    ocel_writer.flush(collection)
+    return myclient[f"{collection}"]
 
 ### Insert object-type functions
 def insert_commit(data, collection):
@@ -67,19 +254,15 @@ def insert_contribution_guideline(data, collection):
 
 ### Generic insert functions
 def insert_eventType(name, attributes, collection):
-    ocdb = myclient[f"{collection}"]
-    ocdb["eventTypes"].replace_one({"_id": name}, {"attributes": attributes}, True)
+    ocel_writer.set_type("eventTypes", name, attributes, collection)
 
 def insert_objectType(name, attributes, collection):
-    ocdb = myclient[f"{collection}"]
-    ocdb["objectTypes"].replace_one({"_id": name}, {"attributes": attributes}, True)
+    ocel_writer.set_type("objectTypes", name, attributes, collection)
 
 def insert_event(id, event_type: str, time, collection, attributes=[], relationships=[]):
-    ocdb = myclient[f"{collection}"]
-    ocdb["events"].replace_one({"_id": id}, {"type": event_type, "time": time, "attributes": attributes, "relationships": relationships}, True)
+    ocel_writer.replace_event(id, {"type": event_type, "time": time, "attributes": attributes, "relationships": relationships}, collection)
 
 def insert_object(id, object_type: str, data: dict, collection: str):
-    ocdb = myclient[f"{collection}"]
     attribute_keys = [attribute_key["name"] for attribute_key in list(get_object_type_by_type_name(object_type, collection)["attributes"])] # type: ignore
     timestamp_keys = [key for key in list(data.keys()) if key.find("timestamp") != -1]
     relationship_keys = list(set(data.keys()) - set(attribute_keys) - set(timestamp_keys))
@@ -87,11 +270,11 @@ def insert_object(id, object_type: str, data: dict, collection: str):
     relationships = []
 
     # Check if the object already exists
-    existing_object = ocdb["objects"].find_one({"_id": id})
+    existing_object = ocel_writer.get_object(id, collection)
 
     if not attribute_keys and not relationship_keys:
         # Replace object, as no times/relationships to update
-        ocdb["objects"].replace_one({"_id": id}, {"type": object_type}, True)
+        ocel_writer.replace_object(id, {"type": object_type}, collection)
         return
 
     if not existing_object:
@@ -105,7 +288,7 @@ def insert_object(id, object_type: str, data: dict, collection: str):
                 elif type(data[key]) != list:
                     relationships.append({"objectId": str(data[key]), "qualifier": key})
             if not attribute_keys:
-                ocdb["objects"].replace_one({"_id": id}, {"type": object_type, "relationships": relationships}, True)
+                ocel_writer.replace_object(id, {"type": object_type, "relationships": relationships}, collection)
                 return
         if attribute_keys:
             for key in attribute_keys:
@@ -115,7 +298,7 @@ def insert_object(id, object_type: str, data: dict, collection: str):
                     "time": str(date_1970()) if not timestamp_keys else data[timestamp_keys[0]]
                 })
             if not relationship_keys:
-                ocdb["objects"].replace_one({"_id": id}, {"type": object_type, "attributes": attributes}, True)
+                ocel_writer.replace_object(id, {"type": object_type, "attributes": attributes}, collection)
                 return
     else:
         # If the object exists, update it
@@ -152,15 +335,12 @@ def insert_object(id, object_type: str, data: dict, collection: str):
                 elif type(data[key]) != list:
                     relationships.append({"objectId": str(data[key]), "qualifier": key})
 
-    try:
-        # Update the object in the database
-        ocdb["objects"].replace_one(
-            {"_id": id}, 
-            {"type": object_type, "attributes": existing_attributes + attributes, "relationships": relationships}, 
-            True
-        )
-    except (pymongo.errors.DocumentTooLarge, pymongo.errors.InvalidDocument) as e: # type: ignore
-        print(e)
+    # Update the object, documents that are too large are reported when flushing
+    ocel_writer.replace_object(
+        id, 
+        {"type": object_type, "attributes": existing_attributes + attributes, "relationships": relationships}, 
+        collection
+    )
 
 def insert_ocel_object(object, collection: str):
     """
@@ -169,8 +349,7 @@ def insert_ocel_object(object, collection: str):
         object (dict): The object to insert, must contain 'id', 'type', 'attributes', and 'relationships'.
         collection (str): The collection to insert the object into.
     """
-    ocdb = myclient[f"{collection}"]
-    ocdb["objects"].replace_one({"_id": object["id"]}, {k: v for k, v in object.items() if k != "id"}, True)
+    ocel_writer.replace_object(object["id"], deepcopy({k: v for k, v in object.items() if k != "id"}), collection)
 
 def insert_ocel_event(event, collection: str):
     """
@@ -179,38 +358,56 @@ def insert_ocel_event(event, collection: str):
         event (dict): The event to insert, must contain 'id', 'type', 'attributes', and 'relationships'.
         collection (str): The collection to insert the event into.
     """
-    ocdb = myclient[f"{collection}"]
-    ocdb["events"].replace_one({"_id": event["id"]}, {k: v for k, v in event.items() if k != "id"}, True)
+    ocel_writer.replace_event(event["id"], {k: v for k, v in event.items() if k != "id"}, collection)
 
 
 ### Get functions
 def get_commits(collection: str):
-    ocdb = myclient[f"{collection}"]
+    ocdb = _read_database(collection)
     return ocdb["objects"].find({"type": "commit"})
 
 def get_files(collection: str):
-    ocdb = myclient[f"{collection}"]
+    ocdb = _read_database(collection)
     return ocdb["objects"].find({"type": "file"})
 
 def get_pull_requests(collection: str):
-    ocdb = myclient[f"{collection}"]
+    ocdb = _read_database(collection)
     return ocdb["objects"].find({"type": "pull_request"})
 
+def get_users(collection: str):
+    ocdb = _read_database(collection)
+    return ocdb["objects"].find({"type": "user"}, {"type": 1, "attributes": 1})
+
+def get_pull_request_events(collection: str):
+    """
+    Get all events related to any pull request in one aggregation, instead of one query per pull request.
+    Args:
+        collection (str): The collection to search in.
+    Returns:
+        A cursor over the events related to at least one pull request, in their natural order.
+    """
+    ocdb = _read_database(collection)
+    pull_request_ids = ocdb["objects"].distinct("_id", {"type": "pull_request"})
+    return ocdb["events"].aggregate([
+        {"$match": {"relationships.objectId": {"$in": pull_request_ids}}},
+        {"$project": {"type": 1, "time": 1, "attributes": 1, "relationships": 1}}
+    ])
+
 def get_object_type_by_type_name(type: str, collection: str):
-    ocdb = myclient[f"{collection}"]
-    object = ocdb["objectTypes"].find_one({"_id": type})
-    return object
+    return ocel_writer.get_type("objectTypes", type, collection)
+
+def get_event_type_by_type_name(type: str, collection: str):
+    return ocel_writer.get_type("eventTypes", type, collection)
 
 def get_type_of_object(object_id: str, collection: str):
-    ocdb = myclient[f"{collection}"]
-    object = ocdb["objects"].find_one({"_id": object_id})
+    object = get_object(object_id, collection)
     if object:
         return object.get("type")
     print(f"ERROR: No object found for id: {object_id}")
     return None
 
 def get_events_for_eventType(type: str, collection: str):
-    ocdb = myclient[f"{collection}"]
+    ocdb = _read_database(collection)
     return ocdb["events"].find({"type": type})
 
 def get_events_for_object(object_id: str, collection: str):
@@ -222,7 +419,7 @@ def get_events_for_object(object_id: str, collection: str):
     Returns:
         list: A list of events related to the specified object.
     """
-    ocdb = myclient[f"{collection}"]
+    ocdb = _read_database(collection)
     return ocdb["events"].find({"relationships.objectId": object_id})
 
 def get_object(object_id: str, collection: str):
@@ -234,8 +431,10 @@ def get_object(object_id: str, collection: str):
     Returns:
         dict: The object data if found, otherwise None.
     """
-    ocdb = myclient[f"{collection}"]
-    return ocdb["objects"].find_one({"_id": object_id})
+    pending_object = ocel_writer.get_pending_object(object_id, collection)
+    if pending_object is not None:
+        return pending_object
+    return myclient[f"{collection}"]["objects"].find_one({"_id": object_id})
 
 def get_event(event_id: str, collection: str):
     """
@@ -246,21 +445,30 @@ def get_event(event_id: str, collection: str):
     Returns:
         dict: The event data if found, otherwise None.
     """
-    ocdb = myclient[f"{collection}"]
-    return ocdb["events"].find_one({"_id": event_id}) 
+    pending_event = ocel_writer.get_pending_event(event_id, collection)
+    if pending_event is not None:
+        return pending_event
+    return myclient[f"{collection}"]["events"].find_one({"_id": event_id})
 
-def get_ocel_data(collection: str):
-    ocdb = myclient[f"{collection}"]
-    data = {
-        "objectTypes": [rename_field(doc, "_id", "name") for doc in ocdb["objectTypes"].find()],
-        "eventTypes": [rename_field(doc, "_id", "name") for doc in ocdb["eventTypes"].find()],
-        "objects": [rename_field(doc, "_id", "id") for doc in ocdb["objects"].find()],
-        "events": [rename_field(doc, "_id", "id") for doc in ocdb["events"].find()]
-    }
-    # Return data as JSON
-    path = f"Exports/{collection}-OCEL.json"
-    
-    write_json(path, data)
+def get_ocel_data(collection: str, path: Optional[str] = None):
+    """
+    Export the OCEL of a collection as OCEL 2.0 JSON file.
+    The documents are streamed from the database cursors into the file, i.e. the log is never held in memory.
+    Args:
+        collection (str): The collection to export.
+        path (str, optional): The path of the file, by default `Exports/{collection}-OCEL.json`.
+    Returns:
+        str: The path of the exported file.
+    """
+    ocdb = _read_database(collection)
+    if path is None:
+        path = f"Exports/{collection}-OCEL.json"
+    write_ocel_json(path, {
+        "objectTypes": (rename_field(doc, "_id", "name") for doc in ocdb["objectTypes"].find()),
+        "eventTypes": (rename_field(doc, "_id", "name") for doc in ocdb["eventTypes"].find()),
+        "objects": (rename_field(doc, "_id", "id") for doc in ocdb["objects"].find()),
+        "events": (rename_field(doc, "_id", "id") for doc in ocdb["events"].find())
+    })
     return path
 
 def get_user_by_username(username: str, collection: str):
@@ -272,8 +480,11 @@ def get_user_by_username(username: str, collection: str):
     Returns:
         dict: The user data if found, otherwise None.
     """
-    ocdb = myclient[f"{collection}"]
-    return ocdb["objects"].find_one({"type": "user", "attributes.0.value": username})
+    # Pending users are cached by the writer, thus the database is only queried for users, which are up to date there
+    user = ocel_writer.get_cached_object_by_first_value("user", username, collection)
+    if user is not None:
+        return user
+    return myclient[f"{collection}"]["objects"].find_one({"type": "user", "attributes.0.value": username})
 
 def get_is_user_bot(user_id: str, collection: str):
     """
@@ -327,6 +538,19 @@ def get_attribute_value_at_time(id, attribute_name, time, collection):
 
     return None
 
+def get_temporal_index(collection: str, object_types: Optional[list] = None):
+    """
+    Build an in-memory index of the attribute histories of the objects in a collection for point-in-time queries.
+    Args:
+        collection (str): The collection to index.
+        object_types (list, optional): The object types to index, by default all object types.
+    Returns:
+        TemporalIndex: The index, which answers the same queries as `get_attribute_value_at_time` without database round trips.
+    """
+    ocdb = _read_database(collection)
+    query = {"type": {"$in": object_types}} if object_types else {}
+    return TemporalIndex.from_objects(ocdb["objects"].find(query, {"type": 1, "attributes": 1}), ocdb["objectTypes"].find())
+
 def get_attribute_value(id, attribute_name, collection):
     """
     Get the (first) value of an object attribute.
@@ -430,6 +654,43 @@ def get_attribute_time(id, attribute_name, collection):
         if attribute["name"] == attribute_name:
             return attribute["time"]
 
+### Checkpoint functions
+def get_checkpoint(name: str, collection: str):
+    """
+    Get the checkpoint of an extraction run.
+    Args:
+        name (str): The name of the extraction, e.g. "local" or "remote".
+        collection (str): The collection the extraction writes to.
+    Returns:
+        dict: The checkpoint if found, otherwise None.
+    """
+    ocdb = _read_database(collection)
+    return ocdb["checkpoints"].find_one({"_id": name})
+
+def update_checkpoint(name: str, collection: str, values: dict, added_values: dict = {}):
+    """
+    Record the progress of an extraction run. The update is buffered and written after all objects and events buffered before it.
+    Args:
+        name (str): The name of the extraction, e.g. "local" or "remote".
+        collection (str): The collection the extraction writes to.
+        values (dict): The fields of the checkpoint to set.
+        added_values (dict): Lists of values to add to the list fields of the checkpoint.
+    """
+    update = {"$set": values} if values else {}
+    if added_values:
+        update["$addToSet"] = {key: {"$each": value} for key, value in added_values.items()}
+    ocel_writer.update_checkpoint(name, update, collection)
+
+def delete_checkpoint(name: str, collection: str):
+    """
+    Delete the checkpoint of an extraction run, such that the next run starts from the beginning.
+    Args:
+        name (str): The name of the extraction, e.g. "local" or "remote".
+        collection (str): The collection the extraction writes to.
+    """
+    ocdb = _read_database(collection)
+    ocdb["checkpoints"].delete_one({"_id": name})
+
 ### Update functions
 def update_attribute(id: str, attribute_name: str, new_value: str, time: str, collection: str, update_id: bool = False):
     """
@@ -449,7 +710,8 @@ def update_attribute(id: str, attribute_name: str, new_value: str, time: str, co
         time (str): The time when the attribute was updated.
         collection (str): The collection to update the object in.
     """ 
-    ocdb = myclient[f"{collection}"]
+    ocdb = _read_database(collection)
+    ocel_writer.forget_object(id, collection)
     ocdb["objects"].update_one(
         {"_id": id},
         {"$push": {
@@ -466,12 +728,23 @@ def update_attribute(id: str, attribute_name: str, new_value: str, time: str, co
             print(f"WARNING: Wanted to update value for {attribute_name} in non-existent document with id: {id}")
             return
         doc["_id"] = new_value
-        ocdb["objects"].insert(doc)
+        ocel_writer.forget_object(new_value, collection)
+        ocdb["objects"].replace_one({"_id": new_value}, doc, True)
 
 ### Initialisation functions
 def initialise_database(repo_path):
     initialise_objectTypes(repo_path)
     initialise_eventTypes(repo_path)
+    initialise_indexes(repo_path)
+
+def initialise_indexes(repo_path):
+    collection = repo_path.split("/")[-1]
+    ocdb = myclient[f"{collection}"]
+    # Used by get_events_for_object and get_events_for_eventType
+    ocdb["events"].create_index("relationships.objectId")
+    ocdb["events"].create_index("type")
+    # Used by get_commits/get_files/get_pull_requests and get_user_by_username
+    ocdb["objects"].create_index([("type", pymongo.ASCENDING), ("attributes.0.value", pymongo.ASCENDING)])
 
 def initialise_objectTypes(repo_path):
     collection = repo_path.split("/")[-1]
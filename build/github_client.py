@@ -0,0 +1,279 @@
+import asyncio
+from datetime import datetime
+import json
+import os
+import sqlite3
+import time
+from typing import AsyncIterator, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import aiohttp
+
+DEFAULT_API_URL = "https://api.github.com"
+DEFAULT_CACHE_PATH = "Exports/github-cache.sqlite"
+DEFAULT_MAX_CONCURRENCY = 8
+DEFAULT_PER_PAGE = 100
+MAX_RETRIES = 5
+
+def with_query(url: str, **params) -> str:
+    """
+    Add query parameters to a URL, keeping parameters the URL already has.
+    """
+    parts = urlsplit(url)
+    query = dict(parse_qsl(parts.query))
+    for name, value in params.items():
+        query.setdefault(name, str(value))
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+def get_next_url(link_header: Optional[str]) -> Optional[str]:
+    """
+    Get the URL of the next page from a `Link` header of a paginated response.
+    Args:
+        link_header (str): The value of the `Link` header, e.g. `<https://...&page=2>; rel="next", <...>; rel="last"`.
+    Returns:
+        str: The URL of the next page, or None if the response is the last page.
+    """
+    if not link_header:
+        return None
+    for link in link_header.split(","):
+        segments = link.split(";")
+        url = segments[0].strip()
+        if url.startswith("<") and url.endswith(">") and any(segment.strip() == 'rel="next"' for segment in segments[1:]):
+            return url[1:-1]
+    return None
+
+class ResponseCache:
+    """
+    On-disk cache of API responses for conditional requests.
+
+    Each successful response is stored with its `ETag` and `Link` header under its URL. Repeated requests
+    send the ETag as `If-None-Match`, and a `304 Not Modified` answer, which does not count against the
+    rate limit, is served from the cache.
+    """
+    def __init__(self, path: str = DEFAULT_CACHE_PATH):
+        self.path = path
+        self._connection = None
+
+    def _connect(self):
+        if self._connection is None:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._connection = sqlite3.connect(self.path, timeout=60)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute("""CREATE TABLE IF NOT EXISTS responses (
+                url TEXT PRIMARY KEY,
+                etag TEXT NOT NULL,
+                link TEXT,
+                body TEXT NOT NULL)""")
+            self._connection.commit()
+        return self._connection
+
+    def get(self, url: str) -> Optional[Tuple[str, Optional[str], object]]:
+        """
+        Get a cached response.
+        Args:
+            url (str): The requested URL.
+        Returns:
+            tuple: The (etag, link, body) of the cached response, or None if the URL is not cached.
+        """
+        row = self._connect().execute("SELECT etag, link, body FROM responses WHERE url = ?", (url,)).fetchone()
+        if row is None:
+            return None
+        return row[0], row[1], json.loads(row[2])
+
+    def set(self, url: str, etag: str, link: Optional[str], body):
+        connection = self._connect()
+        with connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO responses (url, etag, link, body) VALUES (?, ?, ?, ?)",
+                (url, etag, link, json.dumps(body))
+            )
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+class RateLimitBudget:
+    """
+    Bound the number of concurrent requests by the remaining rate limit of the API.
+
+    At most `max_concurrency` requests are in flight, and never more than the `x-ratelimit-remaining`
+    budget reported by the latest response. Once the budget is exhausted, requests wait for the reset.
+    """
+    def __init__(self, max_concurrency: int = DEFAULT_MAX_CONCURRENCY):
+        self.max_concurrency = max_concurrency
+        self.remaining = None  # Unknown until the first response
+        self.reset = 0.0
+        self._in_flight = 0
+        self._condition = asyncio.Condition()
+
+    def _limit(self):
+        if self.remaining is None:
+            return self.max_concurrency
+        return min(self.max_concurrency, self.remaining)
+
+    async def acquire(self):
+        async with self._condition:
+            while self._in_flight >= self._limit():
+                if self._in_flight == 0:
+                    # No pending response can update the budget anymore, thus wait for the reset
+                    retry_after = max(self.reset - time.time(), 0) + 1
+                    retry_time = datetime.fromtimestamp(time.time() + retry_after)
+                    print(f"WARNING: Rate limit exhausted. Retrying after {int(retry_after)} seconds at {retry_time.strftime('%H:%M:%S')}.")
+                    await asyncio.sleep(retry_after)
+                    self.remaining = None
+                else:
+                    await self._condition.wait()
+            self._in_flight += 1
+
+    async def release(self, headers=None):
+        async with self._condition:
+            self._in_flight -= 1
+            if headers is not None:
+                self.update(headers)
+            self._condition.notify_all()
+
+    def update(self, headers):
+        """
+        Update the budget from the rate limit headers of a response.
+        """
+        if "x-ratelimit-remaining" not in headers:
+            return
+        remaining = int(headers["x-ratelimit-remaining"])
+        reset = float(headers.get("x-ratelimit-reset", 0))
+        if self.remaining is None or reset > self.reset:
+            self.remaining, self.reset = remaining, reset
+        elif reset == self.reset:
+            # Responses arrive out of order, the lowest budget of the window is the latest one
+            self.remaining = min(self.remaining, remaining)
+
+class GitHubClient:
+    """
+    Asynchronous client for the GitHub REST API.
+
+    Requests share one pooled session, are bounded by the rate limit budget, follow the `Link` header
+    for pagination and are conditional on the ETag of the cached response. User profiles are memoised,
+    such that each user is requested at most once per client.
+    Use the client as async context manager:
+
+        async with GitHubClient() as client:
+            repo = await client.get("https://api.github.com/repos/owner/name")
+    """
+    def __init__(self, token: Optional[str] = None, base_url: Optional[str] = None, cache_path: Optional[str] = None, max_concurrency: Optional[int] = None):
+        self.token = token if token is not None else os.getenv("GITHUB_TOKEN")
+        self.base_url = (base_url or os.getenv("GITHUB_API_URL", DEFAULT_API_URL)).rstrip("/")
+        self.cache = ResponseCache(cache_path or os.getenv("GITHUB_CACHE_PATH", DEFAULT_CACHE_PATH))
+        self.max_concurrency = max_concurrency or int(os.getenv("GITHUB_MAX_CONCURRENCY", DEFAULT_MAX_CONCURRENCY))
+        self.statistics = {"requests": 0, "not_modified": 0, "retries": 0}
+        self._budget = None
+        self._session = None
+        self._users = {}  # login: task of the user request
+
+    async def __aenter__(self):
+        headers = {"Accept": "application/vnd.github+json"}
+        if self.token:
+            headers["Authorization"] = f"token {self.token}"
+        self._budget = RateLimitBudget(self.max_concurrency)
+        self._session = aiohttp.ClientSession(
+            headers=headers,
+            connector=aiohttp.TCPConnector(limit=self.max_concurrency)
+        )
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self._session.close() # type: ignore
+        self._session = None
+        self.cache.close()
+
+    async def _request(self, url: str):
+        cached = self.cache.get(url)
+        headers = {"If-None-Match": cached[0]} if cached else {}
+        retries = 0
+        while True:
+            await self._budget.acquire() # type: ignore
+            response_headers = None
+            try:
+                self.statistics["requests"] += 1
+                async with self._session.get(url, headers=headers) as response: # type: ignore
+                    response_headers = response.headers
+                    if response.status == 304 and cached:
+                        self.statistics["not_modified"] += 1
+                        return cached[2], cached[1]
+                    if response.ok:
+                        body = await response.json(content_type=None)
+                        link = response.headers.get("Link")
+                        if response.headers.get("ETag"):
+                            self.cache.set(url, response.headers["ETag"], link, body)
+                        return body, link
+                    # Only 429 and a 403 for an exhausted or secondary rate limit are retried, other 403 deny access
+                    rate_limited = response.headers.get("x-ratelimit-remaining") == "0"
+                    if retries >= MAX_RETRIES or not (response.status == 429 or (response.status == 403 and (rate_limited or "retry-after" in response.headers))):
+                        response.raise_for_status()
+                    if rate_limited:
+                        # The budget holds back all requests until the reset
+                        retry_after = 0
+                    else:
+                        retry_after = int(response.headers.get("retry-after", 60)) * 2 ** retries
+                        retry_time = datetime.fromtimestamp(time.time() + retry_after)
+                        print(f"WARNING: Secondary rate limit exceeded. Retrying after {retry_after} seconds at {retry_time.strftime('%H:%M:%S')}.")
+            finally:
+                await self._budget.release(response_headers) # type: ignore
+            retries += 1
+            self.statistics["retries"] += 1
+            await asyncio.sleep(retry_after)
+
+    async def get(self, url: str):
+        """
+        Get the JSON body of a single API response.
+        Args:
+            url (str): The URL of the resource.
+        Returns:
+            The decoded JSON body.
+        """
+        body, _ = await self._request(url)
+        return body
+
+    async def iterate_pages(self, url: str, max_pages: Optional[int] = None) -> AsyncIterator[Tuple[str, list]]:
+        """
+        Iterate over the pages of a paginated resource by following the `Link` header.
+        Args:
+            url (str): The URL of the first page.
+            max_pages (int, optional): The maximum number of pages to request.
+        Returns:
+            An async iterator of (page_url, items) tuples.
+        """
+        pages = 0
+        next_url = url
+        while next_url and (max_pages is None or pages < max_pages):
+            body, link = await self._request(next_url)
+            yield next_url, body
+            next_url = get_next_url(link)
+            pages += 1
+
+    async def get_all(self, url: str) -> list:
+        """
+        Get all items of a paginated resource.
+        Args:
+            url (str): The URL of the resource, requested with the maximum page size.
+        Returns:
+            list: The items of all pages.
+        """
+        items = []
+        async for _, page in self.iterate_pages(with_query(url, per_page=DEFAULT_PER_PAGE)):
+            items.extend(page)
+        return items
+
+    async def get_user(self, login: str) -> dict:
+        """
+        Get the profile of a user, which is requested at most once per client.
+        """
+        if login not in self._users:
+            self._users[login] = asyncio.ensure_future(self.get(f"{self.base_url}/users/{login}"))
+        try:
+            return await self._users[login]
+        except Exception:
+            # Do not memoise failed requests
+            self._users.pop(login, None)
+            raise
@@ -0,0 +1,331 @@
+from datetime import datetime, timedelta, timezone
+import hashlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import random
+import sqlite3
+import threading
+import time
+from typing import Optional
+from urllib.parse import parse_qsl, unquote, urlencode, urlsplit
+
+from build.github_client import DEFAULT_API_URL, DEFAULT_PER_PAGE
+
+DEFAULT_START_DATE = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+LABELS = ["bug", "enhancement", "documentation", "needs review", "good first issue"]
+
+def _format_time(time: datetime) -> str:
+    return time.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+def normalise_url(url: str, base_url: str = "") -> str:
+    """
+    Get the key of a fixture response, i.e. the path and the sorted query of a URL relative to the base URL.
+    """
+    if base_url and url.startswith(base_url):
+        url = url[len(base_url):]
+    parts = urlsplit(url)
+    path = unquote(parts.path).rstrip("/")
+    query = urlencode(sorted(parse_qsl(parts.query)))
+    return f"{path}?{query}" if query else path
+
+def _add_pages(responses: dict, base_url: str, path: str, params: dict, items: list, per_page: int = DEFAULT_PER_PAGE):
+    # Split a resource into pages, which link to the next page like the API does
+    pages = [items[start:start + per_page] for start in range(0, len(items), per_page)] or [[]]
+    for number, page in enumerate(pages, 1):
+        page_params = dict(params, **({"page": number} if number > 1 else {}))
+        link = None
+        if number < len(pages):
+            link = f'<{base_url}{path}?{urlencode(dict(params, page=number + 1))}>; rel="next"'
+        responses[normalise_url(f"{path}?{urlencode(page_params)}")] = {"body": page, "link": link}
+
+def _user(login: str, is_bot: bool = False) -> dict:
+    return {"login": login, "type": "Bot" if is_bot else "User"}
+
+def _timeline(rng: random.Random, number: int, created_at: datetime, events: int, author: str, reviewers: list,
+              users: list, commit_shas: list, merged: bool, end: datetime) -> list:
+    timeline = []
+    step = (end - created_at) / (events + 1)
+    for index in range(events):
+        time = created_at + step * (index + 1)
+        node_id = f"E_{number}_{index}"
+        actor = rng.choice(users)
+        kind = "review_requested" if index == 0 and reviewers else rng.choice(
+            ["commented", "commented", "committed", "committed", "reviewed", "reviewed", "labeled", "unlabeled", "renamed", "review_requested"]
+        )
+        if kind == "committed":
+            timeline.append({
+                "event": "committed",
+                "node_id": node_id,
+                "sha": rng.choice(commit_shas) if commit_shas else hashlib.sha1(node_id.encode()).hexdigest(),
+                "committer": {"name": author, "date": _format_time(time)},
+            })
+        elif kind == "reviewed":
+            timeline.append({
+                "event": "reviewed",
+                "id": number * 10000 + index,
+                "node_id": node_id,
+                "state": rng.choice(["approved", "changes_requested", "commented"]),
+                "user": _user(rng.choice(reviewers or users)),
+                "submitted_at": _format_time(time),
+            })
+        else:
+            event = {"event": kind, "node_id": node_id, "actor": _user(actor), "created_at": _format_time(time)}
+            if kind == "commented":
+                event["body"] = f"Comment {index} on pull request {number}."
+            elif kind in ["labeled", "unlabeled"]:
+                event["label"] = {"name": rng.choice(LABELS)}
+            elif kind == "renamed":
+                event["rename"] = {"from": f"Pull request {number}", "to": f"Pull request {number}, revised"}
+            elif kind == "review_requested":
+                event["requested_reviewer"] = _user(rng.choice(reviewers or users))
+                event["review_requester"] = _user(author)
+            timeline.append(event)
+    if merged:
+        timeline.append({"event": "merged", "node_id": f"M_{number}", "actor": _user(author), "created_at": _format_time(end)})
+    timeline.append({"event": "closed", "node_id": f"C_{number}", "actor": _user(author), "created_at": _format_time(end)})
+    return timeline
+
+def generate_github_fixtures(repository: str, pull_requests: int = 20, events_per_pull: int = 10, commit_shas: Optional[list] = None,
+                             files: Optional[list] = None, users: int = 10, bots: int = 1, seed: int = 0,
+                             start_date: datetime = DEFAULT_START_DATE, period: timedelta = timedelta(days=30)) -> dict:
+    """
+    Generate the GitHub API responses of a repository with closed pull requests, which is deterministic for a seed.
+    The responses cover all requests of the remote repository extractor, i.e. the repository, its pull requests
+    and commits, and the commits, files and timeline of each pull request, as well as the profiles of all users.
+    Args:
+        repository (str): The full name of the repository, i.e. "owner/name".
+        pull_requests (int): The number of closed pull requests.
+        events_per_pull (int): The number of timeline events of a pull request, besides merging and closing it.
+        commit_shas (list): The SHAs of the commits of the repository, which pull requests refer to.
+        files (list): The paths of the files of the repository, which pull requests change.
+        users (int): The number of users.
+        bots (int): The number of bots among the users.
+        seed (int): The seed of the random generator.
+        start_date (datetime): The creation time of the first pull request.
+        period (timedelta): The period, in which the pull requests are created.
+    Returns:
+        dict: The fixtures with the `repository`, the `base_url` of the URLs in the responses and the `responses`
+            by `normalise_url` of the requested URL, each with its JSON `body` and `Link` header.
+    """
+    rng = random.Random(seed)
+    base_url = DEFAULT_API_URL
+    repo_path = f"/repos/{repository}"
+    commit_shas = list(commit_shas or [])
+    files = list(files or [])
+    logins = [f"user-{index}" for index in range(max(users - bots, 1))] + [f"bot-{index}[bot]" for index in range(bots)]
+    humans = logins[:max(users - bots, 1)]
+    responses = {}
+
+    responses[normalise_url(repo_path)] = {"body": {
+        "full_name": repository,
+        "updated_at": _format_time(start_date + period),
+        "created_at": _format_time(start_date - timedelta(days=365)),
+        "forks": 0,
+        "forks_url": f"{base_url}{repo_path}/forks",
+        "pulls_url": f"{base_url}{repo_path}/pulls{{/number}}",
+        "issues_url": f"{base_url}{repo_path}/issues{{/number}}",
+        "commits_url": f"{base_url}{repo_path}/commits{{/sha}}",
+    }, "link": None}
+    responses[normalise_url(f"{repo_path}/commits")] = {"body": [{"sha": sha} for sha in reversed(commit_shas[-30:])], "link": None}
+
+    pulls = []
+    for number in range(1, pull_requests + 1):
+        created_at = start_date + period * (number - 1) / max(pull_requests, 1)
+        closed_at = created_at + timedelta(hours=rng.randint(1, 240))
+        merged = rng.random() < 0.7
+        author = rng.choice(logins)
+        reviewers = rng.sample(humans, min(rng.randint(0, 2), len(humans)))
+        pull_url = f"{base_url}{repo_path}/pulls/{number}"
+        issue_url = f"{base_url}{repo_path}/issues/{number}"
+        pull_commits = rng.sample(commit_shas, min(rng.randint(1, 3), len(commit_shas)))
+        pulls.append({
+            "number": number,
+            "url": pull_url,
+            "issue_url": issue_url,
+            "commits_url": f"{pull_url}/commits",
+            "state": "closed",
+            "title": f"Pull request {number}",
+            "body": f"Fixes #{number}.",
+            "user": _user(author, author.endswith("[bot]")),
+            "author_association": rng.choice(["MEMBER", "CONTRIBUTOR", "NONE"]),
+            "requested_reviewers": [_user(reviewer) for reviewer in reviewers],
+            "assignees": [],
+            "created_at": _format_time(created_at),
+            "updated_at": _format_time(closed_at),
+            "closed_at": _format_time(closed_at),
+            "merged_at": _format_time(closed_at) if merged else None,
+            "merge_commit_sha": rng.choice(commit_shas) if merged and commit_shas else None,
+        })
+        _add_pages(responses, base_url, f"{repo_path}/pulls/{number}/commits", {"per_page": DEFAULT_PER_PAGE}, [{"sha": sha} for sha in pull_commits])
+        _add_pages(responses, base_url, f"{repo_path}/pulls/{number}/files", {"per_page": DEFAULT_PER_PAGE},
+                   [{"filename": file} for file in rng.sample(files, min(rng.randint(1, 5), len(files)))])
+        timeline = _timeline(rng, number, created_at, events_per_pull, author, reviewers, logins, pull_commits, merged, closed_at)
+        _add_pages(responses, base_url, f"{repo_path}/issues/{number}/timeline", {"per_page": DEFAULT_PER_PAGE}, timeline)
+
+    # The newest pull requests come first, where the extractor requests the last updated ones first
+    pulls.reverse()
+    responses[normalise_url(f"{repo_path}/pulls")] = {"body": pulls[:30], "link": None}
+    pulls.sort(key=lambda pull: pull["updated_at"], reverse=True)
+    _add_pages(responses, base_url, f"{repo_path}/pulls", {"state": "closed", "sort": "updated", "direction": "desc", "per_page": DEFAULT_PER_PAGE}, pulls)
+
+    for login in logins:
+        is_bot = login.endswith("[bot]")
+        responses[normalise_url(f"/users/{login}")] = {"body": {
+            "login": login,
+            # Some users do not share their name, which the extractor counts as anonymous
+            "name": None if is_bot or rng.random() < 0.2 else login.replace("-", " ").title(),
+            "type": "Bot" if is_bot else "User",
+            "updated_at": _format_time(start_date - timedelta(days=rng.randint(1, 365))),
+        }, "link": None}
+
+    return {"repository": repository, "base_url": base_url, "responses": responses}
+
+def fixtures_from_response_cache(cache_path: str, repository: str, base_url: str = DEFAULT_API_URL) -> dict:
+    """
+    Record fixtures from the response cache of a run against the GitHub API, see `ResponseCache`.
+    Args:
+        cache_path (str): The path of the SQLite response cache.
+        repository (str): The full name of the repository, i.e. "owner/name", whose responses to record.
+        base_url (str): The base URL of the API the responses were requested from.
+    Returns:
+        dict: The fixtures in the format of `generate_github_fixtures`.
+    """
+    responses = {}
+    connection = sqlite3.connect(cache_path)
+    try:
+        for url, link, body in connection.execute("SELECT url, link, body FROM responses"):
+            key = normalise_url(url, base_url)
+            if key.startswith(f"/repos/{repository}") or key.startswith("/users/"):
+                responses[key] = {"body": json.loads(body), "link": link}
+    finally:
+        connection.close()
+    return {"repository": repository, "base_url": base_url, "responses": responses}
+
+def get_pull_request_period(fixtures: dict):
+    """
+    Get the creation times of the first and the last pull request of fixtures, or None if they have no pull requests.
+    """
+    times = [
+        datetime.fromisoformat(item["created_at"].replace("Z", "+00:00"))
+        for response in fixtures["responses"].values() if isinstance(response["body"], list)
+        for item in response["body"] if isinstance(item, dict) and "number" in item and item.get("created_at")
+    ]
+    return (min(times), max(times)) if times else None
+
+def write_fixtures(fixtures: dict, path: str):
+    with open(path, "w") as file:
+        json.dump(fixtures, file)
+
+def load_fixtures(path: str) -> dict:
+    with open(path, "r") as file:
+        return json.load(file)
+
+class FixtureServer:
+    """
+    Local HTTP server answering GitHub API requests from fixtures.
+
+    The URLs in the responses point to the server instead of the recorded API, each response has an
+    `ETag`, such that conditional requests are answered by `304 Not Modified` like by the API, and the
+    rate limit never runs out. Requests without fixture are answered by `404 Not Found`. A fixture response
+    may list `errors`, each with a `status` and `headers`, which answer the first requests of its URL in order,
+    e.g. to exceed a rate limit.
+    Use the server as context manager:
+
+        with FixtureServer(generate_github_fixtures("owner/name")) as server:
+            os.environ["GITHUB_API_URL"] = server.url
+    """
+    def __init__(self, fixtures: dict, host: str = "127.0.0.1", port: int = 0):
+        self.fixtures = fixtures
+        self.statistics = {"requests": 0, "not_modified": 0, "not_found": 0, "errors": 0}
+        self._responses = {}
+        self._errors = {key: list(response["errors"]) for key, response in fixtures["responses"].items() if response.get("errors")}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self.url = f"http://{host}:{self._server.server_address[1]}"
+        self._thread = None
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join() # type: ignore
+
+    def _get_response(self, key: str):
+        # Encode each response once, replacing the recorded base URL by the URL of the server
+        if key not in self._responses:
+            response = self.fixtures["responses"].get(key)
+            if response is None:
+                return None
+            body = json.dumps(response["body"]).replace(self.fixtures["base_url"], self.url).encode("utf-8")
+            link = response["link"].replace(self.fixtures["base_url"], self.url) if response.get("link") else None
+            self._responses[key] = (body, link, f'"{hashlib.md5(body).hexdigest()}"')
+        return self._responses[key]
+
+    def _next_error(self, key: str):
+        with self._lock:
+            errors = self._errors.get(key)
+            return errors.pop(0) if errors else None
+
+    def _count(self, statistic: str):
+        with self._lock:
+            self.statistics[statistic] += 1
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server._count("requests")
+                response = server._get_response(normalise_url(self.path))
+                if response is None:
+                    server._count("not_found")
+                    self.send_response(404)
+                    self.send_header("Content-Type", "application/json")
+                    self.end_headers()
+                    self.wfile.write(b'{"message": "Not Found"}')
+                    return
+                error = server._next_error(normalise_url(self.path))
+                if error is not None:
+                    server._count("errors")
+                    self.send_response(error["status"])
+                    self.send_header("Content-Type", "application/json")
+                    for name, value in error.get("headers", {}).items():
+                        self.send_header(name, value)
+                    if "x-ratelimit-remaining" not in error.get("headers", {}):
+                        self._send_rate_limit()
+                    self.end_headers()
+                    self.wfile.write(json.dumps({"message": error.get("message", "Error")}).encode("utf-8"))
+                    return
+                body, link, etag = response
+                if self.headers.get("If-None-Match") == etag:
+                    server._count("not_modified")
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self._send_rate_limit()
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("ETag", etag)
+                if link:
+                    self.send_header("Link", link)
+                self._send_rate_limit()
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _send_rate_limit(self):
+                self.send_header("x-ratelimit-remaining", "5000")
+                self.send_header("x-ratelimit-reset", str(int(time.time()) + 3600))
+
+            def log_message(self, format, *args):
+                # Do not log every request
+                pass
+
+        return Handler
@@ -0,0 +1,182 @@
+from contextlib import contextmanager
+from multiprocessing import Value
+import resource
+import sys
+import time
+import traceback
+from pymongo.collection import Collection
+from pymongo.database import Database
+
+# Audit events of launching another program, see https://docs.python.org/3/library/audit_events.html
+SUBPROCESS_EVENTS = {"subprocess.Popen", "os.system", "os.posix_spawn", "os.spawn", "os.exec"}
+FORK_EVENTS = {"os.fork", "os.forkpty"}
+
+DATABASE_OPERATIONS = {
+    "aggregate", "bulk_write", "count_documents", "create_index", "create_indexes", "delete_many", "delete_one",
+    "distinct", "drop", "estimated_document_count", "find", "find_one", "find_one_and_delete", "find_one_and_replace",
+    "find_one_and_update", "index_information", "insert_many", "insert_one", "list_indexes", "replace_one",
+    "update_many", "update_one", "command", "drop_collection", "list_collection_names", "drop_database",
+    "list_database_names", "server_info"
+}
+
+_active_recorder = None
+
+def _audit(event: str, args):
+    # Audit hooks cannot be removed and run for every audited operation, thus return early
+    if _active_recorder is None or (event not in SUBPROCESS_EVENTS and event not in FORK_EVENTS):
+        return
+    counter = _active_recorder._subprocess_launches if event in SUBPROCESS_EVENTS else _active_recorder._process_forks
+    with counter.get_lock():
+        counter.value += 1
+
+_audit_hook_installed = False
+
+def _reset_peak_rss() -> bool:
+    # Linux resets the high water mark of the resident set size on writing 5 to clear_refs
+    try:
+        with open("/proc/self/clear_refs", "w") as file:
+            file.write("5")
+        return True
+    except OSError:
+        return False
+
+def _get_peak_rss() -> int:
+    try:
+        with open("/proc/self/status") as file:
+            for line in file:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return _to_bytes(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+def _to_bytes(max_rss: int) -> int:
+    # ru_maxrss is given in kilobytes on Linux, but in bytes on macOS
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+def count_database_operation():
+    """
+    Count a database operation in the current stage of the active recorder, if any.
+    """
+    if _active_recorder is not None:
+        _active_recorder._database_operations += 1
+
+class StageRecorder:
+    """
+    Record the wall time, CPU time, database round trips, subprocess launches and peak memory of each stage of a run.
+
+    Stages are marked by the `stage` context manager, which does nothing while no recorder is active, i.e. the
+    pipeline is instrumented without overhead outside of benchmarks. Use the recorder as context manager:
+
+        with StageRecorder() as recorder:
+            with stage("local_extraction"):
+                ...
+        print(recorder.stages)
+
+    Database round trips are the operations issued through a `CountingMongoClient`. Subprocess launches and forks
+    are counted by an audit hook, including those of forked worker processes, which share the counters.
+    The peak resident set size is per stage where the kernel allows to reset it (Linux), otherwise since the
+    start of the process, as given by `peak_rss_scope`.
+    """
+    def __init__(self, keep_going: bool = False):
+        self.keep_going = keep_going
+        self.stages = []
+        self._database_operations = 0
+        self._subprocess_launches = Value("q", 0)
+        self._process_forks = Value("q", 0)
+
+    def __enter__(self):
+        global _active_recorder, _audit_hook_installed
+        if not _audit_hook_installed:
+            sys.addaudithook(_audit)
+            _audit_hook_installed = True
+        _active_recorder = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        global _active_recorder
+        _active_recorder = None
+
+    @contextmanager
+    def record(self, name: str):
+        """
+        Record a stage. If the recorder keeps going, an exception of the stage is recorded and suppressed.
+        """
+        peak_rss_scope = "stage" if _reset_peak_rss() else "process"
+        database_operations = self._database_operations
+        subprocess_launches = self._subprocess_launches.value
+        process_forks = self._process_forks.value
+        start_cpu = time.process_time()
+        start = time.perf_counter()
+        result = {"name": name, "status": "ok"}
+        try:
+            yield result
+        except Exception as e:
+            result["status"] = "error"
+            result["error"] = f"{type(e).__name__}: {e}"
+            print(f"ERROR: Stage {name} failed with {result['error']}")
+            traceback.print_exc()
+            if not self.keep_going:
+                raise
+        finally:
+            result.update({
+                "wall_seconds": time.perf_counter() - start,
+                "cpu_seconds": time.process_time() - start_cpu,
+                "db_round_trips": self._database_operations - database_operations,
+                "subprocess_launches": self._subprocess_launches.value - subprocess_launches,
+                "process_forks": self._process_forks.value - process_forks,
+                "peak_rss_bytes": _get_peak_rss(),
+                "peak_rss_scope": peak_rss_scope,
+                "peak_children_rss_bytes": _to_bytes(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss),
+            })
+            self.stages.append(result)
+
+@contextmanager
+def stage(name: str):
+    """
+    Mark a stage of the pipeline, which is recorded by the active `StageRecorder`, if any.
+    """
+    if _active_recorder is None:
+        yield None
+    else:
+        with _active_recorder.record(name) as result:
+            yield result
+
+class _CountingProxy:
+    # Proxy class of the databases of a client, of the collections of a database and of the subcollections of a collection
+    _child_proxy = None
+
+    def __init__(self, target):
+        self._target = target
+
+    def __getattr__(self, name):
+        attribute = getattr(self._target, name)
+        if name in DATABASE_OPERATIONS and callable(attribute):
+            def operation(*args, **kwargs):
+                count_database_operation()
+                return attribute(*args, **kwargs)
+            return operation
+        if name in ("get_database", "get_collection"):
+            return lambda *args, **kwargs: self._child_proxy(attribute(*args, **kwargs))
+        # Databases and collections are also accessible as attributes
+        if isinstance(attribute, (Database, Collection)):
+            return self._child_proxy(attribute)
+        return attribute
+
+    def __getitem__(self, name):
+        return self._child_proxy(self._target[name])
+
+class _CountingCollection(_CountingProxy):
+    pass
+
+class _CountingDatabase(_CountingProxy):
+    _child_proxy = _CountingCollection
+
+_CountingCollection._child_proxy = _CountingCollection
+
+class CountingMongoClient(_CountingProxy):
+    """
+    Wrap a MongoDB client to count each issued operation as database round trip of the active `StageRecorder`.
+    A cursor counts once, no matter how many batches it fetches.
+    """
+    _child_proxy = _CountingDatabase
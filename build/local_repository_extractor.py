@@ -1,19 +1,21 @@
 from datetime import datetime
 import hashlib
 import re
-import subprocess
 from venv import create
 from colorama import init
 from numpy import insert, size
 from pydriller import Repository
 from requests import get
-from typing import Dict, List
+from typing import Dict, List, Optional
 
 from tomlkit import date
 
-from build.database_handler import get_attribute_change_times, get_attribute_value_at_time, get_object, insert_commit, insert_event, insert_file, insert_file_metrics, update_attribute
-from build.code_quality_analyzer import get_cyclomatic_complexity, get_halstead_metrics, get_line_metrics, get_pylint_score, get_maintainability_index
-from build.utils import date_1970, date_formatter, list_to_dict
+from build.database_handler import delete_checkpoint, flush_ocel_writes, get_attribute_change_times, get_attribute_value_at_time, get_checkpoint, get_object, insert_commit, insert_event, insert_file, insert_file_metrics, update_attribute, update_checkpoint
+from build.code_quality_engine import DEFAULT_BATCH_SIZE, CodeQualityEngine, GitBlobReader
+from build.metrics_cache import metrics_cache
+from build.utils import batched, date_1970, date_formatter, get_blob_hash, list_to_dict
+
+DEFAULT_COMMIT_WINDOW = 64
 
 def _create_commit(commit_sha, author, message, repository, branches, commit_timestamp, contribution_guideline_version, description=None, file_changes=None, parents=None):
     return {
@@ -59,57 +61,32 @@ def _create_file(name, filename, file_change_timestamp, commit_sha, size_bytes,
         "file_purpose": file_purpose,
     }
 
-def _get_snapshot_code_quality(repo_path, from_date, file_types, collection, partial=True):
+def _get_snapshot_code_quality(repo_path, from_date, file_types, collection, engine, partial=True):
     repository_code_metrics: Dict[str, List[float]] = {}  # filename: [maintainability_index, pylint_score]
     for commit in Repository(repo_path, 
                              since=from_date).traverse_commits():
 
-        # Get the initial commit to reset the repository to its original state
-        initial_commit = subprocess.run(
-            ['git', 'rev-parse', 'HEAD'], 
-            cwd=repo_path, 
-            stdout=subprocess.PIPE, 
-            text=True).stdout.strip()
-        
-        # Move HEAD to the commit, from which we want to analze the code quality
+        # Read the files of the commit, from which we want to analyse the code quality, directly from the object storage
+        with GitBlobReader(repo_path) as blob_reader:
+            sources = {}
+            for file, blob_sha in blob_reader.list_files(commit.hash):
+                if partial and not file.endswith(".py"):
+                    continue
+                source = blob_reader.read(blob_sha)
+                if source is None:
+                    print(f"ERROR: Reading file {file} from blob {blob_sha}")
+                    source = ""
+                sources[file] = (blob_sha, source)
+
         if partial:
             # Get the code metrics for only Python files:
-            print(f"Checking out commit {commit.hash} from original commit {initial_commit}")
-            subprocess.run(['git', 'checkout', commit.hash], cwd=repo_path, check=True)
-            result = subprocess.run(
-                ["git", "ls-files", "*.py", "**/*.py"],
-                cwd=repo_path,
-                stdout=subprocess.PIPE,
-                text=True,
-                check=True
-            )
-            py_files = result.stdout.strip().split('\n')
-            for file in py_files:
-                try:
-                    with open(f"{repo_path}/{file}", 'r') as f:
-                        source_code = f.read()
-                except Exception as e:
-                    print(f"Error reading file {file}: {e}")
-                    source_code = ""
-                mi = get_maintainability_index(source_code)/100 # TODO Implement own calculation of maintainability index
-                pl = get_pylint_score(source_code)/10
-                repository_code_metrics[file] = [mi, pl]
+            results = engine.analyse([(blob_sha, file, source) for file, (blob_sha, source) in sources.items()])
+            for file, (blob_sha, _) in sources.items():
+                repository_code_metrics[file] = results[blob_sha][0:2]
         else:
             # Get inital values for all files in the repository and add them to the OCEL
-            all_files = subprocess.run(
-                ["git", "ls-files"],
-                cwd=repo_path,
-                stdout=subprocess.PIPE,
-                text=True,
-                check=True
-            )
-            for file in all_files.stdout.strip().split('\n'):
-                try:
-                    with open(f"{repo_path}/{file}", 'r') as f:
-                        source = f.read()
-                except Exception as e:
-                    print(f"ERROR: Reading file {file}: {e}")
-                    source = ""
+            results = engine.analyse([(blob_sha, file, source) for file, (blob_sha, source) in sources.items() if _check_file_purpose(file, source, file_types) == "source"])
+            for file, (blob_sha, source) in sources.items():
                 file_purpose = _check_file_purpose(file, source, file_types)
                 file_object = _create_file(
                     "Repository Owner", 
@@ -122,13 +99,13 @@ def _get_snapshot_code_quality(repo_path, from_date, file_types, collection, par
                 insert_file(file_object, collection)
 
                 if file_purpose == "source":
-                    source_code_metrics = _extract_source_code_metrics(source)
+                    source_code_metrics = results[blob_sha]
                     repository_code_metrics[file] = source_code_metrics[0:2]
-                    ps, cc, hm, lm = source_code_metrics[1:6]
+                    ps, cc, hm, lm = source_code_metrics[1:5]
                     file_metrics = _create_file_metrics(
                         commit.committer.name, 
                         file,
-                        date_1970, 
+                        date_1970(), 
                         commit.hash,
                         -1, # FIXME Check with prior suggestion of cc_visit
                         cc,
@@ -146,38 +123,23 @@ def _get_snapshot_code_quality(repo_path, from_date, file_types, collection, par
                     insert_file_metrics(file_metrics, collection)
 
                 if file_purpose == "documentation":
-                    word_count = len(source.split())
                     diff_new = {i: line for i, line in enumerate(source.split("\n"), 1)}
                     candidates = _extract_guideline_rule_candidates_combined(
                         file,
                         diff_new,
-                        guideline_id=f"g_{date_1970}"
+                        guideline_id=f"g_{date_1970()}"
                     )
                     for rule in candidates:
-                        insert_event(f"GR_{rule['rule_id']}_{date}",
+                        insert_event(f"GR_{rule['rule_id']}_{date_1970()}",
                                     "guideline_rule_candidate",
                                     date_1970(),
                                     collection,
                                     [rule],
                                     [])
-                    
-                    # diff_new = list_to_dict(modified_file.diff_parsed["added"])
-                    # for line, content in diff_new.items():
-                    #     for keyword in set(keyword_topic.keys()):
-                    #         if keyword.lower() in content.split():
-                    #             print(f"LOG: Found line \"{content}\" for \"{keyword}\" in \"{modified_file.new_path}\"")
-                    #             contribution_guidelines[modified_file.new_path] = {
-                    #                 line: content,
-                    #                 keyword.lower(): keyword_topic[keyword]
-                    #             }
-
-        # Move HEAD back to the initial commit
-        subprocess.run(['git', 'checkout', initial_commit], cwd=repo_path, check=True)
-        print(f"Back to the real analysis")
         break
     return repository_code_metrics
 
-def get_and_insert_local_data(repo_path: str, from_date: datetime, to_date: datetime, file_types: list, do_snapshot: bool = False):
+def get_and_insert_local_data(repo_path: str, from_date: datetime, to_date: datetime, file_types: list, do_snapshot: bool = False, workers: Optional[int] = None, batch_size: int = DEFAULT_BATCH_SIZE, commit_window: int = DEFAULT_COMMIT_WINDOW, resume: bool = True):
     """
     Extract the file level change for a given repository and certain source code files
     Args:
@@ -186,162 +148,215 @@ def get_and_insert_local_data(repo_path: str, from_date: datetime, to_date: date
         to_date (datetime): The end date for the analysis
         file_types (list): The file types to include in the analysis
         do_snapshot (bool): Whether to take a snapshot of the code quality
+        workers (int): The number of processes analysing the code quality, defaults to the number of cores
+        batch_size (int): The number of source files analysed at once by a process
+        commit_window (int): The number of commits whose source files are analysed together before inserting them in commit order
+        resume (bool): Whether to continue with the commits a previous run of the same time period did not process
     """
     collection = repo_path.split("/")[-1]
-    repository_code_metrics = _get_snapshot_code_quality(repo_path, from_date, file_types, collection) if do_snapshot else {}
-    for commit in Repository(repo_path, 
+    checkpoint = get_checkpoint("local", collection) if resume else None
+    # A later end date only adds commits to process, whereas another start date changes the repository code metrics
+    if checkpoint and (checkpoint.get("from_date") != date_formatter(from_date) or checkpoint.get("to_date", "") > date_formatter(to_date)):
+        print(f"WARNING: Checkpoint of local extraction from {checkpoint.get('from_date')} to {checkpoint.get('to_date')} does not match the time period, restarting")
+        checkpoint = None
+    if not checkpoint:
+        delete_checkpoint("local", collection)
+    with CodeQualityEngine(workers, batch_size) as engine:
+        commits = Repository(repo_path, 
                              since=from_date, 
                              to=to_date,
                              #only_modifications_with_file_types=file_types NOTE Remove for final version
-                            ).traverse_commits():
-        commit_timestamp = date_formatter(commit.committer_date)
-        file_metrics = {
-            "maintainability_index": [],
-            "pylint_score": []
-        }
-        filenames = []
-        contribution_guidelines = {}
-
-        # Update the repository code metrics for current commit
-        for modified_file in commit.modified_files:
-            file_action = {}
-            file_actor = {}
-            if modified_file.change_type.name == "DELETE" and commit.committer.name:
-                if modified_file.old_path and any(modified_file.old_path.endswith(extension) for extension in file_types):
-                    repository_code_metrics.pop(modified_file.old_path, None)
-                file_action = {"removed_file": modified_file.old_path}
-                file_actor = {"removed_by": commit.committer.name}
+                            ).traverse_commits()
+        if checkpoint:
+            print(f"LOG: Resuming local extraction after {len(checkpoint['processed_commits'])} processed commits, the last one {checkpoint['commit_sha']} from {checkpoint['commit_timestamp']}")
+            repository_code_metrics = {file: [mi, pl] for file, mi, pl in checkpoint["repository_code_metrics"]}
+            commits = _unprocessed_commits(commits, set(checkpoint["processed_commits"]))
+        else:
+            repository_code_metrics = _get_snapshot_code_quality(repo_path, from_date, file_types, collection, engine) if do_snapshot else {}
+        for window in batched(commits, commit_window):
+            # Analyse the source files of all commits in the window in parallel, then insert them in commit order
+            modified_files_per_commit = [[_read_modified_file(modified_file, file_types) for modified_file in commit.modified_files] for commit in window]
+            source_code_metrics = engine.analyse([
+                (modified_file["blob_sha"], modified_file["new_path"], modified_file["source_code"])
+                for modified_files in modified_files_per_commit 
+                for modified_file in modified_files 
+                if modified_file["file_purpose"] == "source"
+            ])
+            for commit, modified_files in zip(window, modified_files_per_commit):
+                _insert_commit(commit, modified_files, source_code_metrics, repository_code_metrics, file_types, collection)
+            update_checkpoint("local", collection, {
+                "from_date": date_formatter(from_date),
+                "to_date": date_formatter(to_date),
+                "commit_sha": window[-1].hash,
+                "commit_timestamp": date_formatter(window[-1].committer_date),
+                "repository_code_metrics": [[file, mi, pl] for file, (mi, pl) in repository_code_metrics.items()]
+            }, {"processed_commits": [commit.hash for commit in window]})
+    flush_ocel_writes(collection)
+    cache_statistics = metrics_cache.statistics()
+    hits = sum(metric["hits"] for metric in cache_statistics["metrics"].values())
+    misses = sum(metric["misses"] for metric in cache_statistics["metrics"].values())
+    print(f"LOG: Metrics cache holds {cache_statistics['entries']} entries, {hits} hits and {misses} misses in total")
+    return
+
+def _unprocessed_commits(commits, processed_commits: set):
+    # Skip commits by hash rather than by date, as commits of side branches merged after the checkpoint are older than it
+    skipped = 0
+    for commit in commits:
+        if commit.hash in processed_commits:
+            skipped += 1
+        else:
+            yield commit
+    if skipped < len(processed_commits):
+        print(f"WARNING: {len(processed_commits) - skipped} processed commits of the checkpoint are not in the history anymore")
+
+def _read_modified_file(modified_file, file_types: list):
+    # Pydriller reads the blob on every access of source_code, thus read it once
+    source_code = modified_file.source_code
+    if modified_file.change_type.name != "DELETE" and modified_file.new_path and source_code:
+        file_purpose = _check_file_purpose(modified_file.new_path, source_code, file_types)
+    else:
+        file_purpose = "unknown"
+    return {
+        "change_type": modified_file.change_type.name,
+        "old_path": modified_file.old_path,
+        "new_path": modified_file.new_path,
+        "source_code": source_code,
+        "blob_sha": get_blob_hash(source_code) if source_code else None,
+        "file_purpose": file_purpose,
+        "added_lines": modified_file.diff_parsed["added"] if file_purpose == "documentation" else []
+    }
+
+def _insert_commit(commit, modified_files: list, source_code_metrics: dict, repository_code_metrics: dict, file_types: list, collection: str):
+    commit_timestamp = date_formatter(commit.committer_date)
+    file_metrics = {
+        "maintainability_index": [],
+        "pylint_score": []
+    }
+    filenames = []
+    contribution_guidelines = {}
+
+    # Update the repository code metrics for current commit
+    for modified_file in modified_files:
+        file_action = {}
+        file_actor = {}
+        if modified_file["change_type"] == "DELETE" and commit.committer.name:
+            if modified_file["old_path"] and any(modified_file["old_path"].endswith(extension) for extension in file_types):
+                repository_code_metrics.pop(modified_file["old_path"], None)
+            file_action = {"removed_file": modified_file["old_path"]}
+            file_actor = {"removed_by": commit.committer.name}
+        else:
+            if modified_file["change_type"] == "ADD" and modified_file["new_path"] and commit.committer.name:
+                file_action = {"added_file": modified_file["new_path"]}
+                file_actor = {"added_by": commit.committer.name}
+            elif modified_file["change_type"] == "RENAME" and modified_file["old_path"] and modified_file["new_path"] and commit.committer.name:
+                update_attribute(modified_file["old_path"], "filename", modified_file["new_path"], commit_timestamp, collection, update_id = True)
+                if any(modified_file["old_path"].endswith(extension) for extension in file_types):
+                    repository_code_metrics.pop(modified_file["old_path"], None)
+                file_action = {"renamed_file": modified_file["new_path"]}
+                file_actor = {"renamed_by": commit.committer.name}
+            elif modified_file["new_path"] and commit.committer.name: # modified_file["change_type"] == "MODIFIED"
+                file_action = {"modified_file": modified_file["new_path"]}
+                file_actor = {"modified_by": commit.committer.name}
             else:
-                if modified_file.change_type.name == "ADD" and modified_file.new_path and commit.committer.name:
-                    file_action = {"added_file": modified_file.new_path}
-                    file_actor = {"added_by": commit.committer.name}
-                elif modified_file.change_type.name == "RENAME" and modified_file.old_path and modified_file.new_path and commit.committer.name:
-                    update_attribute(modified_file.old_path, "filename", modified_file.new_path, commit_timestamp, collection, update_id = True)
-                    if any(modified_file.old_path.endswith(extension) for extension in file_types):
-                        repository_code_metrics.pop(modified_file.old_path, None)
-                    file_action = {"renamed_file": modified_file.new_path}
-                    file_actor = {"renamed_by": commit.committer.name}
-                elif modified_file.new_path and commit.committer.name: # modified_file.change_type.name == "MODIFIED"
-                    file_action = {"modified_file": modified_file.new_path}
-                    file_actor = {"modified_by": commit.committer.name}
-                else:
-                    print(f"WARNING Unknown change type {modified_file.change_type.name} in commit {commit.hash}")
-                insert_event(
-                    f"CF_{commit_timestamp}", 
-                    "change_file", 
-                    commit_timestamp, 
-                    collection, 
-                    [], 
-                    [{"qualifier": file_action, "objectId": file_actor}])
-
-                # For every change to a file including adding a file, create/update object
-                if modified_file.new_path and modified_file.source_code:
-                    file_purpose = _check_file_purpose(modified_file.new_path, modified_file.source_code, file_types)
-                else:
-                    file_purpose = "unknown"
-                file = _create_file(
+                print(f"WARNING Unknown change type {modified_file['change_type']} in commit {commit.hash}")
+            insert_event(
+                f"CF_{commit.hash}_{modified_file['new_path']}", 
+                "change_file", 
+                commit_timestamp, 
+                collection, 
+                [], 
+                [{"qualifier": file_action, "objectId": file_actor}])
+
+            # For every change to a file including adding a file, create/update object
+            file_purpose = modified_file["file_purpose"]
+            source_code = modified_file["source_code"]
+            file = _create_file(
+                commit.committer.name, 
+                modified_file["new_path"],
+                commit_timestamp, 
+                commit.hash,
+                size(source_code) if source_code else 0,
+                file_purpose
+            )
+            insert_file(file, collection)
+
+            # For every source file additionally update metrics
+            if file_purpose == "source":
+                metrics = source_code_metrics[modified_file["blob_sha"]]
+                repository_code_metrics[modified_file["new_path"]] = metrics[0:2]
+                ps, cc, hm, lm, method_count = metrics[1:6]
+                file_metrics_object = _create_file_metrics(
                     commit.committer.name, 
-                    modified_file.new_path,
+                    modified_file["new_path"],
                     commit_timestamp, 
                     commit.hash,
-                    size(modified_file.source_code) if modified_file.source_code else 0,
-                    file_purpose
+                    method_count,
+                    cc,
+                    hm.total.h1,
+                    hm.total.h2,
+                    hm.total.N1,
+                    hm.total.N2,
+                    lm.loc,
+                    lm.lloc,
+                    lm.sloc,
+                    lm.comments,
+                    lm.multi,
+                    lm.blank,
+                    ps)
+                insert_file_metrics(file_metrics_object, collection)
+
+            # For every documentation document check wether it is a contribution relevant document
+            if file_purpose == "documentation":
+                diff_new = list_to_dict(modified_file["added_lines"])
+                candidates = _extract_guideline_rule_candidates_combined(
+                    modified_file["new_path"],
+                    diff_new,
+                    guideline_id=f"g_{commit_timestamp}"
                 )
-                insert_file(file, collection)
-
-                # For every source file additionally update metrics
-                if file_purpose == "source" and modified_file.new_path and modified_file.source_code:
-                    source_code_metrics = _extract_source_code_metrics(modified_file.source_code)
-                    repository_code_metrics[modified_file.new_path] = source_code_metrics[0:2]
-                    ps, cc, hm, lm = source_code_metrics[1:6]
-                    file_metrics = _create_file_metrics(
-                        commit.committer.name, 
-                        modified_file.new_path,
-                        commit_timestamp, 
-                        commit.hash,
-                        len(modified_file.methods),
-                        cc,
-                        hm.total.h1,
-                        hm.total.h2,
-                        hm.total.N1,
-                        hm.total.N2,
-                        lm.loc,
-                        lm.lloc,
-                        lm.sloc,
-                        lm.comments,
-                        lm.multi,
-                        lm.blank,
-                        ps)
-                    insert_file_metrics(file_metrics, collection)
-
-                # For every documentation document check wether it is a contribution relevant document
-                if file_purpose == "documentation" and modified_file.new_path and modified_file.source_code:
-                    word_count = len(modified_file.source_code.split())
-                    diff_new = list_to_dict(modified_file.diff_parsed["added"])
-                    candidates = _extract_guideline_rule_candidates_combined(
-                        modified_file.new_path,
-                        diff_new,
-                        guideline_id=f"g_{commit_timestamp}"
-                    )
-                    for rule in candidates:
-                        insert_event(f"GR_{rule['rule_id']}_{commit_timestamp}",
-                                    "guideline_rule_candidate",
-                                    commit_timestamp,
-                                    collection,
-                                    [{"attributes": rule}],
-                                    [])
-                    
-                    # diff_new = list_to_dict(modified_file.diff_parsed["added"])
-                    # for line, content in diff_new.items():
-                    #     for keyword in set(keyword_topic.keys()):
-                    #         if keyword.lower() in content.split():
-                    #             print(f"LOG: Found line \"{content}\" for \"{keyword}\" in \"{modified_file.new_path}\"")
-                    #             contribution_guidelines[modified_file.new_path] = {
-                    #                 line: content,
-                    #                 keyword.lower(): keyword_topic[keyword]
-                    #             }
-
-            # Append the filename according to the performed action to the list of filenames
-            _, objectId = file_action.popitem()
-            filenames.append(objectId)
-
-        # After going through all file changes add the commit information
-        commit_object = _create_commit(
-            commit.hash, 
-            commit.author.name, 
-            commit.msg.split("\n\n", 1)[0], 
-            commit.project_name, 
-            commit.branches, 
-            commit_timestamp,
-            # contribution_guideline_version,
-            "" if len(commit.msg.split("\n\n")) < 2 else commit.msg.split("\n\n", 1)[1], 
-            filenames, 
-            commit.parents)
-        
-        # Calculate the overall code quality scores for the files in the repository i.e., in ´repository_code_metrics´
-        for _,v in repository_code_metrics.items():
-            file_metrics["maintainability_index"].append(v[0])
-            file_metrics["pylint_score"].append(v[1])
-        commit_mi = sum(file_metrics["maintainability_index"])/len(file_metrics["maintainability_index"]) if file_metrics["maintainability_index"] else 0
-        commit_pylint = sum(file_metrics["pylint_score"])/len(file_metrics["pylint_score"]) if file_metrics["pylint_score"] else 0
-        commit_object["repository_maintainability_index"] = commit_mi
-        commit_object["repository_pylint_score"] = commit_pylint
-        insert_commit(commit_object, collection)
-    return
-
-def _extract_source_code_metrics(source):
-    if source is None:
-        source = ""
-        print(f"File has no source code")
-
-    # Gather code quality data per file
-    mi = get_maintainability_index(source)/100
-    ps = get_pylint_score(source)/10
-    lm = get_line_metrics(source)
-    hm = get_halstead_metrics(source)
-    cc = get_cyclomatic_complexity(source)
-
-    return [mi, ps, cc, hm, lm]
+                for rule in candidates:
+                    insert_event(f"GR_{rule['rule_id']}_{commit_timestamp}",
+                                "guideline_rule_candidate",
+                                commit_timestamp,
+                                collection,
+                                [{"attributes": rule}],
+                                [])
+                
+                # diff_new = list_to_dict(modified_file.diff_parsed["added"])
+                # for line, content in diff_new.items():
+                #     for keyword in set(keyword_topic.keys()):
+                #         if keyword.lower() in content.split():
+                #             print(f"LOG: Found line \"{content}\" for \"{keyword}\" in \"{modified_file.new_path}\"")
+                #             contribution_guidelines[modified_file.new_path] = {
+                #                 line: content,
+                #                 keyword.lower(): keyword_topic[keyword]
+                #             }
+
+        # Append the filename according to the performed action to the list of filenames
+        _, objectId = file_action.popitem()
+        filenames.append(objectId)
+
+    # After going through all file changes add the commit information
+    commit_object = _create_commit(
+        commit.hash, 
+        commit.author.name, 
+        commit.msg.split("\n\n", 1)[0], 
+        commit.project_name, 
+        commit.branches, 
+        commit_timestamp,
+        # contribution_guideline_version,
+        "" if len(commit.msg.split("\n\n")) < 2 else commit.msg.split("\n\n", 1)[1], 
+        filenames, 
+        commit.parents)
+    
+    # Calculate the overall code quality scores for the files in the repository i.e., in ´repository_code_metrics´
+    for _,v in repository_code_metrics.items():
+        file_metrics["maintainability_index"].append(v[0])
+        file_metrics["pylint_score"].append(v[1])
+    commit_mi = sum(file_metrics["maintainability_index"])/len(file_metrics["maintainability_index"]) if file_metrics["maintainability_index"] else 0
+    commit_pylint = sum(file_metrics["pylint_score"])/len(file_metrics["pylint_score"]) if file_metrics["pylint_score"] else 0
+    commit_object["repository_maintainability_index"] = commit_mi
+    commit_object["repository_pylint_score"] = commit_pylint
+    insert_commit(commit_object, collection)
 
 def _check_file_purpose(path: str, source: str, file_types: list):
     if path:
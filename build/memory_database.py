@@ -0,0 +1,34 @@
+import inspect
+
+_bulk_operations_patched = False
+
+def _drop_unsupported_arguments(method):
+    # Newer pymongo versions pass options to bulk operations, which mongomock does not know, e.g. `sort`
+    parameters = inspect.signature(method).parameters
+    def operation(self, *args, **kwargs):
+        return method(self, *args, **{name: value for name, value in kwargs.items() if name in parameters})
+    return operation
+
+def _patch_bulk_operations(mongomock):
+    global _bulk_operations_patched
+    if _bulk_operations_patched:
+        return
+    builder = mongomock.collection.BulkOperationBuilder
+    for name in ["add_replace", "add_update", "add_delete"]:
+        setattr(builder, name, _drop_unsupported_arguments(getattr(builder, name)))
+    _bulk_operations_patched = True
+
+def create_memory_client():
+    """
+    Create an in-memory stand-in for a MongoDB client, e.g. to run tests or benchmarks without a MongoDB server.
+    The client is backed by mongomock, which is installed with `pip install mongomock`.
+    Returns:
+        mongomock.MongoClient: The client, which behaves like a `pymongo.MongoClient`.
+    """
+    try:
+        import mongomock
+        import mongomock.collection
+    except ImportError:
+        raise ImportError("The in-memory MongoDB client requires mongomock, install it with `pip install mongomock`")
+    _patch_bulk_operations(mongomock)
+    return mongomock.MongoClient()
@@ -0,0 +1,212 @@
+import atexit
+import functools
+import os
+import pickle
+import sqlite3
+import time
+
+from build.utils import get_blob_hash
+
+DEFAULT_CACHE_PATH = "Exports/metrics-cache.sqlite"
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+FLUSH_SIZE = 512
+
+MISSING = object()
+
+class Uncached:
+    """
+    A fallback value of a metric, e.g. after the analysing tool failed or timed out, which is returned but not cached,
+    such that a temporary failure does not become permanent for the analysed source code.
+    """
+    def __init__(self, value):
+        self.value = value
+
+class MetricsCache:
+    """
+    Persistent cache of code quality metrics, addressed by the git blob hash of the analysed source code.
+
+    Entries are keyed by (blob_sha, metric, tool_version), so a metric is only recomputed if the content
+    or the version of the analysing tool changed. Writes are buffered and flushed in one transaction,
+    and the least recently used entries are evicted once the entries take more than `max_bytes` bytes of the database.
+    The connection is opened lazily per process, such that the cache can be shared with worker processes.
+    """
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._connection = None
+        self._pid = None
+        self._pending_entries = {}
+        self._pending_accesses = set()
+        self._hits = {}
+        self._misses = {}
+
+    def _connect(self):
+        if self._connection is None or self._pid != os.getpid():
+            # Do not reuse a connection inherited from the parent process
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._connection = sqlite3.connect(self.path, timeout=60)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute("""CREATE TABLE IF NOT EXISTS metrics (
+                blob_sha TEXT NOT NULL,
+                metric TEXT NOT NULL,
+                tool_version TEXT NOT NULL,
+                value BLOB NOT NULL,
+                last_access REAL NOT NULL,
+                PRIMARY KEY (blob_sha, metric, tool_version))""")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS metrics_last_access ON metrics (last_access)")
+            self._connection.execute("""CREATE TABLE IF NOT EXISTS statistics (
+                metric TEXT PRIMARY KEY,
+                hits INTEGER NOT NULL,
+                misses INTEGER NOT NULL)""")
+            self._connection.commit()
+            self._pid = os.getpid()
+            self._pending_entries = {}
+            self._pending_accesses = set()
+            self._hits = {}
+            self._misses = {}
+        return self._connection
+
+    def get(self, blob_sha: str, metric: str, tool_version: str):
+        """
+        Get a cached metric value.
+        Args:
+            blob_sha (str): The git blob hash of the analysed source code.
+            metric (str): The name of the metric.
+            tool_version (str): The version of the tool computing the metric.
+        Returns:
+            The cached value, or `MISSING` if the metric is not cached.
+        """
+        connection = self._connect()
+        key = (blob_sha, metric, tool_version)
+        if key in self._pending_entries:
+            value = self._pending_entries[key]
+        else:
+            row = connection.execute(
+                "SELECT value FROM metrics WHERE blob_sha = ? AND metric = ? AND tool_version = ?", key
+            ).fetchone()
+            value = pickle.loads(row[0]) if row else MISSING
+            if row:
+                self._pending_accesses.add(key)
+        if value is MISSING:
+            self._misses[metric] = self._misses.get(metric, 0) + 1
+        else:
+            self._hits[metric] = self._hits.get(metric, 0) + 1
+        return value
+
+    def set(self, blob_sha: str, metric: str, tool_version: str, value):
+        """
+        Add a metric value to the cache, the value is written with the next flush.
+        Args:
+            blob_sha (str): The git blob hash of the analysed source code.
+            metric (str): The name of the metric.
+            tool_version (str): The version of the tool computing the metric.
+            value: The picklable metric value.
+        """
+        self._connect()
+        self._pending_entries[(blob_sha, metric, tool_version)] = value
+        if len(self._pending_entries) >= FLUSH_SIZE:
+            self.flush()
+
+    def flush(self):
+        """
+        Write pending entries, access times and statistics to disk and evict entries if the cache is full.
+        """
+        if self._connection is None or self._pid != os.getpid():
+            return
+        now = time.time()
+        with self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO metrics (blob_sha, metric, tool_version, value, last_access) VALUES (?, ?, ?, ?, ?)",
+                [(*key, pickle.dumps(value), now) for key, value in self._pending_entries.items()]
+            )
+            self._connection.executemany(
+                "UPDATE metrics SET last_access = ? WHERE blob_sha = ? AND metric = ? AND tool_version = ?",
+                [(now, *key) for key in self._pending_accesses]
+            )
+            for metric in set(self._hits) | set(self._misses):
+                self._connection.execute(
+                    """INSERT INTO statistics (metric, hits, misses) VALUES (?, ?, ?)
+                    ON CONFLICT(metric) DO UPDATE SET hits = hits + excluded.hits, misses = misses + excluded.misses""",
+                    (metric, self._hits.get(metric, 0), self._misses.get(metric, 0))
+                )
+            if self._pending_entries:
+                self._evict()
+        self._pending_entries = {}
+        self._pending_accesses = set()
+        self._hits = {}
+        self._misses = {}
+
+    def _used_bytes(self) -> int:
+        # The pages in use, read from the database header instead of summing the size of all entries
+        connection = self._connection
+        page_count = connection.execute("PRAGMA page_count").fetchone()[0] # type: ignore
+        free_pages = connection.execute("PRAGMA freelist_count").fetchone()[0] # type: ignore
+        return (page_count - free_pages) * connection.execute("PRAGMA page_size").fetchone()[0] # type: ignore
+
+    def _evict(self):
+        used_bytes = self._used_bytes()
+        if used_bytes > self.max_bytes:
+            entries = self._connection.execute("SELECT COUNT(*) FROM metrics").fetchone()[0] # type: ignore
+            # Evict down to 90% of the capacity, so that not every flush has to evict, assuming entries of average size
+            self._connection.execute( # type: ignore
+                "DELETE FROM metrics WHERE rowid IN (SELECT rowid FROM metrics ORDER BY last_access LIMIT ?)",
+                (entries - int(entries * self.max_bytes * 0.9 / used_bytes),)
+            )
+
+    def statistics(self):
+        """
+        Get the hit and miss statistics of the cache over all runs and processes.
+        Returns:
+            dict: A dictionary with the number of entries, the size in bytes and the hits and misses per metric.
+        """
+        self.flush()
+        connection = self._connect()
+        return {
+            "entries": connection.execute("SELECT COUNT(*) FROM metrics").fetchone()[0],
+            "size_bytes": os.path.getsize(self.path) if os.path.exists(self.path) else 0,
+            "metrics": {metric: {"hits": hits, "misses": misses} for metric, hits, misses in connection.execute("SELECT metric, hits, misses FROM statistics")}
+        }
+
+    def clear(self):
+        """
+        Remove all entries and statistics from the cache.
+        """
+        connection = self._connect()
+        with connection:
+            connection.execute("DELETE FROM metrics")
+            connection.execute("DELETE FROM statistics")
+        self._pending_entries = {}
+        self._pending_accesses = set()
+        self._hits = {}
+        self._misses = {}
+
+metrics_cache = MetricsCache(
+    os.getenv("METRICS_CACHE_PATH", DEFAULT_CACHE_PATH),
+    int(os.getenv("METRICS_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES))
+)
+atexit.register(metrics_cache.flush)
+
+def cached_metric(metric: str, tool_version: str):
+    """
+    Decorate a function computing a metric of a source code, such that it consults the metrics cache first.
+    The decorated function must take the source code as first argument and return a picklable value,
+    or a fallback value wrapped in `Uncached`, which is returned unwrapped without caching it.
+    Args:
+        metric (str): The name of the metric.
+        tool_version (str): The version of the tool computing the metric.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(source_code, *args, **kwargs):
+            blob_sha = get_blob_hash(source_code or "")
+            value = metrics_cache.get(blob_sha, metric, tool_version)
+            if value is MISSING:
+                value = function(source_code, *args, **kwargs)
+                if isinstance(value, Uncached):
+                    return value.value
+                metrics_cache.set(blob_sha, metric, tool_version, value)
+            return value
+        return wrapper
+    return decorator
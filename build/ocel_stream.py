@@ -0,0 +1,121 @@
+import json
+from typing import Dict, Iterable, Iterator
+
+OCEL_SECTIONS = ["objectTypes", "eventTypes", "objects", "events"]
+DEFAULT_CHUNK_SIZE = 1 << 20
+INDENT = 4
+
+def write_ocel_json(path: str, sections: Dict[str, Iterable[dict]]):
+    """
+    Write an OCEL 2.0 JSON file incrementally, such that only one document is held in memory at a time.
+    The output is byte-identical to `json.dump` of the materialised sections with an indent of 4.
+    Args:
+        path (str): The path of the file to write.
+        sections (dict): The name of each section, i.e. objectTypes, eventTypes, objects and events, mapped to an iterable of its documents.
+    """
+    section_indent = "\n" + " " * INDENT
+    document_indent = "\n" + " " * 2 * INDENT
+    with open(path, "w") as file:
+        file.write("{")
+        for section_index, (section, documents) in enumerate(sections.items()):
+            file.write(("," if section_index else "") + section_indent + json.dumps(section) + ": [")
+            empty = True
+            for document in documents:
+                # JSON strings cannot contain raw line breaks, thus indenting all lines of the document nests it correctly
+                file.write(("," if not empty else "") + document_indent + json.dumps(document, indent=INDENT).replace("\n", document_indent))
+                empty = False
+            file.write("]" if empty else section_indent + "]")
+        file.write("\n}" if sections else "}")
+
+class _JSONStream:
+    """
+    Decode the values of a JSON file one at a time from a buffer of bounded size.
+    """
+    def __init__(self, file, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.buffer = ""
+        self.position = 0
+        self.end_of_file = False
+        self._decoder = json.JSONDecoder()
+
+    def _read(self):
+        chunk = self.file.read(self.chunk_size)
+        if not chunk:
+            self.end_of_file = True
+            return False
+        self.buffer = self.buffer[self.position:] + chunk
+        self.position = 0
+        return True
+
+    def peek(self):
+        while True:
+            while self.position < len(self.buffer) and self.buffer[self.position] in " \t\r\n":
+                self.position += 1
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            if not self._read():
+                return ""
+
+    def expect(self, characters: str):
+        character = self.peek()
+        if not character or character not in characters:
+            raise ValueError(f"Expected one of {characters!r} at offset {self.position} of {self.file.name}, found {character!r}")
+        self.position += 1
+        return character
+
+    def decode(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self.buffer, self.position)
+            except json.JSONDecodeError:
+                # The value is either invalid or not completely read yet
+                if not self._read():
+                    raise
+                continue
+            if end == len(self.buffer) and not self.end_of_file and self._read():
+                # A number at the end of the buffer may continue in the next chunk
+                continue
+            self.position = end
+            return value
+
+def iterate_ocel_json(path: str, section: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[dict]:
+    """
+    Iterate over the documents of one section of an OCEL 2.0 JSON file without loading the whole file.
+    Args:
+        path (str): The path of the OCEL 2.0 JSON file.
+        section (str): The section to iterate over, i.e. objectTypes, eventTypes, objects or events.
+        chunk_size (int, optional): The number of characters read from the file at once.
+    Returns:
+        An iterator over the documents of the section in file order.
+    """
+    with open(path, "r") as file:
+        stream = _JSONStream(file, chunk_size)
+        stream.expect("{")
+        if stream.peek() == "}":
+            return
+        while True:
+            name = stream.decode()
+            stream.expect(":")
+            stream.expect("[")
+            if stream.peek() == "]":
+                stream.expect("]")
+            else:
+                while True:
+                    # Documents of other sections are decoded one at a time as well, but discarded
+                    document = stream.decode()
+                    if name == section:
+                        yield document
+                    if stream.expect(",]") == "]":
+                        break
+            if name == section or stream.expect(",}") == "}":
+                return
+
+def iterate_ocel(ocel, section: str) -> Iterator[dict]:
+    """
+    Iterate over the documents of one section of an OCEL, given either as path of an OCEL 2.0 JSON file or as dictionary.
+    """
+    if isinstance(ocel, str):
+        return iterate_ocel_json(ocel, section)
+    return iter(ocel[section])
@@ -0,0 +1,221 @@
+from typing import Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from build.database_handler import get_pull_request_events, get_pull_requests, get_users
+from build.ocel_stream import iterate_ocel
+
+# Relationship qualifiers naming the actor of an event, in order of preference
+ACTOR_QUALIFIERS = ["by", "author", "committer", "merged_by", "closed_by", "requested_by", "reviewer", "assignee", "user", "actor"]
+
+def _get_label(event: dict):
+    for attribute in event.get("attributes", []):
+        if isinstance(attribute, dict) and attribute.get("name") == "label":
+            return attribute.get("value")
+    return None
+
+def _get_is_bot(user: dict):
+    # Same as `get_is_user_bot`, i.e. the first is-bot attribute decides
+    for attribute in user.get("attributes", []):
+        if attribute.get("name") == "is-bot":
+            return {"True": True, "False": False}.get(attribute.get("value"))
+    return None
+
+class PullRequestAnalytics:
+    """
+    Batch analytics over the events of all pull requests of a repository.
+
+    The events are loaded once into a table with one row per pull request and related event, next to a
+    table of the relationships of the events and a lookup of which users are bots. Each analysis is
+    computed for all pull requests at once with vectorised operations on these tables and memoised,
+    such that further analyses and plots of any subset of pull requests reuse it.
+    """
+    def __init__(self, events: pd.DataFrame, relationships: pd.DataFrame, users: Dict[str, Optional[bool]]):
+        self.events = events
+        self.relationships = relationships
+        self.users = users
+        self._results = {}
+
+    @classmethod
+    def from_documents(cls, events: Iterable[dict], pull_request_ids: Iterable[str], users: Iterable[dict]) -> "PullRequestAnalytics":
+        """
+        Build the tables from event and user documents.
+        Args:
+            events: The event documents with `_id` (or `id`), `type`, `time`, `attributes` and `relationships`, in their natural order.
+            pull_request_ids: The IDs of the pull requests.
+            users: The user documents with `_id` (or `id`) and `attributes`.
+        Returns:
+            PullRequestAnalytics: The analytics over the events related to the pull requests.
+        """
+        pull_request_ids = set(pull_request_ids)
+        event_rows, pull_request_rows, relationship_rows = [], [], []
+        for event in events:
+            position = len(event_rows)
+            event_relationships = []
+            for index, relationship in enumerate(event.get("relationships", [])):
+                object_id, qualifier = relationship.get("objectId"), relationship.get("qualifier", "")
+                # Change file events relate dictionaries, which are neither pull requests nor actors
+                if isinstance(object_id, str) and isinstance(qualifier, str):
+                    event_relationships.append((position, index, object_id, qualifier))
+            related_pull_requests = dict.fromkeys(row[2] for row in event_relationships if row[2] in pull_request_ids)
+            if not related_pull_requests:
+                continue
+            event_rows.append((event.get("_id", event.get("id")), event["type"], event["time"], _get_label(event)))
+            pull_request_rows.extend((pull_request_id, position) for pull_request_id in related_pull_requests)
+            relationship_rows.extend(event_relationships)
+        relationships = pd.DataFrame(relationship_rows, columns=["position", "relationship_index", "object_id", "qualifier"])
+
+        event_table = pd.DataFrame(event_rows, columns=["event_id", "type", "time", "label"])
+        event_table["time"] = pd.to_datetime(event_table["time"], utc=True, format="ISO8601")
+        table = pd.DataFrame(pull_request_rows, columns=["pull_request_id", "position"])
+        table = table.join(event_table, on="position").reset_index(drop=True)
+        return cls(table, relationships, {user.get("_id", user.get("id")): _get_is_bot(user) for user in users})
+
+    def _memoise(self, name: str, compute: Callable):
+        if name not in self._results:
+            self._results[name] = compute()
+        return self._results[name]
+
+    def is_bot(self, user_id: str) -> Optional[bool]:
+        """
+        Get whether a user is a bot, or None if the user is unknown or not classified.
+        """
+        return self.users.get(user_id)
+
+    def _type_contains(self, text: str) -> pd.Series:
+        return self._memoise(f"type_contains_{text}", lambda: self.events["type"].str.contains(text, regex=False))
+
+    def _last_type_token(self) -> pd.Series:
+        return self._memoise("last_type_token", lambda: self.events["type"].str.split("_").str[-1])
+
+    def _sorted_by_time(self) -> pd.DataFrame:
+        # Ties keep the natural order of the events, like a stable sort of each pull request's events
+        return self._memoise("sorted_by_time", lambda: self.events.sort_values(["pull_request_id", "time", "position"]))
+
+    def get_times(self) -> pd.DataFrame:
+        """
+        Get the times at which each pull request was opened, closed and merged.
+        Returns:
+            pd.DataFrame: Indexed by pull request, with the `first_open`, `last_open`, `last_close`,
+                `last_merge` and `last_close_only` times in the natural order of the events, where
+                reopening counts as opening, and `last_close_only` skips events that also count as opening.
+        """
+        def compute():
+            grouped_times = lambda mask: self.events["time"][mask].groupby(self.events["pull_request_id"][mask])
+            is_open = self._type_contains("open")
+            return pd.DataFrame({
+                "first_open": grouped_times(is_open).first(),
+                "last_open": grouped_times(is_open).last(),
+                "last_close": grouped_times(self._type_contains("close")).last(),
+                "last_merge": grouped_times(self._type_contains("merge")).last(),
+                "last_close_only": grouped_times(self._type_contains("close") & ~is_open).last(),
+            })
+        return self._memoise("times", compute)
+
+    def get_reviewers(self) -> pd.DataFrame:
+        """
+        Get the users related by a "by" qualifier to the review events of each pull request.
+        Returns:
+            pd.DataFrame: One row per pull request and reviewing relationship in the natural order of the
+                events, with the `pull_request_id`, the `object_id` of the reviewer and whether it `is_bot`.
+        """
+        def compute():
+            is_review = (self._last_type_token() == "review") & ~self._type_contains("open") & ~self._type_contains("close")
+            reviews = self.events.loc[is_review, ["pull_request_id", "position"]]
+            by = self.relationships[self.relationships["qualifier"].str.contains("by", regex=False)]
+            reviewers = reviews.merge(by, on="position").sort_values(["position", "relationship_index"], kind="stable")
+            reviewers["is_bot"] = reviewers["object_id"].map(self.users).eq(True)
+            return reviewers[["pull_request_id", "object_id", "is_bot"]].reset_index(drop=True)
+        return self._memoise("reviewers", compute)
+
+    def get_review_iterations(self) -> pd.Series:
+        """
+        Get the number of review iterations of each pull request, i.e. reviews with a commit since the previous review.
+        Returns:
+            pd.Series: The number of review iterations by pull request, for pull requests with at least one review.
+        """
+        def compute():
+            events = self._sorted_by_time()
+            is_review = self._last_type_token().str.contains("review", regex=False)[events.index]
+            commits = self._type_contains("commit")[events.index].groupby(events["pull_request_id"]).cumsum()
+            # A review starts a new iteration if there were commits since the previous review
+            commits_at_reviews = commits[is_review]
+            pull_requests = events["pull_request_id"][is_review]
+            previous = commits_at_reviews.groupby(pull_requests).shift(fill_value=0)
+            return (commits_at_reviews > previous).groupby(pull_requests).sum()
+        return self._memoise("review_iterations", compute)
+
+    def get_labels_and_approvals(self) -> pd.DataFrame:
+        """
+        Get the added labels and the number of approvals of each pull request.
+        Returns:
+            pd.DataFrame: Indexed by pull request, with the list of `labels` in order of time and the number of `approvals`.
+        """
+        def compute():
+            events = self._sorted_by_time()
+            is_add_label = self._type_contains("add_label")[events.index]
+            labels = events["label"][is_add_label].groupby(events["pull_request_id"][is_add_label]).agg(list)
+            approvals = self._type_contains("approve")[events.index].groupby(events["pull_request_id"]).sum()
+            result = pd.DataFrame({"approvals": approvals})
+            result["labels"] = labels.reindex(result.index)
+            result["labels"] = result["labels"].map(lambda labels: labels if isinstance(labels, list) else [])
+            return result
+        return self._memoise("labels_and_approvals", compute)
+
+    def get_actors(self) -> pd.Series:
+        """
+        Get the actor of each event, i.e. the first related user by the preferred qualifiers of `ACTOR_QUALIFIERS`.
+        Returns:
+            pd.Series: The user ID by position of the event, for events with an actor.
+        """
+        def compute():
+            relationships = self.relationships[self.relationships["object_id"].isin(self.users.keys())]
+            preference = np.full(len(relationships), len(ACTOR_QUALIFIERS))
+            # Assign the most preferred matching qualifier last
+            for rank, qualifier in reversed(list(enumerate(ACTOR_QUALIFIERS))):
+                preference[relationships["qualifier"].str.contains(qualifier, regex=False).to_numpy()] = rank
+            candidates = relationships.assign(preference=preference)
+            candidates = candidates[candidates["preference"] < len(ACTOR_QUALIFIERS)]
+            actors = candidates.sort_values(["position", "preference", "relationship_index"]).drop_duplicates("position")
+            return actors.set_index("position")["object_id"]
+        return self._memoise("actors", compute)
+
+    def select(self, pull_request_ids: List[str], by_time: bool = False) -> pd.DataFrame:
+        """
+        Get the events of some pull requests, in the order of the given IDs and then of the events.
+        Args:
+            pull_request_ids (list): The IDs of the pull requests.
+            by_time (bool): Whether to order the events of each pull request by time instead of their natural order.
+        """
+        order = {pull_request_id: index for index, pull_request_id in enumerate(dict.fromkeys(pull_request_ids))}
+        events = self._sorted_by_time() if by_time else self.events
+        events = events[events["pull_request_id"].isin(order.keys())]
+        return events.iloc[np.argsort(events["pull_request_id"].map(order).to_numpy(), kind="stable")]
+
+_pull_request_analytics: Dict[str, PullRequestAnalytics] = {}
+
+def get_pull_request_analytics(collection: str, ocel=None, reload: bool = False) -> PullRequestAnalytics:
+    """
+    Get the memoised analytics of the pull requests of a collection, loading them once.
+    Args:
+        collection (str): The collection (i.e., repository) of the pull requests.
+        ocel (optional): An exported OCEL, as path of an OCEL 2.0 JSON file or as dictionary, to load the events from instead of the database.
+        reload (bool): Whether to load the events again, e.g. after extracting more data.
+    Returns:
+        PullRequestAnalytics: The analytics shared by all analyses of the collection.
+    """
+    if reload or ocel is not None or collection not in _pull_request_analytics:
+        if ocel is not None:
+            pull_request_ids, users = [], []
+            for obj in iterate_ocel(ocel, "objects"):
+                if obj["type"] == "pull_request":
+                    pull_request_ids.append(obj["id"])
+                elif obj["type"] == "user":
+                    users.append(obj)
+            analytics = PullRequestAnalytics.from_documents(iterate_ocel(ocel, "events"), pull_request_ids, users)
+        else:
+            pull_request_ids = [pull_request["_id"] for pull_request in get_pull_requests(collection)]
+            analytics = PullRequestAnalytics.from_documents(get_pull_request_events(collection), pull_request_ids, get_users(collection))
+        _pull_request_analytics[collection] = analytics
+    return _pull_request_analytics[collection]
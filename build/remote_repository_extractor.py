@@ -1,48 +1,40 @@
-from datetime import timedelta
+from datetime import timedelta, timezone
 from gc import collect
 from operator import ge
-import time
+import asyncio
 from numpy import extract
-import requests
 import os
 
-from build.database_handler import date_1970, datetime, get_user_by_username, insert_event, insert_pull, insert_user
+from build.database_handler import date_1970, datetime, delete_checkpoint, flush_ocel_writes, get_checkpoint, get_user_by_username, insert_event, insert_pull, insert_user, update_checkpoint
+from build.github_client import DEFAULT_PER_PAGE, GitHubClient, with_query
 
 token = os.getenv("GITHUB_TOKEN")  # Import GitHub token from environment variables
 anonymous_user_counter = {}
+user_names = {}  # (collection, username): id of the user object
 
-def get_and_insert_remote_data(repo_url, repo_path):
-    repo = get_repo_information(repo_url)
+def get_and_insert_remote_data(repo_url, repo_path, resume=True, from_date=None, to_date=None):
     collection = repo_url.split("/")[-1]
-    get_closed_pulls(repo["utility_information"]["pulls_url"], collection)
-    
-def get_api_response(url, retries=0):
-    headers = {"Authorization": f"token {token}"}
-    response = requests.get(url, headers=headers)
-    if response.ok:
-        return response.json()
-    elif response.status_code == 403 or response.status_code == 429 and retries < 5:
-        if int(response.headers.get("x-ratelimit-remaining", 0)) == 0:
-            retry_after = int(response.headers.get("x-ratelimit-reset", 60)) - int(time.time())
-            retry_time = datetime.now() + timedelta(seconds=retry_after)
-            print(f"Secondary rate limit exceeded. Retrying after {retry_after} seconds at {retry_time.strftime('%H:%M:%S')}.")
-            retries += 1
-        else:
-            retry_after = int(response.headers.get("retry-after", 60))
-            retry_time = datetime.now() + timedelta(seconds=retry_after)
-            print(f"Secondary rate limit exceeded. Retrying after {retry_after} seconds at {retry_time.strftime('%H:%M:%S')}.")
-            retries += 1
-        time.sleep(retry_after^retries)
-        return get_api_response(url, retries)
-    else: 
-        raise Exception(response.raise_for_status())
+    if not resume:
+        delete_checkpoint("remote", collection)
+    asyncio.run(_get_and_insert_remote_data(repo_url, collection, from_date, to_date))
+    flush_ocel_writes(collection)
 
-def get_repo_information(repo_url):
-    repo_response = get_api_response(repo_url)
+async def _get_and_insert_remote_data(repo_url, collection, from_date, to_date):
+    async with GitHubClient(token) as client:
+        repo = await get_repo_information(client, repo_url)
+        await get_closed_pulls(client, repo["utility_information"]["pulls_url"], collection, from_date, to_date)
+    print(f"LOG: Sent {client.statistics['requests']} GitHub API requests, {client.statistics['not_modified']} of them were answered from the response cache")
+
+async def get_repo_information(client, repo_url):
+    repo_response = await client.get(repo_url)
+    related_pulls, related_commits = await asyncio.gather(
+        get_related_pulls(client, repo_response["pulls_url"][:-9]),
+        get_related_commits(client, repo_response["commits_url"][:-6], all_pages=False)
+    )
     repo_information = {
         "name": repo_response["full_name"],
-        "has-pull_requests": get_related_pulls(repo_response["pulls_url"][:-9]),
-        "has-commits": get_related_commits(repo_response["commits_url"][:-6]),
+        "has-pull_requests": related_pulls,
+        "has-commits": related_commits,
         "timestamp": repo_response["updated_at"],
         "utility_information": {
             "forks_url": repo_response["forks_url"],
@@ -56,41 +48,99 @@ def get_repo_information(repo_url):
     }
     return repo_information
 
-def get_closed_pulls(pulls_url, collection):
-    # TODO Check pulls for date range with link headers in pagination
-    pages = 190
-    for page in range(180, pages + 1):
-        pull_response = get_api_response(pulls_url + "?state=closed&page=" + str(page))
+def _to_utc(date):
+    if isinstance(date, str):
+        date = datetime.fromisoformat(date.replace("Z", "+00:00"))
+    return date.replace(tzinfo=timezone.utc) if date.tzinfo is None else date
+
+async def get_closed_pulls(client, pulls_url, collection, from_date=None, to_date=None):
+    """
+    Insert all closed pull requests created in the given time period together with their timeline events.
+    Pull requests are requested by their last update, newest first, following the pagination of the API until the first
+    pull request updated before the newest update of the last completed run, or before `from_date`. Thus later runs
+    ingest new pull requests as well as pull requests closed or changed since, e.g. ones that were still open before.
+    Args:
+        client (GitHubClient): The client to request the API with.
+        pulls_url (str): The URL of the pull requests of the repository.
+        collection (str): The collection to insert the pull requests into.
+        from_date (datetime, optional): The earliest creation date of the pull requests.
+        to_date (datetime, optional): The latest creation date of the pull requests.
+    """
+    checkpoint = get_checkpoint("remote", collection) or {}
+    # Pull requests are skipped, if they were ingested at their current update, e.g. by an interrupted run
+    ingested_pulls = dict(checkpoint.get("ingested_pulls", {}))
+    newest_ingested = checkpoint.get("newest_updated_at")
+    run_newest = newest_ingested
+    first_page_url = with_query(pulls_url, state="closed", sort="updated", direction="desc", per_page=DEFAULT_PER_PAGE)
+    async for _, pull_response in client.iterate_pages(first_page_url):
+        pulls = []
+        reached_end = False
         for pull in pull_response:
+            updated_at = _to_utc(pull["updated_at"])
+            if (newest_ingested is not None and updated_at < _to_utc(newest_ingested)) or (from_date is not None and updated_at < _to_utc(from_date)):
+                reached_end = True
+                break
+            if run_newest is None or updated_at > _to_utc(run_newest):
+                run_newest = pull["updated_at"]
+            created_at = _to_utc(pull["created_at"])
+            if (from_date is not None and created_at < _to_utc(from_date)) or (to_date is not None and created_at > _to_utc(to_date)):
+                continue
+            if ingested_pulls.get(str(pull["number"])) != pull["updated_at"]:
+                pulls.append(pull)
+        # Request the related resources of all pull requests of a page concurrently, but insert them in order
+        pull_resources = await asyncio.gather(*(_get_pull_resources(client, pull, collection) for pull in pulls))
+        for pull, (commits, files, timeline) in zip(pulls, pull_resources):
             pull_content = {
                 "is-merged-with":  pull["merge_commit_sha"],
                 "number": str(pull["number"]),
-                "is-authored-by": get_name_by_username(pull["user"]["login"], collection, pull["author_association"]),
+                "is-authored-by": await get_name_by_username(client, pull["user"]["login"], collection, pull["author_association"]),
                 "title": pull["title"],
                 "description": pull["body"],
                 "merged_at_timestamp": pull["merged_at"],
                 "created_at_timestamp": pull["created_at"],
                 "closed_at_timestamp": pull["closed_at"],
                 "has-participant": 
-                    [get_name_by_username(pull["user"]["login"], collection)] + 
-                    [get_name_by_username(user["login"], collection) for user in pull["requested_reviewers"] + pull["assignees"]],
-                "is-reviewed-by": [get_name_by_username(user["login"], collection) for user in pull["requested_reviewers"]], 
-                "formalises": get_related_commits(pull["commits_url"]),
-                "aggregates": get_related_files(pull["url"] + "/files"),
+                    [await get_name_by_username(client, pull["user"]["login"], collection)] + 
+                    [await get_name_by_username(client, user["login"], collection) for user in pull["requested_reviewers"] + pull["assignees"]],
+                "is-reviewed-by": [await get_name_by_username(client, user["login"], collection) for user in pull["requested_reviewers"]], 
+                "formalises": commits,
+                "aggregates": files,
                 # FIXME Extract correct state
                 "state": pull["state"],
             } 
             insert_pull(pull_content, collection)
-            extract_events_from_pull(pull_response, collection)
+            await extract_events_from_pull(client, [pull], collection, {pull["number"]: timeline})
+            update_checkpoint("remote", collection, {f"ingested_pulls.{pull['number']}": pull["updated_at"]})
+            ingested_pulls[str(pull["number"])] = pull["updated_at"]
+        if reached_end:
+            break
+    # The run completed, thus the next one stops at the newest update of this run
+    update_checkpoint("remote", collection, {"newest_updated_at": run_newest})
+
+async def _get_pull_resources(client, pull, collection):
+    commits, files, timeline = await asyncio.gather(
+        get_related_commits(client, pull["commits_url"]),
+        get_related_files(client, pull["url"] + "/files"),
+        client.get_all(pull["issue_url"] + "/timeline")
+    )
+    # Request the profiles of all unknown participants, such that inserting the pull request does not wait for them
+    users = [pull["user"]] + pull["requested_reviewers"] + pull["assignees"]
+    for event in timeline:
+        users += [event.get(key) for key in ["actor", "user", "requested_reviewer", "review_requester"]]
+    usernames = {user["login"] for user in users if isinstance(user, dict) and "login" in user}
+    await asyncio.gather(*(client.get_user(username) for username in usernames if username != "Copilot" and _get_known_user(username, collection) is None))
+    return commits, files, timeline
 
-def extract_events_from_pull(pull_response, collection):
+async def extract_events_from_pull(client, pull_response, collection, timelines={}):
     for pull in pull_response:
         # Check PR events
-
-        for event in get_api_response(pull["issue_url"] + "/timeline"):
+        timeline = timelines.get(pull["number"])
+        if timeline is None:
+            timeline = await client.get_all(pull["issue_url"] + "/timeline")
+        for event in timeline:
             if event["event"] not in ["committed", "reviewed"]:
                 timestamp = event["created_at"]
-                actor = {"objectId": get_name_by_username(event["actor"]["login"], collection), "qualifier": "authored-by"}
+                actor = {"objectId": await get_name_by_username(client, event["actor"]["login"], collection), "qualifier": "authored-by"}
             else:
                 # TODO Check OCEL for those attributes
                 timestamp = date_1970()
@@ -118,7 +168,7 @@ def extract_events_from_pull(pull_response, collection):
                     [actor, {"objectId": str(pull['number']), "qualifier": "closed-on-pull_request"}]
                 )
             elif event["event"] == "reopened":
-                actor = {"objectId": get_name_by_username(event["actor"]["login"], collection), "qualifier": "reopened-by"}
+                actor = {"objectId": await get_name_by_username(client, event["actor"]["login"], collection), "qualifier": "reopened-by"}
                 insert_event(
                     f"{event['node_id']}",
                     "reopen_pull_request",
@@ -138,10 +188,10 @@ def extract_events_from_pull(pull_response, collection):
                 )
             elif event["event"] == "review_requested":
                 try:
-                    requested_reviewer = {"objectId": get_name_by_username(event["requested_reviewer"]["login"], collection), "qualifier": "for"}
+                    requested_reviewer = {"objectId": await get_name_by_username(client, event["requested_reviewer"]["login"], collection), "qualifier": "for"}
                 except KeyError:
                     requested_reviewer = {"objectId": event["requested_team"]["name"], "qualifier": "for"}
-                review_requester = {"objectId": get_name_by_username(event["review_requester"]["login"], collection), "qualifier": "by"}
+                review_requester = {"objectId": await get_name_by_username(client, event["review_requester"]["login"], collection), "qualifier": "by"}
                 insert_event(
                     f"{event['node_id']}",
                     "add_review_request",
@@ -152,10 +202,10 @@ def extract_events_from_pull(pull_response, collection):
                 )
             elif event["event"] == "review_request_removed":
                 try:
-                    requested_reviewer = {"objectId": get_name_by_username(event["requested_reviewer"]["login"], collection), "qualifier": "for"}
+                    requested_reviewer = {"objectId": await get_name_by_username(client, event["requested_reviewer"]["login"], collection), "qualifier": "for"}
                 except KeyError:
                     requested_reviewer = {"objectId": event["requested_team"]["name"], "qualifier": "for"}
-                review_requester = {"objectId": get_name_by_username(event["review_requester"]["login"], collection), "qualifier": "by"}
+                review_requester = {"objectId": await get_name_by_username(client, event["review_requester"]["login"], collection), "qualifier": "by"}
                 insert_event(
                     f"{event['node_id']}",
                     "remove_review_request",
@@ -165,7 +215,7 @@ def extract_events_from_pull(pull_response, collection):
                     [review_requester, {"objectId": str(pull['number']), "qualifier": "in-pull-request"}]
                 )
             elif event["event"] == "commented":
-                user_relation = {"objectId": get_name_by_username(event["actor"]["login"], collection), "qualifier": "commented-by"}
+                user_relation = {"objectId": await get_name_by_username(client, event["actor"]["login"], collection), "qualifier": "commented-by"}
                 insert_event(
                     f"{event['node_id']}",
                     "comment_pull_request",
@@ -190,7 +240,7 @@ def extract_events_from_pull(pull_response, collection):
                     timestamp,
                     collection,
                     [{"name": "renamed-to", "value": event["rename"]["to"]}],
-                    [{"objectId": get_name_by_username(event["actor"]["login"], collection, collection), "qualifier": "change-issued-by"}, {"objectId": str(pull['number']), "qualifier": "for-pull-request"}]
+                    [{"objectId": await get_name_by_username(client, event["actor"]["login"], collection, collection), "qualifier": "change-issued-by"}, {"objectId": str(pull['number']), "qualifier": "for-pull-request"}]
                 )
             elif event["event"] == "labeled":
                 label = {"name": "label", "value": event["label"]["name"]}
@@ -215,16 +265,16 @@ def extract_events_from_pull(pull_response, collection):
             elif event["event"] == "reviewed":
                 if event["state"] == "approved":
                     review_type = "approve_review"
-                    user_relation = {"objectId": get_name_by_username(event["user"]["login"], collection), "qualifier": "approved-by"}
+                    user_relation = {"objectId": await get_name_by_username(client, event["user"]["login"], collection), "qualifier": "approved-by"}
                 elif event["state"] == "changes_requested":
                     review_type = "suggest_changes_as_review"
-                    user_relation = {"objectId": get_name_by_username(event["user"]["login"], collection), "qualifier": "requested-by"}
+                    user_relation = {"objectId": await get_name_by_username(client, event["user"]["login"], collection), "qualifier": "requested-by"}
                 elif event["state"] == "review_dismissed":
                     review_type = "dismiss_review"
-                    user_relation = {"objectId": get_name_by_username(event["user"]["login"], collection), "qualifier": "dismissed-by"}
+                    user_relation = {"objectId": await get_name_by_username(client, event["user"]["login"], collection), "qualifier": "dismissed-by"}
                 else:
                     review_type = "comment_review"
-                    user_relation = {"objectId": get_name_by_username(event["user"]["login"], collection), "qualifier": "commented-by"}
+                    user_relation = {"objectId": await get_name_by_username(client, event["user"]["login"], collection), "qualifier": "commented-by"}
                 timestamp = event["submitted_at"]
                 insert_event(
                     f"{event['id']}",
@@ -241,30 +291,30 @@ def extract_events_from_pull(pull_response, collection):
             pull["created_at"],
             collection,
             [],
-            [{"objectId": get_name_by_username(pull["user"]["login"], collection), "qualifier": "opened-by"}, {"objectId": str(pull['number']), "qualifier": "for-pull_request"}]
+            [{"objectId": await get_name_by_username(client, pull["user"]["login"], collection), "qualifier": "opened-by"}, {"objectId": str(pull['number']), "qualifier": "for-pull_request"}]
         )
         # TODO 1. Change file event
 
 
-def get_pull_data(number: int, owner: str, repo_name: str) -> dict:
-    return get_api_response(f"https://api.github.com/repos/{owner}/{repo_name}/pulls/{number}")
+async def get_pull_data(client, number: int, owner: str, repo_name: str) -> dict:
+    return await client.get(f"{client.base_url}/repos/{owner}/{repo_name}/pulls/{number}")
 
-def get_related_commits(commits_url):
-    commit_response = get_api_response(commits_url) 
+async def get_related_commits(client, commits_url, all_pages=True):
+    commit_response = await client.get_all(commits_url) if all_pages else await client.get(commits_url)
     commits = []
     for commit in commit_response:
         commits.append(commit["sha"])
     return commits
 
-def get_related_files(files_url):
-    file_response = get_api_response(files_url)
+async def get_related_files(client, files_url):
+    file_response = await client.get_all(files_url)
     files = []
     for file in file_response:
         files.append(file["filename"])
     return files
 
-def get_related_pulls(pulls_url):
-    pull_response = get_api_response(pulls_url)
+async def get_related_pulls(client, pulls_url):
+    pull_response = await client.get(pulls_url)
     pulls = []
     for pull in pull_response:
         pulls.append(str(pull["number"]))
@@ -274,7 +324,16 @@ def get_anonymous_user_counter():
     global anonymous_user_counter
     return anonymous_user_counter
 
-def get_name_by_username(username, collection, author_association = "NONE"):
+def _get_known_user(username, collection):
+    # Check the in-process memo and the database, than save API calls
+    if (collection, username) not in user_names:
+        user_object = get_user_by_username(username, collection)
+        if not user_object:
+            return None
+        user_names[(collection, username)] = user_object["_id"]
+    return user_names[(collection, username)]
+
+async def get_name_by_username(client, username, collection, author_association = "NONE"):
     global anonymous_user_counter # TODO Check if still necessary
     # TODO Implement checking if remote and local user ids match
     user_response = {
@@ -283,13 +342,12 @@ def get_name_by_username(username, collection, author_association = "NONE"):
         "type": "Bot",
         "updated_at": date_1970(),
     }
-    # Check if user is already in database, than save API calls
-    user_object = get_user_by_username(username, collection)
-    if user_object:
-        return user_object["_id"]
+    user_id = _get_known_user(username, collection)
+    if user_id is not None:
+        return user_id
     else:
         if username != "Copilot":
-            user_response = get_api_response(f"https://api.github.com/users/{username}")
+            user_response = await client.get_user(username)
             if user_response["name"] is None and user_response["type"] == "User":
                 anonymous_user_counter[username] = anonymous_user_counter.get(username, 0) + 1
         user = {
@@ -300,4 +358,5 @@ def get_name_by_username(username, collection, author_association = "NONE"):
             "created_at_timestamp": user_response["updated_at"] if user_response["updated_at"] else date_1970(),
         }
         insert_user(user, collection)
+        user_names[(collection, username)] = user["name"]
         return user["name"]
@@ -0,0 +1,155 @@
+from datetime import datetime, timedelta, timezone
+import os
+import random
+import subprocess
+from typing import List, Optional
+
+DEFAULT_START_DATE = datetime(2024, 1, 1, tzinfo=timezone.utc)
+DEFAULT_COMMIT_INTERVAL = timedelta(hours=6)
+
+AUTHORS = [
+    ("Ada Lovelace", "ada@example.com"),
+    ("Alan Turing", "alan@example.com"),
+    ("Grace Hopper", "grace@example.com"),
+    ("Edsger Dijkstra", "edsger@example.com"),
+    ("Barbara Liskov", "barbara@example.com"),
+    ("Donald Knuth", "donald@example.com"),
+]
+
+# Sentences of contribution guidelines, each detected by a rule of `detect_rule` in the local repository extractor
+GUIDELINE_SENTENCES = [
+    "Every pull request must be approved by at least {count} reviewers before it is merged.",
+    "Contributions should come with tests for all new behaviour.",
+    "Stale pull requests are closed after {count} days without activity.",
+    "A pull request should change no more than {count} lines.",
+    "Each pull request must reference the issue it fixes, e.g. #{count}.",
+    "All code must keep the style checks clean.",
+    "Merging requires +1 by {word} core contributors and no -1 by a core contributor.",
+    "Please discuss larger changes with the maintainers before opening a pull request.",
+]
+
+COUNT_WORDS = ["one", "two", "three", "four", "five"]
+
+def _python_function(rng: random.Random, name: str) -> List[str]:
+    # A function of about ten lines with branches and loops, such that all code metrics are non-trivial
+    threshold, step = rng.randint(1, 50), rng.randint(1, 5)
+    return [
+        f"def {name}(values, limit={threshold}):",
+        f'    """Sum the values of {name} up to the limit."""',
+        "    total = 0",
+        f"    for index, value in enumerate(values[::{step}]):",
+        "        if value > limit:",
+        "            total -= value // (index + 1)",
+        f"        elif value % {step + 1} == 0:",
+        "            total += value * index",
+        "        else:",
+        "            total += 1",
+        "    return total",
+        "",
+        "",
+    ]
+
+def _python_source(rng: random.Random, module: str, lines: int, version: int) -> str:
+    source = [f'"""Module {module}, revision {version}."""', "import math", "", ""]
+    index = 0
+    while len(source) < lines:
+        source.extend(_python_function(rng, f"{module}_function_{index}"))
+        index += 1
+    return "\n".join(source) + "\n"
+
+def _guideline_sentence(rng: random.Random, index: int) -> str:
+    count = rng.randint(1, 5)
+    return GUIDELINE_SENTENCES[index % len(GUIDELINE_SENTENCES)].format(count=count, word=COUNT_WORDS[count - 1])
+
+def _doc_source(rng: random.Random, path: str, sentences: int, version: int) -> str:
+    title = os.path.splitext(os.path.basename(path))[0].replace("_", " ").title()
+    heading = f"# {title}" if path.endswith(".md") else f"{title}\n{'=' * len(title)}"
+    lines = [heading, "", f"Revision {version} of the guidelines.", ""]
+    lines.extend(_guideline_sentence(rng, index) for index in range(sentences))
+    return "\n".join(lines) + "\n"
+
+def _data(content: str) -> bytes:
+    encoded = content.encode("utf-8")
+    return b"data %d\n%s\n" % (len(encoded), encoded)
+
+def generate_repository(path: str, commits: int = 100, files: int = 20, lines_per_file: int = 100, doc_files: int = 2,
+                        guideline_sentences: int = 5, files_per_commit: int = 3, seed: int = 0,
+                        start_date: datetime = DEFAULT_START_DATE, commit_interval: timedelta = DEFAULT_COMMIT_INTERVAL,
+                        authors: Optional[list] = None) -> dict:
+    """
+    Generate a git repository with a synthetic history, which is deterministic for a seed.
+    The first commit adds all files, each further commit changes some of them, where doc files with
+    contribution guidelines change about every tenth commit. The history is written by one `git fast-import`,
+    which is much faster than committing each change.
+    Args:
+        path (str): The path of the repository, whose name is the collection of the pipeline. It must not exist yet.
+        commits (int): The number of commits.
+        files (int): The number of Python files.
+        lines_per_file (int): The approximate number of lines of a Python file.
+        doc_files (int): The number of doc files, i.e. a CONTRIBUTING.md and reStructuredText files in docs.
+        guideline_sentences (int): The number of guideline sentences of a doc file.
+        files_per_commit (int): The maximum number of Python files changed by a commit after the first one.
+        seed (int): The seed of the random generator.
+        start_date (datetime): The time of the first commit.
+        commit_interval (timedelta): The time between commits.
+        authors (list): The (name, email) tuples of the authors, defaults to `AUTHORS`.
+    Returns:
+        dict: The path, the commit SHAs in order, the paths of the files, the lines of Python code at the last commit and the time period.
+    """
+    if os.path.exists(path):
+        raise Exception(f"Repository at {path} already exists")
+    rng = random.Random(seed)
+    authors = authors or AUTHORS
+    python_files = [f"src/package_{index % 10}/module_{index}.py" for index in range(files)]
+    doc_paths = (["CONTRIBUTING.md"] + [f"docs/guide_{index}.rst" for index in range(1, doc_files)])[:doc_files]
+    versions = dict.fromkeys(python_files + doc_paths, 0)
+    lines_of_code = {}
+
+    stream = bytearray()
+    for number in range(commits):
+        if number == 0:
+            changed = python_files + doc_paths
+        else:
+            changed = rng.sample(python_files, rng.randint(1, min(files_per_commit, len(python_files)))) if python_files else []
+            if doc_paths and number % 10 == 0:
+                changed.append(rng.choice(doc_paths))
+        author_name, author_email = authors[rng.randrange(len(authors))]
+        timestamp = int((start_date + number * commit_interval).timestamp())
+        stream += b"commit refs/heads/main\n"
+        stream += b"mark :%d\n" % (number + 1)
+        stream += f"author {author_name} <{author_email}> {timestamp} +0000\n".encode("utf-8")
+        stream += f"committer {author_name} <{author_email}> {timestamp} +0000\n".encode("utf-8")
+        stream += _data(f"Change {len(changed)} files\n\nSynthetic commit {number}.")
+        if number > 0:
+            stream += b"from :%d\n" % number
+        for file in changed:
+            versions[file] += 1
+            if file.endswith(".py"):
+                module = os.path.splitext(os.path.basename(file))[0]
+                content = _python_source(rng, module, lines_per_file, versions[file])
+                lines_of_code[file] = content.count("\n")
+            else:
+                content = _doc_source(rng, file, guideline_sentences, versions[file])
+            stream += f"M 100644 inline {file}\n".encode("utf-8")
+            stream += _data(content)
+        stream += b"\n"
+
+    os.makedirs(path)
+    subprocess.run(["git", "init", "-q", "-b", "main"], cwd=path, check=True)
+    subprocess.run(["git", "fast-import", "--quiet"], cwd=path, input=bytes(stream), check=True)
+    if commits > 0:
+        # Check out the last commit, such that the working tree matches the history
+        subprocess.run(["git", "reset", "-q", "--hard", "main"], cwd=path, check=True)
+    commit_shas = subprocess.run(
+        ["git", "rev-list", "--reverse", "main"], cwd=path, stdout=subprocess.PIPE, check=True
+    ).stdout.decode("utf-8").split() if commits > 0 else []
+
+    return {
+        "path": os.path.abspath(path),
+        "commits": commit_shas,
+        "python_files": python_files,
+        "doc_files": doc_paths,
+        "lines_of_code": sum(lines_of_code.values()),
+        "start_date": start_date.isoformat(),
+        "end_date": (start_date + max(commits - 1, 0) * commit_interval).isoformat(),
+    }
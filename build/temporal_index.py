@@ -0,0 +1,132 @@
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+
+TYPED_ATTRIBUTES = {
+    "int": np.int64,
+    "float": np.float64,
+    "boolean": np.bool_,
+}
+
+def _strip_timezone(time: str) -> str:
+    # Timestamps are compared by their wall-clock time, as `get_attribute_value_at_time` does
+    if time.endswith("Z"):
+        return time[:-1]
+    if len(time) > 6 and time[-6] in "+-" and time[-3] == ":":
+        return time[:-6]
+    return time
+
+def to_epoch(times) -> np.ndarray:
+    """
+    Convert ISO 8601 timestamps to microseconds since epoch, ignoring their timezone.
+    Args:
+        times: A list of ISO 8601 strings or datetime objects.
+    Returns:
+        np.ndarray: The timestamps as int64 array.
+    """
+    normalised = [_strip_timezone(time) if isinstance(time, str) else time.replace(tzinfo=None) for time in times]
+    return np.array(normalised, dtype="datetime64[us]").astype(np.int64)
+
+def _convert(value, attribute_type: str):
+    if attribute_type == "int":
+        return int(value)
+    if attribute_type == "float":
+        return float(value)
+    return value == "True"
+
+class TemporalIndex:
+    """
+    In-memory index of the attribute histories of objects for point-in-time queries.
+
+    Per object and typed attribute, the change times are held as sorted array of epoch timestamps
+    next to an array of the converted values, such that the value at a point in time is found by
+    bisection instead of scanning and parsing all attributes of the object.
+    Only int, float and boolean attributes are indexed, like `get_attribute_value_at_time` returns.
+    Values, which cannot be converted to the type of their attribute, are left out of the histories.
+    """
+    def __init__(self):
+        self._histories: Dict[Tuple[str, str], Tuple[np.ndarray, np.ndarray]] = {}
+
+    @classmethod
+    def from_objects(cls, objects: Iterable[dict], object_types: Iterable[dict]) -> "TemporalIndex":
+        """
+        Build the index from object documents.
+        Args:
+            objects: The object documents with `_id` (or `id`), `type` and `attributes`.
+            object_types: The object type documents with `_id` (or `name`) and `attributes`.
+        Returns:
+            TemporalIndex: The index over the typed attributes of all objects.
+        """
+        attribute_types = {}
+        for object_type in object_types:
+            type_name = object_type.get("_id", object_type.get("name"))
+            attribute_types[type_name] = {attribute["name"]: attribute["type"] for attribute in object_type["attributes"]}
+        index = cls()
+        skipped = 0
+        for document in objects:
+            types = attribute_types.get(document.get("type"))
+            if types is None:
+                continue
+            history = {}
+            for attribute in document.get("attributes", []):
+                attribute_type = types.get(attribute["name"])
+                if attribute_type in TYPED_ATTRIBUTES and attribute.get("time") is not None:
+                    try:
+                        value = _convert(attribute["value"], attribute_type)
+                    except (TypeError, ValueError):
+                        # Skip malformed values like "None" of an int attribute, such that the previous change stays in effect
+                        skipped += 1
+                        continue
+                    history.setdefault(attribute["name"], ([], [], attribute_type))
+                    history[attribute["name"]][0].append(attribute["time"])
+                    history[attribute["name"]][1].append(value)
+            for name, (times, values, attribute_type) in history.items():
+                index.add(document.get("_id", document.get("id")), name, to_epoch(times), np.array(values, dtype=TYPED_ATTRIBUTES[attribute_type]))
+        if skipped:
+            print(f"WARNING: Skipped {skipped} attribute values, which could not be converted to their attribute type")
+        return index
+
+    def add(self, object_id: str, attribute_name: str, times: np.ndarray, values: np.ndarray):
+        """
+        Add the history of an attribute of an object.
+        Args:
+            object_id (str): The ID of the object.
+            attribute_name (str): The name of the attribute.
+            times (np.ndarray): The change times in microseconds since epoch.
+            values (np.ndarray): The values at the change times.
+        """
+        # A stable sort keeps the last of several changes at the same time last, which then takes precedence
+        order = np.argsort(times, kind="stable")
+        self._histories[(object_id, attribute_name)] = (times[order], values[order])
+
+    def __len__(self):
+        return len(self._histories)
+
+    def get_history(self, object_id: str, attribute_name: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Get the sorted change times and values of an attribute of an object, or None if it has no history.
+        """
+        return self._histories.get((object_id, attribute_name))
+
+    def value_at(self, object_id: str, attribute_name: str, time):
+        """
+        Get the value of an attribute at a specific time.
+        Args:
+            object_id (str): The ID of the object to get the attribute value for.
+            attribute_name (str): The name of the attribute to get the value for.
+            time (str | datetime | int): The time as ISO 8601 string, datetime or microseconds since epoch.
+        Returns:
+            The value of the last change at or before the time, or None if there is none.
+        """
+        history = self._histories.get((object_id, attribute_name))
+        if history is None:
+            return None
+        times, values = history
+        position = int(np.searchsorted(times, self._to_epoch(time), side="right")) - 1
+        return values[position].item() if position >= 0 else None
+
+    @staticmethod
+    def _to_epoch(time) -> int:
+        if isinstance(time, (int, np.integer)):
+            return int(time)
+        return int(to_epoch([time])[0])
@@ -1,4 +1,5 @@
 import datetime
+import hashlib
 import json
 import os
 import subprocess
@@ -19,6 +20,26 @@ def clone_repository(repo_url, temp_dir="/Users/as/Library/Mobile Documents/com~
     subprocess.run(['git', 'clone', repo_url, clone_path], check=True)
     return clone_path
 
+def batched(iterable, size: int):
+    """
+    Split an iterable into lists of at most `size` items while preserving the order.
+    """
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def get_blob_hash(source: str):
+    """
+    Get the git blob hash (as of `git hash-object`) of a source code string.
+    """
+    content = source.encode("utf-8")
+    return hashlib.sha1(b"blob %d\0" % len(content) + content).hexdigest()
+
 def array_to_string(array):
     return "[" + ", ".join(map(str, array)) + "]"
 
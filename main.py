@@ -1,5 +1,4 @@
 import argparse
-import json
 import os
 from datetime import datetime, timedelta
 
@@ -9,8 +8,69 @@ from build.local_repository_extractor import get_and_insert_local_data
 from build.remote_repository_extractor import get_and_insert_remote_data
 from build.database_handler import initialise_database, get_ocel_data
 from build.contribution_process_miner import divide_event_log_at, split_OCEL_at_guideline_changes, flatten_ocel2, visualise_xes_as
+from build.instrumentation import stage
+
+def run_pipeline(repo_path, api_url, from_date, to_date, file_types, workers=None, resume=True, split_date=datetime(2025, 7, 7, 15, 0), view=True):
+    """
+    Run all stages of the pipeline on a cloned repository.
+    Each stage is marked by `stage`, such that a benchmark records it, see `benchmark.py`.
+    Args:
+        repo_path (str): The path of the cloned repository, whose name is the collection.
+        api_url (str): The GitHub API URL of the repository.
+        from_date (datetime): The start date for the analysis.
+        to_date (datetime): The end date for the analysis.
+        file_types (list): The file types to analyse the code quality of.
+        workers (int): The number of processes analysing the code quality, defaults to the number of cores.
+        resume (bool): Whether to continue after the checkpoints of a previous run.
+        split_date (datetime): The date to split the flattened log at.
+        view (bool): Whether to view the discovered models.
+    """
+    collection = repo_path.split("/")[-1]
+
+    with stage("initialise_database"):
+        initialise_database(repo_path)
 
-def main(repo_url="https://github.com/matplotlib/matplotlib", **kwargs):
+    # =========================================================
+    # RQ1: Creation of OCEL
+    # =========================================================
+    
+    # Go through all commits in the given time period
+    with stage("local_extraction"):
+        get_and_insert_local_data(repo_path, from_date, to_date, file_types, False, workers=workers, resume=resume)
+
+    with stage("remote_extraction"):
+        get_and_insert_remote_data(api_url, repo_path, resume=resume, from_date=from_date, to_date=to_date)
+
+    # Export the OCEL as file, which later stages stream instead of loading it into memory
+    ocel_path = None
+    with stage("ocel_export"):
+        ocel_path = get_ocel_data(collection)
+
+    # =========================================================
+    # RQ2: Code Quality Analysis and Visualisation
+    # =========================================================
+
+    with stage("code_quality_plot"):
+        plot_repo_code_quality_fast(collection)
+
+    # =========================================================
+    # RQ3: Contribution Guidelines Analysis and Visualisation
+    # =========================================================
+
+    flat_event_log = None
+    with stage("flattening"):
+        flat_event_log = flatten_ocel2(ocel_path, object_type="pull_request", collection=collection, export=False)
+
+    if flat_event_log is not None:
+        with stage("petri_net_discovery"):
+            visualise_xes_as("petri_net", flat_event_log, collection=collection, view=view)
+            before_log, after_log = divide_event_log_at(split_date.replace(tzinfo=None), flat_event_log)
+            visualise_xes_as("petri_net", before_log, collection=collection, view=view)
+            visualise_xes_as("petri_net", after_log, collection=collection, view=view)
+    else:
+        print("ERROR: Flattened event log is empty")
+
+def main(repo_url="https://github.com/matplotlib/matplotlib", workers=None, resume=True, **kwargs):
     # =============================================
     # Set-Up
     # =============================================
@@ -20,7 +80,8 @@ def main(repo_url="https://github.com/matplotlib/matplotlib", **kwargs):
     collection = repo_url.split("/")[-1]
 
     # Setting different timeperiod
-    from_date = (datetime.today() - timedelta(days=5*365)).replace(day=1, month=1)
+    # Start at midnight, such that the time period of the checkpoints matches in later runs
+    from_date = (datetime.today() - timedelta(days=5*365)).replace(day=1, month=1, hour=0, minute=0, second=0, microsecond=0)
     to_date = datetime.today() - timedelta(days=1)
 
     # Select supported file types your code quality analyser
@@ -34,41 +95,8 @@ def main(repo_url="https://github.com/matplotlib/matplotlib", **kwargs):
 
     if not os.path.exists(repo_path):
         raise Exception(f"Repository at {repo_path} does not exist")
-    
-    initialise_database(repo_path)
-
-    # =========================================================
-    # RQ1: Creation of OCEL
-    # =========================================================
-    
-    # Go through all commits in the given time period
-    get_and_insert_local_data(repo_path, from_date, to_date, file_types, False)
-
-    get_and_insert_remote_data(api_url, repo_path)
 
-    path = get_ocel_data(collection)
-    with open(path) as f:
-        ocel = json.load(f)
-
-    # =========================================================
-    # RQ2: Code Quality Analysis and Visualisation
-    # =========================================================
-
-    plot_repo_code_quality_fast(collection)
-
-    # =========================================================
-    # RQ3: Contribution Guidelines Analysis and Visualisation
-    # =========================================================
-
-    flat_event_log = flatten_ocel2(ocel, object_type="pull_request", collection=collection)
-    visualise_xes_as("petri_net", flat_event_log, collection=collection)
-
-    if flat_event_log:
-        before_log, after_log = divide_event_log_at(datetime(2025, 7, 7, 15, 0).replace(tzinfo=None), flat_event_log)
-        visualise_xes_as("petri_net", before_log, collection=collection)
-        visualise_xes_as("petri_net", after_log, collection=collection)
-    else:
-        print("ERROR: Flattened event log is empty")
+    run_pipeline(repo_path, api_url, from_date, to_date, file_types, workers=workers, resume=resume)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -78,5 +106,16 @@ if __name__ == "__main__":
         default='https://github.com/matplotlib/matplotlib',
         help="URL of the GitHub repository to analyze (default: https://github.com/matplotlib/matplotlib)"
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of processes analysing the code quality (default: number of cores)"
+    )
+    parser.add_argument(
+        "--restart",
+        action="store_true",
+        help="Ignore the checkpoints of previous runs and extract the full time period again"
+    )
     args = parser.parse_args()
-    main(repo_url=args.repo_url)
\ No newline at end of file
+    main(repo_url=args.repo_url, workers=args.workers, resume=not args.restart)
\ No newline at end of file
@@ -0,0 +1,55 @@
+import unittest
+
+from build import database_handler
+from build.code_quality_analyzer import calculate_maintainability_index
+from build.code_quality_visualizer import get_repository_code_quality
+from build.local_repository_extractor import _create_commit, _create_file, _create_file_metrics
+from build.memory_database import create_memory_client
+
+COLLECTION = "repository"
+TIMES = ["2024-01-01T00:00:00+00:00", "2024-01-02T00:00:00+00:00", "2024-01-03T00:00:00+00:00"]
+
+def _insert_change(number: int, filename: str, loc: int, pylint_score: float):
+    commit_sha = f"sha-{number}"
+    database_handler.insert_file(_create_file("Ada Lovelace", filename, TIMES[number], commit_sha, loc * 30, "source"), COLLECTION)
+    database_handler.insert_file_metrics(_create_file_metrics(
+        "Ada Lovelace", filename, TIMES[number], commit_sha,
+        method_count=3, cyclomatic_complexity=loc // 10, theta_1=8, theta_2=loc // 2, N_1=loc, N_2=loc * 2, loc=loc,
+        lloc=loc, sloc=loc, cloc=0, dloc=0, blank_lines=0, pylint_score=pylint_score
+    ), COLLECTION)
+
+def _insert_commit(number: int, filenames: list):
+    commit = _create_commit(f"sha-{number}", "Ada Lovelace", f"Commit {number}", COLLECTION, ["main"], TIMES[number], "None", "", filenames, [])
+    commit["repository_pylint_score"] = 0.0
+    commit["repository_maintainability_index"] = 0.0
+    database_handler.insert_commit(commit, COLLECTION)
+
+def _maintainability_index(loc: int) -> float:
+    return calculate_maintainability_index(loc, loc * 2, 8, loc // 2, loc // 10, loc)
+
+class RepositoryCodeQualityTest(unittest.TestCase):
+    def setUp(self):
+        database_handler.set_client(create_memory_client())
+        database_handler.initialise_database(f"/tmp/{COLLECTION}")
+        _insert_change(0, "src/a.py", 40, 8.0)
+        _insert_change(0, "src/b.py", 80, 6.0)
+        _insert_commit(0, ["src/a.py", "src/b.py"])
+        _insert_change(1, "src/a.py", 60, 10.0)
+        _insert_commit(1, ["src/a.py"])
+        _insert_change(2, "src/b.py", 100, 9.0)
+        _insert_commit(2, ["src/b.py"])
+
+    def test_metrics_are_averaged_over_the_files_at_each_commit(self):
+        code_quality = list(get_repository_code_quality(COLLECTION).values())
+        self.assertEqual([point["pylint_score"] for point in code_quality], [7.0, 8.0, 9.5])
+        expected_mi = [
+            (_maintainability_index(40) + _maintainability_index(80)) / 2,
+            (_maintainability_index(60) + _maintainability_index(80)) / 2,
+            (_maintainability_index(60) + _maintainability_index(100)) / 2,
+        ]
+        for point, mi in zip(code_quality, expected_mi):
+            self.assertGreater(point["mi"], 0)
+            self.assertAlmostEqual(point["mi"], mi)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+import unittest
+
+from build import database_handler
+from build.instrumentation import CountingMongoClient, StageRecorder, stage
+from build.memory_database import create_memory_client
+
+COLLECTION = "repository"
+
+def _commit(number: int, message: str = "Change files", timestamp: str = "2024-01-01T00:00:00+00:00") -> dict:
+    return {
+        "commit_sha": f"sha-{number}",
+        "message": message,
+        "description": "None",
+        "to": "['repository:main']",
+        "repository_pylint_score": 8.0,
+        "repository_maintainability_index": 70.0,
+        "is-authored-by": "Ada Lovelace",
+        "commit_timestamp": timestamp,
+    }
+
+class OCELWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.database = create_memory_client()
+        database_handler.set_client(CountingMongoClient(self.database))
+        database_handler.initialise_database(f"/tmp/{COLLECTION}")
+
+    def _record(self, name: str, function):
+        with StageRecorder() as recorder:
+            with stage(name):
+                function()
+        return recorder.stages[0]["db_round_trips"]
+
+    def test_writes_of_commits_are_batched(self):
+        commits, events_per_commit = 50, 5
+        def insert():
+            for number in range(commits):
+                database_handler.insert_commit(_commit(number), COLLECTION)
+                for index in range(events_per_commit):
+                    database_handler.insert_event(f"event-{number}-{index}", "modify_file", "2024-01-01T00:00:00+00:00", COLLECTION, [], [{"objectId": f"sha-{number}", "qualifier": "part-of"}])
+            database_handler.flush_ocel_writes(COLLECTION)
+        # Without buffering, each commit costs two type lookups, a read and a write of the object and a write per event
+        round_trips = self._record("insert", insert)
+        self.assertLessEqual(round_trips, commits + 2)
+        self.assertEqual(self.database[COLLECTION]["objects"].count_documents({"type": "commit"}), commits)
+        self.assertEqual(self.database[COLLECTION]["events"].count_documents({}), commits * events_per_commit)
+
+    def test_attribute_histories_are_merged_client_side(self):
+        database_handler.insert_commit(_commit(0), COLLECTION)
+        round_trips = self._record("update", lambda: database_handler.insert_commit(_commit(0, "Amend files", "2024-01-02T00:00:00+00:00"), COLLECTION))
+        self.assertEqual(round_trips, 0)
+        database_handler.flush_ocel_writes(COLLECTION)
+        commit = self.database[COLLECTION]["objects"].find_one({"_id": "sha-0"})
+        messages = [(attribute["value"], attribute["time"]) for attribute in commit["attributes"] if attribute["name"] == "message"]
+        self.assertEqual(messages, [("Change files", "2024-01-01T00:00:00+00:00"), ("Amend files", "2024-01-02T00:00:00+00:00")])
+
+    def test_pending_users_are_found_without_flushing(self):
+        user = {"name": "Ada Lovelace", "username": "ada", "rank": "MEMBER", "is-bot": False, "created_at_timestamp": "2024-01-01T00:00:00Z"}
+        database_handler.insert_user(user, COLLECTION)
+        found = []
+        round_trips = self._record("lookup", lambda: found.append(database_handler.get_user_by_username("ada", COLLECTION)))
+        self.assertEqual(round_trips, 0)
+        self.assertEqual(found[0]["_id"], "Ada Lovelace")
+        self.assertIsNone(self.database[COLLECTION]["objects"].find_one({"type": "user"}))
+        self.assertIsNone(database_handler.get_user_by_username("grace", COLLECTION))
+
+    def test_checkpoints_are_buffered_and_merged(self):
+        def update():
+            database_handler.insert_commit(_commit(0), COLLECTION)
+            database_handler.update_checkpoint("local", COLLECTION, {"commit_sha": "sha-0"}, {"processed_commits": ["sha-0"]})
+            database_handler.update_checkpoint("local", COLLECTION, {"commit_sha": "sha-1"}, {"processed_commits": ["sha-1"]})
+        self.assertEqual(self._record("update", update), 1)
+        self.assertIsNone(self.database[COLLECTION]["checkpoints"].find_one({"_id": "local"}))
+        checkpoint = database_handler.get_checkpoint("local", COLLECTION)
+        self.assertEqual(checkpoint["commit_sha"], "sha-1")
+        self.assertEqual(checkpoint["processed_commits"], ["sha-0", "sha-1"])
+        self.assertIsNotNone(self.database[COLLECTION]["objects"].find_one({"_id": "sha-0"}))
+
+if __name__ == "__main__":
+    unittest.main()
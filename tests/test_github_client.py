@@ -0,0 +1,89 @@
+import asyncio
+import os
+import tempfile
+import time
+import unittest
+
+import aiohttp
+
+from build.github_client import DEFAULT_API_URL, GitHubClient
+from build.github_fixtures import FixtureServer, _add_pages, normalise_url
+
+def _fixtures(responses: dict) -> dict:
+    return {"repository": "owner/name", "base_url": DEFAULT_API_URL, "responses": responses}
+
+class GitHubClientTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache_path = os.path.join(self.directory.name, "github-cache.sqlite")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def _client(self, server: FixtureServer) -> GitHubClient:
+        return GitHubClient(token="token", base_url=server.url, cache_path=self.cache_path)
+
+    async def test_get_all_follows_link_header(self):
+        responses = {}
+        _add_pages(responses, DEFAULT_API_URL, "/repos/owner/name/pulls", {"per_page": 100}, [{"number": number} for number in range(250)])
+        with FixtureServer(_fixtures(responses)) as server:
+            async with self._client(server) as client:
+                items = await client.get_all(f"{server.url}/repos/owner/name/pulls")
+        self.assertEqual([item["number"] for item in items], list(range(250)))
+        self.assertEqual(server.statistics["requests"], 3)
+
+    async def test_not_modified_responses_are_served_from_cache(self):
+        responses = {normalise_url("/repos/owner/name"): {"body": {"full_name": "owner/name"}, "link": None}}
+        with FixtureServer(_fixtures(responses)) as server:
+            async with self._client(server) as client:
+                first = await client.get(f"{server.url}/repos/owner/name")
+            # Another client shares the response cache on disk
+            async with self._client(server) as client:
+                second = await client.get(f"{server.url}/repos/owner/name")
+                self.assertEqual(client.statistics["not_modified"], 1)
+        self.assertEqual(first, second)
+        self.assertEqual(server.statistics["not_modified"], 1)
+
+    async def test_too_many_requests_are_retried(self):
+        errors = [{"status": 429, "headers": {"retry-after": "0"}}] * 2
+        responses = {normalise_url("/repos/owner/name"): {"body": {"full_name": "owner/name"}, "link": None, "errors": errors}}
+        with FixtureServer(_fixtures(responses)) as server:
+            async with self._client(server) as client:
+                repo = await client.get(f"{server.url}/repos/owner/name")
+                self.assertEqual(client.statistics["retries"], 2)
+        self.assertEqual(repo["full_name"], "owner/name")
+        self.assertEqual(server.statistics["requests"], 3)
+
+    async def test_rate_limited_forbidden_requests_are_retried(self):
+        errors = [
+            {"status": 403, "headers": {"x-ratelimit-remaining": "0", "x-ratelimit-reset": str(int(time.time()))}},
+            {"status": 403, "headers": {"retry-after": "0"}},
+        ]
+        responses = {normalise_url("/repos/owner/name"): {"body": {"full_name": "owner/name"}, "link": None, "errors": errors}}
+        with FixtureServer(_fixtures(responses)) as server:
+            async with self._client(server) as client:
+                repo = await client.get(f"{server.url}/repos/owner/name")
+        self.assertEqual(repo["full_name"], "owner/name")
+        self.assertEqual(server.statistics["requests"], 3)
+
+    async def test_forbidden_requests_are_not_retried(self):
+        errors = [{"status": 403, "headers": {}, "message": "Resource not accessible by integration"}] * 3
+        responses = {normalise_url("/repos/owner/name"): {"body": {"full_name": "owner/name"}, "link": None, "errors": errors}}
+        with FixtureServer(_fixtures(responses)) as server:
+            async with self._client(server) as client:
+                with self.assertRaises(aiohttp.ClientResponseError) as context:
+                    await client.get(f"{server.url}/repos/owner/name")
+        self.assertEqual(context.exception.status, 403)
+        self.assertEqual(server.statistics["requests"], 1)
+
+    async def test_users_are_requested_once(self):
+        responses = {normalise_url("/users/ada"): {"body": {"login": "ada", "name": "Ada Lovelace"}, "link": None}}
+        with FixtureServer(_fixtures(responses)) as server:
+            async with self._client(server) as client:
+                users = await asyncio.gather(*(client.get_user("ada") for _ in range(3)))
+                users.append(await client.get_user("ada"))
+        self.assertTrue(all(user["name"] == "Ada Lovelace" for user in users))
+        self.assertEqual(server.statistics["requests"], 1)
+
+if __name__ == "__main__":
+    unittest.main()